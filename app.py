@@ -2,21 +2,43 @@
 # Đặt eventlet.monkey_patch() lên đầu (QUAN TRỌNG!)
 import eventlet
 eventlet.monkey_patch()
+from eventlet import tpool
 
-from flask import Flask, render_template, jsonify, url_for, request
-from flask_socketio import SocketIO
+from flask import Flask, Response, render_template, jsonify, url_for, request
+from flask.json.provider import DefaultJSONProvider
+from flask_socketio import SocketIO, join_room, leave_room, rooms as client_rooms
 import paho.mqtt.client as mqtt
 import msgpack
 import threading
-import json
+import queue
+import itertools
+import heapq
+import collections
 import time
 import base64
-import binascii
-import copy # For deep copying data
+import gzip
+import zlib
+import fnmatch
+import re
 import logging # Use logging module
 import signal # To handle graceful shutdown
 import sys
 
+from state_store import StateStore, make_topic_entry
+from payload_decoder import IMAGE_LIKE_TOPICS, DecodeProcessPool, DecodeWorkerError, LazyPayload, decode_payload
+from delta_codec import DeltaEncoder
+from history_store import HistoryStore
+from path_simplifier import PathSimplifier
+from scan_codec import ScanCodecError, ScanEncoder, is_scan
+from tracing import Tracer
+from snapshot_store import SnapshotError, SnapshotStore
+from mqtt_recorder import MqttRecorder
+from metrics import SIZE_BUCKETS, InstrumentedLock, MetricsRegistry
+import state_bus
+from ingest_partitions import PartitionFilter, PartitionSupervisor, read_control
+from green_mqtt import GreenMQTTDriver
+from image_transcoder import IMAGE_FORMATS, SUPPORTED_ENCODINGS, FrameCache, TranscodeError, size_bucket, transcode
+
 # --- Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 log = logging.getLogger('DashboardApp')
@@ -28,7 +50,23 @@ logging.getLogger('socketio').setLevel(logging.WARNING)
 # logging.getLogger('DashboardApp').setLevel(logging.DEBUG) # Uncomment for very detailed logs
 
 # --- Flask & SocketIO Setup ---
+class DashboardJSONProvider(DefaultJSONProvider):
+    """JSON provider for the HTTP endpoints: raw image buffers are returned as base64 strings."""
+    @staticmethod
+    def default(o):
+        if isinstance(o, (bytes, bytearray, memoryview)):
+            return base64.b64encode(o).decode('ascii')
+        if isinstance(o, LazyPayload):
+            return o.value() # Decoded (once) when a client actually reads it
+        return DefaultJSONProvider.default(o)
+
+def msgpack_default(o):
+    if isinstance(o, LazyPayload):
+        return o.value()
+    raise TypeError(f"Cannot serialize {type(o).__name__}")
+
 app = Flask(__name__)
+app.json = DashboardJSONProvider(app)
 # !!! THAY ĐỔI SECRET KEY CHO PRODUCTION !!!
 app.config['SECRET_KEY'] = 'a_very_secret_key_change_this_12345!'
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', logger=False, engineio_logger=False)
@@ -40,14 +78,165 @@ MQTT_PORT = int(os.environ.get('MQTT_PORT', 1883))
 MQTT_USER = os.environ.get('MQTT_USER', "alphaasimov2024")
 MQTT_PASS = os.environ.get('MQTT_PASS', "gvB3DtGfus6U")
 MQTT_LISTENER_CLIENT_ID = f"dashboard_listener_{int(time.time())}"
+if os.environ.get('DASHBOARD_ROLE') == 'partition':
+    MQTT_LISTENER_CLIENT_ID += f"_p{os.environ.get('INGEST_PARTITION', 0)}"
 MQTT_PUBLISHER_CLIENT_ID_PREFIX = "dashboard_publisher_"
 MQTT_KEEPALIVE = 60
 MQTT_RECONNECT_DELAY = 15 # seconds
+# MQTT network loop of the listener (see green_mqtt.py):
+#   green   wait on the eventlet hub until the socket is readable, drain every buffered packet,
+#           reconnect after a jittered exponential backoff of MQTT_RECONNECT_MIN..MQTT_RECONNECT_MAX s
+#   thread  paho's loop_forever, retrying every MQTT_RECONNECT_DELAY s (previous behaviour)
+MQTT_DRIVER = os.environ.get('MQTT_DRIVER', 'green')
+if MQTT_DRIVER not in ('green', 'thread'):
+    raise ValueError(f"Unknown MQTT_DRIVER '{MQTT_DRIVER}' (expected green or thread)")
+MQTT_RECONNECT_MIN = float(os.environ.get('MQTT_RECONNECT_MIN', 1.0))
+MQTT_RECONNECT_MAX = float(os.environ.get('MQTT_RECONNECT_MAX', 60.0))
+# Keep image 'data' fields as raw bytes (sent as Socket.IO binary attachments)
+# instead of expanding them into a Python list of ints. Set to "0" for the legacy list format.
+IMAGE_BINARY_TRANSPORT = os.environ.get('IMAGE_BINARY_TRANSPORT', '1') == '1'
+# Persistent command publisher: number of broker connections and max queued commands
+MQTT_PUBLISHER_POOL_SIZE = int(os.environ.get('MQTT_PUBLISHER_POOL_SIZE', 1))
+MQTT_PUBLISH_QUEUE_SIZE = int(os.environ.get('MQTT_PUBLISH_QUEUE_SIZE', 256))
+MQTT_PUBLISH_CONNECT_WAIT = 2.0 # seconds a queued command waits for a connected publisher
+
+def _parse_topic_map(spec, cast=float):
+    """Parse "topic=value,topic=value" into a dict (invalid entries are skipped)."""
+    values = {}
+    for item in spec.split(','):
+        name, _, value = item.partition('=')
+        try:
+            if name.strip():
+                values[name.strip()] = cast(value.strip())
+        except ValueError:
+            log.warning(f"Ignoring invalid topic setting '{item}'")
+    return values
+
+# Max Socket.IO emit rate per (robot, sub_topic). Newer messages replace a pending one (latest value wins).
+# 0 disables rate limiting for that topic.
+EMIT_DEFAULT_RATE_HZ = float(os.environ.get('EMIT_DEFAULT_RATE_HZ', 10))
+EMIT_TOPIC_RATES_HZ = {
+    'robot_status': 20, 'lane_follow_cmd': 10, 'scan_multi': 5,
+    'gloal_path_gps': 1, 'camera': 5, 'routed_map': 2,
+}
+EMIT_TOPIC_RATES_HZ.update(_parse_topic_map(os.environ.get('EMIT_TOPIC_RATES', '')))
+# Sub-topics broadcast to every client (status channel). All other topics only go to clients
+# subscribed to the robot or robot/sub_topic room; everyone else gets a payload-less 'topic_update'.
+# Decode pipeline: on_message only enqueues; DECODE_WORKERS threads decode. Each (robot, sub_topic)
+# queue holds at most its limit; overflow policy is 'drop_oldest', 'drop_newest' or 'never_drop' (unbounded).
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', 2))
+DECODE_QUEUE_DEFAULT_LIMIT = int(os.environ.get('DECODE_QUEUE_DEFAULT_LIMIT', 8))
+DECODE_QUEUE_LIMITS = {'camera': 2, 'routed_map': 2, 'scan_multi': 4}
+DECODE_QUEUE_LIMITS.update(_parse_topic_map(os.environ.get('DECODE_QUEUE_LIMITS', ''), int))
+DECODE_QUEUE_DEFAULT_POLICY = os.environ.get('DECODE_QUEUE_DEFAULT_POLICY', 'drop_oldest')
+DECODE_QUEUE_POLICIES = {'robot_status': 'never_drop'}
+DECODE_QUEUE_POLICIES.update(_parse_topic_map(os.environ.get('DECODE_QUEUE_POLICIES', ''), str))
+# Image payloads at least this large are decoded in separate worker processes (0 workers disables)
+DECODE_PROCESS_WORKERS = int(os.environ.get('DECODE_PROCESS_WORKERS', 1))
+DECODE_PROCESS_MIN_BYTES = int(os.environ.get('DECODE_PROCESS_MIN_BYTES', 256 * 1024))
+# Decode workers are green threads: payloads at least this large are decoded on a native thread
+# (tpool) so the hub keeps serving; smaller ones decode inline, where the hop (~80us) costs more
+DECODE_TPOOL_MIN_BYTES = int(os.environ.get('DECODE_TPOOL_MIN_BYTES', 16 * 1024))
+# /data responses larger than this are gzip/deflate compressed when the client accepts it
+DATA_COMPRESS_MIN_BYTES = int(os.environ.get('DATA_COMPRESS_MIN_BYTES', 1024))
+DATA_COMPRESS_LEVEL = int(os.environ.get('DATA_COMPRESS_LEVEL', 6))
+# Max total size of the serialized /data bodies kept between polls (least recently used evicted)
+DATA_CACHE_MAX_BYTES = int(os.environ.get('DATA_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# Max age (seconds) of the serialized metadata sent in initial_state; connects within it share one copy
+INITIAL_STATE_MAX_AGE = float(os.environ.get('INITIAL_STATE_MAX_AGE', 1.0))
+BROADCAST_SUB_TOPICS = set(filter(None, os.environ.get('BROADCAST_SUB_TOPICS', 'robot_status').split(',')))
+# Image topics are sent to clients as a /frame URL (server-side PNG/JPEG) instead of raw pixels
+IMAGE_TRANSCODE = os.environ.get('IMAGE_TRANSCODE', '1') == '1'
+FRAME_FORMATS = {'camera': 'jpeg', 'routed_map': 'png'} # Lossless for maps
+FRAME_FORMATS.update(_parse_topic_map(os.environ.get('FRAME_FORMATS', ''), str))
+FRAME_JPEG_QUALITY = int(os.environ.get('FRAME_JPEG_QUALITY', 80))
+FRAME_CACHE_MAX_BYTES = int(os.environ.get('FRAME_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# Structured topics sent as field-level patches ('mqtt_delta') with a full keyframe every DELTA_KEYFRAME_INTERVAL seconds
+DELTA_SUB_TOPICS = set(filter(None, os.environ.get('DELTA_SUB_TOPICS', 'robot_status,lane_follow_cmd').split(',')))
+DELTA_KEYFRAME_INTERVAL = float(os.environ.get('DELTA_KEYFRAME_INTERVAL', 10))
+# Topics stored as raw bytes and decoded only when a subscribed client, /data, /frame or history
+# reads them (empty = decode everything on arrival). LAZY_EAGER_FIELDS lists top-level keys that are
+# still extracted on arrival through a partial msgpack parse ("topic=key|key,..."), e.g. robot GPS.
+LAZY_DECODE_SUB_TOPICS = set(filter(None, os.environ.get('LAZY_DECODE_SUB_TOPICS', '').split(',')))
+LAZY_EAGER_FIELDS = {'robot_status': ('gps',)}
+LAZY_EAGER_FIELDS.update(_parse_topic_map(os.environ.get('LAZY_EAGER_FIELDS', ''), lambda value: tuple(filter(None, value.split('|')))))
+# GPS path topics sent to map clients as a zoom-dependent simplified polyline ('subscribe_path' /
+# 'path_update' with only the changed suffix); empty = raw payloads only
+PATH_SUB_TOPICS = set(filter(None, os.environ.get('PATH_SUB_TOPICS', 'gloal_path_gps').split(',')))
+PATH_TOLERANCE_PX = float(os.environ.get('PATH_TOLERANCE_PX', 1.5)) # Max deviation in screen pixels at the client's zoom
+PATH_CHUNK_SIZE = int(os.environ.get('PATH_CHUNK_SIZE', 256)) # Raw points per independently simplified chunk
+# LaserScan topics sent to clients as a binary 'scan_frame' (typed array + small header, see scan_codec.py)
+# instead of JSON number lists; empty = send the decoded payload. SCAN_ENCODING is 'uint16' (ranges
+# quantized to SCAN_RESOLUTION metres) or 'float32'; SCAN_DECIMATION keeps the nearest of every N beams.
+SCAN_SUB_TOPICS = set(filter(None, os.environ.get('SCAN_SUB_TOPICS', 'scan_multi').split(',')))
+SCAN_ENCODING = os.environ.get('SCAN_ENCODING', 'uint16')
+SCAN_RESOLUTION = float(os.environ.get('SCAN_RESOLUTION', 0.01)) # Metres per uint16 step (max 655 m at 0.01)
+SCAN_MAX_RANGE = float(os.environ.get('SCAN_MAX_RANGE', 0)) # Farther ranges become "no return" (0 = scan's range_max)
+SCAN_DECIMATION = int(os.environ.get('SCAN_DECIMATION', 1))
+# Teleoperation ('teleop' events): only the latest joystick command per robot is kept and republished
+# TELEOP_RATE_HZ times/s on a pooled publisher connection. Without new input for TELEOP_STALE_TIMEOUT
+# seconds the robot gets a zero-velocity stop (sent TELEOP_STOP_REPEAT times) and the stream ends.
+TELEOP_COMMAND_TYPE = os.environ.get('TELEOP_COMMAND_TYPE', 'joystick_control')
+TELEOP_RATE_HZ = float(os.environ.get('TELEOP_RATE_HZ', 20))
+TELEOP_STALE_TIMEOUT = float(os.environ.get('TELEOP_STALE_TIMEOUT', 0.5))
+TELEOP_STOP_REPEAT = int(os.environ.get('TELEOP_STOP_REPEAT', 3))
+# Message tracing: rules "robot_glob/topic_glob=N" trace 1 in N matching messages (per-stage spans and
+# events, fetched from /admin/traces); rules can be changed at runtime through /admin/trace.
+TRACE_RULES = _parse_topic_map(os.environ.get('TRACE_RULES', ''), int)
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', 1000)) # Most recent traces kept
+# Required in the X-Admin-Token header of /admin/* requests when set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# Warm start: the latest entry of every robot/topic (image frames included) is appended to this file
+# every SNAPSHOT_INTERVAL seconds when it changed, and restored on startup marked as stale until a
+# live message replaces it (see snapshot_store.py); empty = off. Only used by standalone and ingest roles.
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', '')
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', 10))
+SNAPSHOT_MAX_ENTRY_BYTES = int(os.environ.get('SNAPSHOT_MAX_ENTRY_BYTES', 16 * 1024 * 1024)) # Larger entries are not persisted
+# Append raw r2s traffic to this file (see mqtt_recorder.py for replay); empty = off
+MQTT_RECORD_PATH = os.environ.get('MQTT_RECORD_PATH', '')
+# Numeric fields of these topics are kept as a ring-buffer time series, see /history
+HISTORY_SUB_TOPICS = set(filter(None, os.environ.get('HISTORY_SUB_TOPICS', 'robot_status,lane_follow_cmd').split(',')))
+HISTORY_CAPACITY = int(os.environ.get('HISTORY_CAPACITY', 3600)) # Samples per robot/topic
+HISTORY_MAX_BYTES = int(os.environ.get('HISTORY_MAX_BYTES', 32 * 1024 * 1024))
+HISTORY_MAX_FIELDS = int(os.environ.get('HISTORY_MAX_FIELDS', 32)) # Per robot/topic
+
+# Process role: 'standalone' (default, everything in one process), 'ingest' (owns the MQTT
+# subscription and publishes updates on STATE_BUS_URL) or 'web' (mirrors state from the bus
+# and serves Socket.IO / HTTP; run several, e.g. gunicorn -k eventlet -w 4 without --preload)
+DASHBOARD_ROLE = os.environ.get('DASHBOARD_ROLE', 'standalone')
+STATE_BUS_URL = os.environ.get('STATE_BUS_URL', 'unix:///tmp/aa_dashboard_bus.sock')
+STATE_BUS_QUEUE_SIZE = int(os.environ.get('STATE_BUS_QUEUE_SIZE', 1024)) # Frames buffered per web worker
+# Partitioned ingestion (see ingest_partitions.py): with INGEST_PARTITIONS > 1 a standalone or ingest
+# process starts that many listener processes (DASHBOARD_ROLE=partition), each publishing on its own
+# INGEST_PARTITION_BUS_URL, and merges their updates. INGEST_PARTITION_MODE 'shared' splits messages
+# with the MQTT 5 shared subscription $share/<INGEST_SHARE_GROUP>/+/r2s/#, 'hash' splits robots.
+INGEST_PARTITIONS = int(os.environ.get('INGEST_PARTITIONS', 1))
+INGEST_PARTITION = int(os.environ.get('INGEST_PARTITION', 0)) # Set by the supervisor for DASHBOARD_ROLE=partition
+INGEST_PARTITION_MODE = os.environ.get('INGEST_PARTITION_MODE', 'shared')
+INGEST_SHARE_GROUP = os.environ.get('INGEST_SHARE_GROUP', 'dashboard')
+INGEST_PARTITION_BUS_URL = os.environ.get('INGEST_PARTITION_BUS_URL', 'unix:///tmp/aa_dashboard_partition_{index}.sock')
+PARTITION_HEALTH_INTERVAL = float(os.environ.get('PARTITION_HEALTH_INTERVAL', 2)) # Seconds between health checks
+PARTITION_STALL_TIMEOUT = float(os.environ.get('PARTITION_STALL_TIMEOUT', 15)) # Running but bus down this long: restart
+SERVES_CLIENTS = DASHBOARD_ROLE not in ('ingest', 'partition')
+# Several web workers without sticky sessions need websocket-only Socket.IO (no long-polling)
+SOCKETIO_TRANSPORTS = list(filter(None, os.environ.get('SOCKETIO_TRANSPORTS', 'websocket' if DASHBOARD_ROLE == 'web' else '').split(',')))
+# Seconds between 'metrics' Socket.IO pushes to clients that sent 'subscribe_metrics' (0 = off)
+METRICS_EMIT_INTERVAL = float(os.environ.get('METRICS_EMIT_INTERVAL', 5))
 
 # --- !!! DEFINE YOUR ROBOTS HERE !!! ---
 # Robot IDs should match the format: {username}_{mac_id}
-KNOWN_ROBOTS = ["embed_e6d9e2", "bulldog01_5f899b", "sim_robot_1", "sim_robot_2"]
-log.info(f"Managing known robots: {KNOWN_ROBOTS}")
+# Known robots are always listed; other robots register themselves on their first r2s message
+KNOWN_ROBOTS = os.environ.get('KNOWN_ROBOTS', "embed_e6d9e2,bulldog01_5f899b,sim_robot_1,sim_robot_2").split(',')
+ROBOT_ALLOWLIST = list(filter(None, os.environ.get('ROBOT_ALLOWLIST', '').split(','))) # fnmatch patterns, empty = any robot
+ROBOT_IDLE_TTL = float(os.environ.get('ROBOT_IDLE_TTL', 3600)) # seconds without messages before a robot is dropped (0 = never)
+ROBOT_MAX_COUNT = int(os.environ.get('ROBOT_MAX_COUNT', 1000))
+# Presence is tracked on the server: clients get 'robot_online' / 'robot_offline' when a robot's
+# messages start or stop for ROBOT_OFFLINE_AFTER seconds, and 'topic_stale' when a topic below has
+# been silent for its number of seconds (0 = not tracked).
+ROBOT_OFFLINE_AFTER = float(os.environ.get('ROBOT_OFFLINE_AFTER', 30))
+TOPIC_STALE_AFTER = {'robot_status': 10}
+TOPIC_STALE_AFTER.update(_parse_topic_map(os.environ.get('TOPIC_STALE_AFTER', '')))
+log.info(f"Managing known robots: {KNOWN_ROBOTS} (auto-register: {ROBOT_ALLOWLIST or 'any'}, idle TTL {ROBOT_IDLE_TTL}s)")
 log.info(f"MQTT Config - Host: {MQTT_HOST}:{MQTT_PORT}, User: {MQTT_USER}")
 
 # Expected sub-topics
@@ -58,38 +247,416 @@ ROBOT_SUB_TOPICS_R2S = [
 ROBOT_SUB_TOPICS_S2R = ["joystick_control", "server_cmd"]
 ALL_EXPECTED_SUB_TOPICS = list(set(ROBOT_SUB_TOPICS_R2S + ROBOT_SUB_TOPICS_S2R))
 
+# --- Metrics (Prometheus text on /metrics, see metrics.py) ---
+metrics_registry = MetricsRegistry()
+MQTT_MESSAGES = metrics_registry.counter('dashboard_mqtt_messages_total', 'MQTT r2s messages accepted', ('robot_id', 'sub_topic'))
+MQTT_PAYLOAD_BYTES = metrics_registry.histogram('dashboard_mqtt_payload_bytes', 'Raw MQTT payload size', ('sub_topic',), SIZE_BUCKETS)
+ON_MESSAGE_SECONDS = metrics_registry.histogram('dashboard_on_message_seconds', 'Time spent in the paho on_message callback')
+DECODE_SECONDS = metrics_registry.histogram('dashboard_decode_seconds', 'Payload decode time', ('sub_topic',))
+DECODE_ERRORS = metrics_registry.counter('dashboard_decode_errors_total', 'Payloads that failed to decode', ('sub_topic',))
+INGEST_LATENCY = metrics_registry.histogram('dashboard_ingest_latency_seconds', 'MQTT receive to store latency (decode queue + decode)', ('sub_topic',))
+STORE_SECONDS = metrics_registry.histogram('dashboard_store_seconds', 'Store, history and fan-out hand-off time per topic entry', ('sub_topic',))
+STORE_LOCK_WAIT = metrics_registry.histogram('dashboard_store_lock_wait_seconds', 'Wait to acquire the state store write lock')
+EMITS = metrics_registry.counter('dashboard_socketio_emits_total', 'Socket.IO messages emitted for topic updates', ('event', 'sub_topic'))
+EMIT_SECONDS = metrics_registry.histogram('dashboard_emit_seconds', 'Socket.IO emit time per topic update', ('sub_topic',))
+EMIT_LATENCY = metrics_registry.histogram('dashboard_emit_latency_seconds', 'MQTT receive to Socket.IO emit latency (includes emit rate limiting)', ('sub_topic',))
+COMMANDS = metrics_registry.counter('dashboard_commands_total', 'send_command requests by outcome', ('command_type', 'status'))
+LAZY_PAYLOADS = metrics_registry.counter('dashboard_lazy_payloads_total', 'Payloads stored undecoded / decoded on demand', ('sub_topic', 'event'))
+PUBLISH_LATENCY = metrics_registry.histogram('dashboard_publish_latency_seconds', 'Command queue to broker hand-off latency', ('command_type',))
+TELEOP_PUBLISHES = metrics_registry.counter('dashboard_teleop_publishes_total', 'Teleop frames published', ('kind', 'status'))
+TELEOP_LATENCY = metrics_registry.histogram('dashboard_teleop_latency_seconds', 'Teleop input receive to broker hand-off latency')
+
 # --- Data Storage ---
-latest_data = {}
-data_lock = threading.Lock()
+state_store = StateStore(lock=InstrumentedLock(STORE_LOCK_WAIT)) # Copy-on-write latest value per robot/topic (see state_store.py)
+mqtt_recorder = MqttRecorder(MQTT_RECORD_PATH) if MQTT_RECORD_PATH and INGEST_PARTITIONS <= 1 else None
+history_store = HistoryStore(HISTORY_CAPACITY, HISTORY_MAX_BYTES, HISTORY_MAX_FIELDS)
+tracer = Tracer(TRACE_BUFFER_SIZE)
+for _pattern, _sample in TRACE_RULES.items():
+    _robot, _, _topic = _pattern.partition('/')
+    tracer.add_rule(_robot, _topic or '*', _sample)
 mqtt_listener_thread_obj = None
 stop_event = threading.Event()
 
 # --- Initialization ---
 def initialize_robot_data():
     log.info("Initializing data structure for known robots...")
-    with data_lock:
-        for robot_id in KNOWN_ROBOTS:
-            if robot_id not in latest_data:
-                latest_data[robot_id] = {
-                    'last_seen': 0,
-                    'topics': {
-                        topic: {'payload': "waiting...", 'timestamp': 0}
-                        for topic in ALL_EXPECTED_SUB_TOPICS
-                    }
+    for robot_id in KNOWN_ROBOTS:
+        robot_registry.register(robot_id, pinned=True) # Topic slots are created on first message
+    log.info(f"Data structure initialized. Robots managed: {list(state_store.snapshot().robots.keys())}")
+
+# --- Emit Scheduler ---
+class EmitScheduler:
+    """Latest-value-wins emit coalescing per (robot_id, sub_topic).
+
+    The first message for a key inside its rate window is emitted immediately. Messages that
+    arrive before the window closes replace the pending one and are flushed by a background
+    thread when the window ends, so clients always see the newest value at most `rate` times/s.
+    """
+
+    def __init__(self, emit_func, default_rate_hz, topic_rates_hz):
+        self.emit_func = emit_func
+        self.default_rate_hz = default_rate_hz
+        self.topic_rates_hz = topic_rates_hz
+        self.pending = {} # key -> latest args not yet emitted
+        self.next_allowed = {} # key -> monotonic time of the next allowed emit
+        self.due_heap = [] # (due_time, key) for keys that have a pending value
+        self.emitted = {} # key -> emit count
+        self.coalesced = {} # key -> number of messages replaced before being emitted
+        self.cond = threading.Condition()
+        self.flusher_thread = None
+
+    def interval_for(self, sub_topic):
+        rate = self.topic_rates_hz.get(sub_topic, self.default_rate_hz)
+        return 1.0 / rate if rate > 0 else 0.0
+
+    def start(self):
+        if self.flusher_thread and self.flusher_thread.is_alive():
+            return
+        self.flusher_thread = threading.Thread(target=self._flush_loop, name="EmitSchedulerThread", daemon=True)
+        self.flusher_thread.start()
+
+    def submit(self, robot_id, sub_topic, *args):
+        key = (robot_id, sub_topic)
+        interval = self.interval_for(sub_topic)
+        now = time.monotonic()
+        with self.cond:
+            if key in self.pending:
+                self.pending[key] = args
+                self.coalesced[key] = self.coalesced.get(key, 0) + 1
+                return
+            due = self.next_allowed.get(key, 0.0)
+            if now < due:
+                self.pending[key] = args
+                heapq.heappush(self.due_heap, (due, key))
+                self.cond.notify()
+                return
+            self.next_allowed[key] = now + interval
+            self.emitted[key] = self.emitted.get(key, 0) + 1
+        self.emit_func(*args)
+
+    def _flush_loop(self):
+        while not stop_event.is_set():
+            with self.cond:
+                if not self.due_heap:
+                    self.cond.wait(timeout=1.0)
+                    continue
+                due, key = self.due_heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self.cond.wait(timeout=due - now)
+                    continue
+                heapq.heappop(self.due_heap)
+                args = self.pending.pop(key, None)
+                if args is None:
+                    continue
+                self.next_allowed[key] = now + self.interval_for(key[1])
+                self.emitted[key] = self.emitted.get(key, 0) + 1
+            try:
+                self.emit_func(*args)
+            except Exception as e:
+                log.exception(f"EmitScheduler: emit failed for {key}: {e}")
+
+    def forget_robot(self, robot_id):
+        with self.cond:
+            for table in (self.pending, self.next_allowed, self.emitted, self.coalesced):
+                for key in [key for key in table if key[0] == robot_id]:
+                    del table[key]
+
+    def stats(self):
+        with self.cond:
+            keys = set(self.emitted) | set(self.coalesced)
+            return {
+                f"{robot_id}/{sub_topic}": {
+                    'emitted': self.emitted.get((robot_id, sub_topic), 0),
+                    'coalesced': self.coalesced.get((robot_id, sub_topic), 0),
+                    'max_rate_hz': self.topic_rates_hz.get(sub_topic, self.default_rate_hz),
                 }
-    log.info(f"Data structure initialized. Robots managed: {list(latest_data.keys())}")
+                for robot_id, sub_topic in sorted(keys)
+            }
+
+def robot_room(robot_id):
+    return f"robot:{robot_id}"
+
+def topic_room(robot_id, sub_topic):
+    return f"topic:{robot_id}/{sub_topic}"
+
+def is_transcodable(payload):
+    return IMAGE_TRANSCODE and isinstance(payload, dict) and payload.get('encoding') in SUPPORTED_ENCODINGS and 'data' in payload
+
+def resolve_payload(payload):
+    """Decoded form of a stored payload: a LazyPayload is decoded on first use, anything else is returned as-is."""
+    return payload.value() if isinstance(payload, LazyPayload) else payload
+
+def resolve_entry(entry):
+    if not isinstance(entry['payload'], LazyPayload):
+        return entry
+    return make_topic_entry(entry['payload'].value(), entry['timestamp'], entry.get('size', 0), entry.get('stale', False))
+
+def has_listeners(rooms):
+    """True if a client of this process is in one of `rooms` (None: any connected client)."""
+    namespace_rooms = socketio.server.manager.rooms.get('/', {})
+    if rooms is None:
+        return bool(namespace_rooms.get(None))
+    return any(namespace_rooms.get(room) for room in rooms)
+
+def client_topic_entry(robot_id, sub_topic, entry):
+    """Topic entry as sent over Socket.IO: image pixels are replaced by a `frame_url` the browser loads,
+    scan ranges/intensities by a binary `scan_frame`."""
+    entry = resolve_entry(entry)
+    payload = entry['payload']
+    if sub_topic in SCAN_SUB_TOPICS and is_scan(payload):
+        try:
+            scan_frame = scan_encoder.frame((robot_id, sub_topic), payload, entry['timestamp'])
+        except ScanCodecError as e:
+            log.warning(f"⚠️ Cannot encode {robot_id}/{sub_topic} scan: {e}")
+            return entry
+        scan = {k: v for k, v in payload.items() if k not in ('ranges', 'intensities')}
+        scan['scan_frame'] = scan_frame
+        return make_topic_entry(scan, entry['timestamp'], entry.get('size', 0), entry.get('stale', False))
+    if not is_transcodable(payload):
+        return entry
+    frame = {k: v for k, v in payload.items() if k != 'data'}
+    frame['frame_url'] = f"/frame/{robot_id}/{sub_topic}?ts={entry['timestamp']}" # Built outside any request context
+    return make_topic_entry(frame, entry['timestamp'], entry.get('size', 0), entry.get('stale', False))
+
+delta_encoder = DeltaEncoder(DELTA_KEYFRAME_INTERVAL)
+scan_encoder = ScanEncoder(SCAN_ENCODING, SCAN_RESOLUTION, SCAN_MAX_RANGE, SCAN_DECIMATION)
+path_simplifier = PathSimplifier(PATH_TOLERANCE_PX, PATH_CHUNK_SIZE)
+
+def path_room(robot_id, sub_topic, zoom):
+    return f"path:{robot_id}/{sub_topic}@{zoom}"
+
+def active_path_zooms(robot_id, sub_topic):
+    """Zoom levels at which clients of this process follow a robot's path."""
+    prefix = path_room(robot_id, sub_topic, '')
+    return [int(room[len(prefix):]) for room, members in list(socketio.server.manager.rooms.get('/', {}).items())
+            if members and isinstance(room, str) and room.startswith(prefix)]
+
+def emit_path_updates(robot_id, sub_topic, data_to_store, robot_last_seen):
+    """Send each zoom level's path followers the simplified suffix that changed since their last update."""
+    zooms = active_path_zooms(robot_id, sub_topic)
+    if not zooms:
+        return
+    state = path_simplifier.update((robot_id, sub_topic), resolve_payload(data_to_store['payload']), data_to_store['timestamp'])
+    if state is None:
+        return
+    for zoom in zooms:
+        update = path_simplifier.diff(state, zoom)
+        if update['base_version'] == update['version']:
+            continue # The room already has this version (same entry emitted again)
+        update.update(robot_id=robot_id, sub_topic=sub_topic, zoom=zoom,
+                      timestamp=data_to_store['timestamp'], robot_last_seen=robot_last_seen)
+        EMITS.inc('path_update', sub_topic)
+        socketio.emit('path_update', update, to=path_room(robot_id, sub_topic, zoom))
+
+def emit_mqtt_data(robot_id, sub_topic, data_to_store, robot_last_seen):
+    started = time.perf_counter()
+    trace = tracer.take((robot_id, sub_topic), data_to_store['timestamp'])
+    rooms = None if sub_topic in BROADCAST_SUB_TOPICS else [robot_room(robot_id), topic_room(robot_id, sub_topic)]
+    payload = data_to_store['payload']
+    lazy = isinstance(payload, LazyPayload)
+    # A lazy payload nobody in `rooms` would receive stays undecoded; only the topic_update goes out
+    send_payload = not lazy or payload.decoded or has_listeners(rooms)
+    if send_payload and sub_topic in DELTA_SUB_TOPICS:
+        def emit_encoded(kind, seq, body):
+            EMITS.inc('mqtt_data' if kind == 'keyframe' else 'mqtt_delta', sub_topic)
+            if kind == 'keyframe':
+                socketio.emit('mqtt_data', {
+                    'robot_id': robot_id,
+                    'sub_topic': sub_topic,
+                    'data': body,
+                    'robot_last_seen': robot_last_seen,
+                    'seq': seq
+                }, to=rooms)
+            else:
+                socketio.emit('mqtt_delta', {
+                    'robot_id': robot_id,
+                    'sub_topic': sub_topic,
+                    'seq': seq,
+                    'timestamp': data_to_store['timestamp'],
+                    'size': data_to_store.get('size', 0),
+                    'set': body['set'],
+                    'unset': body['unset'],
+                    'robot_last_seen': robot_last_seen
+                }, to=rooms)
+        delta_encoder.encode((robot_id, sub_topic), client_topic_entry(robot_id, sub_topic, data_to_store), emit_encoded)
+    elif send_payload:
+        EMITS.inc('mqtt_data', sub_topic)
+        socketio.emit('mqtt_data', {
+            'robot_id': robot_id,
+            'sub_topic': sub_topic,
+            'data': client_topic_entry(robot_id, sub_topic, data_to_store), # Dict containing payload+timestamp
+            'robot_last_seen': robot_last_seen
+        }, to=rooms)
+    if rooms is not None:
+        # Heavy topics: payload only to subscribers, lightweight notice to everyone
+        update = {
+            'robot_id': robot_id,
+            'sub_topic': sub_topic,
+            'timestamp': data_to_store['timestamp'],
+            'robot_last_seen': robot_last_seen
+        }
+        if lazy and payload.fields:
+            update['fields'] = payload.fields # Eagerly extracted, e.g. robot_status GPS
+        EMITS.inc('topic_update', sub_topic)
+        socketio.emit('topic_update', update)
+    if sub_topic in PATH_SUB_TOPICS:
+        emit_path_updates(robot_id, sub_topic, data_to_store, robot_last_seen)
+    EMIT_SECONDS.observe(time.perf_counter() - started, sub_topic)
+    if not data_to_store.get('stale'): # Restored entries were received before this process started
+        EMIT_LATENCY.observe(max(0.0, time.time() - data_to_store['timestamp'] / 1000.0), sub_topic)
+    if trace:
+        trace.add_span('emit', started, payload_sent=bool(send_payload), rooms='all' if rooms is None else len(rooms))
+
+emit_scheduler = EmitScheduler(emit_mqtt_data, EMIT_DEFAULT_RATE_HZ, EMIT_TOPIC_RATES_HZ)
+
+# --- Decode Pipeline ---
+class DecodePipeline:
+    """Bounded per-(robot_id, sub_topic) queues drained by a pool of decode workers.
+
+    Keys are served round-robin and a key is never decoded by two workers at once, so
+    per-topic ordering is preserved. Workers are green threads: payloads of DECODE_TPOOL_MIN_BYTES
+    or more are decoded on a tpool thread, large image payloads in the decode process pool.
+    """
+
+    def __init__(self, handler, workers, process_pool):
+        self.handler = handler # Called with the decoded message (store stage)
+        self.workers = workers
+        self.process_pool = process_pool
+        self.queues = {} # key -> deque of (raw, received_ms, trace)
+        self.ready = collections.deque() # keys with queued items that no worker holds
+        self.busy = set() # keys currently being decoded
+        self.counters = {} # key -> {'enqueued', 'dropped', 'processed', 'max_depth'}
+        self.cond = threading.Condition()
+        self.worker_threads = []
+
+    def start(self):
+        if self.worker_threads:
+            return
+        if self.process_pool:
+            self.process_pool.start()
+        for index in range(max(1, self.workers)):
+            thread = threading.Thread(target=self._worker, name=f"DecodeWorker-{index}", daemon=True)
+            thread.start()
+            self.worker_threads.append(thread)
+
+    def stop(self):
+        with self.cond:
+            self.cond.notify_all()
+        if self.process_pool:
+            self.process_pool.stop()
+
+    def submit(self, robot_id, sub_topic, raw, received_ms, trace=None):
+        """Enqueue a raw message. Returns False if it was dropped by the overflow policy."""
+        key = (robot_id, sub_topic)
+        limit = DECODE_QUEUE_LIMITS.get(sub_topic, DECODE_QUEUE_DEFAULT_LIMIT)
+        policy = DECODE_QUEUE_POLICIES.get(sub_topic, DECODE_QUEUE_DEFAULT_POLICY)
+        with self.cond:
+            pending = self.queues.get(key)
+            if pending is None:
+                pending = self.queues[key] = collections.deque()
+                self.counters[key] = {'enqueued': 0, 'dropped': 0, 'processed': 0, 'max_depth': 0}
+            counters = self.counters[key]
+            counters['enqueued'] += 1
+            if policy != 'never_drop' and len(pending) >= limit:
+                counters['dropped'] += 1
+                if policy == 'drop_newest':
+                    if trace: trace.event("dropped by the decode queue (drop_newest, depth %s)", len(pending))
+                    return False
+                dropped_trace = pending.popleft()[2] # drop_oldest
+                if dropped_trace: dropped_trace.event("dropped by the decode queue (drop_oldest, depth %s)", len(pending))
+            pending.append((raw, received_ms, trace))
+            counters['max_depth'] = max(counters['max_depth'], len(pending))
+            if key not in self.busy and len(pending) == 1:
+                self.ready.append(key)
+                self.cond.notify()
+        return True
+
+    def _decode(self, robot_id, sub_topic, raw, trace=None):
+        if self.process_pool and sub_topic in IMAGE_LIKE_TOPICS and len(raw) >= DECODE_PROCESS_MIN_BYTES:
+            started = time.perf_counter()
+            try:
+                result = self.process_pool.decode(robot_id, sub_topic, raw, IMAGE_BINARY_TRANSPORT)
+                if trace: trace.add_span('decode', started, bytes=len(raw), process=True)
+                return result
+            except DecodeWorkerError as e:
+                if trace: trace.event("decode process failed, decoding in-thread: %s", str(e))
+        if len(raw) >= DECODE_TPOOL_MIN_BYTES:
+            if trace: trace.event("decoding on a tpool thread (%s bytes)", len(raw))
+            return tpool.execute(decode_payload, robot_id, sub_topic, raw, IMAGE_BINARY_TRANSPORT, trace)
+        return decode_payload(robot_id, sub_topic, raw, IMAGE_BINARY_TRANSPORT, trace)
+
+    def decode_on_demand(self, robot_id, sub_topic, raw):
+        """LazyPayload decoder: the same decode path (and metrics) as an eager decode."""
+        started = time.perf_counter()
+        payload, is_error_payload = self._decode(robot_id, sub_topic, raw)
+        DECODE_SECONDS.observe(time.perf_counter() - started, sub_topic)
+        LAZY_PAYLOADS.inc(sub_topic, 'decoded')
+        if is_error_payload:
+            DECODE_ERRORS.inc(sub_topic)
+        return payload, is_error_payload
+
+    def _worker(self):
+        while not stop_event.is_set():
+            with self.cond:
+                if not self.ready:
+                    self.cond.wait(timeout=1.0)
+                    continue
+                key = self.ready.popleft()
+                raw, received_ms, trace = self.queues[key].popleft()
+                self.busy.add(key)
+            robot_id, sub_topic = key
+            try:
+                if trace:
+                    trace.add_span('queue', trace.origin) # Receive to dequeue
+                if sub_topic in LAZY_DECODE_SUB_TOPICS:
+                    payload, is_error_payload = LazyPayload(robot_id, sub_topic, raw, self.decode_on_demand,
+                                                            LAZY_EAGER_FIELDS.get(sub_topic, ())), False
+                    LAZY_PAYLOADS.inc(sub_topic, 'stored')
+                    if trace: trace.event("stored undecoded: %s", payload.describe())
+                else:
+                    started = time.perf_counter()
+                    payload, is_error_payload = self._decode(robot_id, sub_topic, raw, trace)
+                    DECODE_SECONDS.observe(time.perf_counter() - started, sub_topic)
+                    if is_error_payload:
+                        DECODE_ERRORS.inc(sub_topic)
+                self.handler(robot_id, sub_topic, payload, is_error_payload, len(raw), received_ms, trace)
+            except Exception as e:
+                log.exception(f"CRITICAL error decoding {robot_id}/{sub_topic}: {e}")
+            finally:
+                with self.cond:
+                    self.busy.discard(key)
+                    self.counters[key]['processed'] += 1
+                    if self.queues[key]:
+                        self.ready.append(key)
+                        self.cond.notify()
+
+    def forget_robot(self, robot_id):
+        """Drop the idle queues and counters of a robot (keys being decoded are kept)."""
+        with self.cond:
+            for key in [key for key in self.queues if key[0] == robot_id and key not in self.busy and not self.queues[key]]:
+                del self.queues[key]
+                del self.counters[key]
+
+    def stats(self):
+        with self.cond:
+            return {
+                f"{robot_id}/{sub_topic}": dict(counters, depth=len(self.queues[(robot_id, sub_topic)]),
+                                                 policy=DECODE_QUEUE_POLICIES.get(sub_topic, DECODE_QUEUE_DEFAULT_POLICY))
+                for (robot_id, sub_topic), counters in sorted(self.counters.items())
+            }
 
 # --- MQTT Callbacks ---
-def on_connect(client, userdata, flags, rc):
+def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
         log.info("✅ MQTT Listener connected successfully.")
-        topic_to_subscribe = "+/r2s/#"
+        topic_to_subscribe = MQTT_SUBSCRIBE_TOPIC
         client.subscribe(topic_to_subscribe, qos=0)
         log.info(f"➡️ MQTT Listener subscribed to: {topic_to_subscribe}")
     else:
         log.error(f"❌ MQTT Listener connection failed. Code: {rc}. Check broker address/port/credentials.")
 
-def on_disconnect(client, userdata, rc):
+def on_disconnect(client, userdata, rc, properties=None):
     if rc != 0:
         log.warning(f"🔌 MQTT Listener unexpectedly disconnected. Code: {rc}. Reconnection will be attempted by the loop.")
 
@@ -97,13 +664,12 @@ def on_message(client, userdata, msg):
     if stop_event.is_set():
         return
 
-    payload = None
+    started = time.perf_counter()
     robot_id = "unknown"
     direction = "unknown"
     sub_topic = "unknown"
     current_time_ms = int(time.time() * 1000)
-    is_error_payload = False # Flag to indicate if payload processing resulted in an error string
-    is_target_topic = False # Flag for bulldog/routed_map
+    trace = None
 
     try:
         topic = msg.topic
@@ -116,194 +682,493 @@ def on_message(client, userdata, msg):
             direction = topic_parts[1]
             sub_topic = '/'.join(topic_parts[2:])
 
-            # --- ADDED: Check if this is the target topic for logging ---
-            if robot_id == 'bulldog01_5f899b' and sub_topic == 'routed_map':
-                is_target_topic = True
-                log.info(f"--- Processing TARGET topic: {topic} ---")
+            if direction != 'r2s':
+                return
+            if partition_filter is not None and not partition_filter.owns(robot_id):
+                return # Hash-partitioned: another partition ingests this robot
+            if not robot_registry.admit(robot_id, current_time_ms):
+                return
+            trace = tracer.start(robot_id, sub_topic, started) # None unless a trace rule samples this message
+            MQTT_MESSAGES.inc(robot_id, sub_topic)
+            MQTT_PAYLOAD_BYTES.observe(len(msg.payload), sub_topic)
+            if mqtt_recorder:
+                mqtt_recorder.write(topic, msg.payload, current_time_ms / 1000.0)
+
+            if trace:
+                trace.add_span('receive', started, bytes=len(msg.payload))
+            # Hand off to the decode pipeline; decoding must not block the paho network thread
+            decode_pipeline.submit(robot_id, sub_topic, msg.payload, current_time_ms, trace)
+            ON_MESSAGE_SECONDS.observe(time.perf_counter() - started)
+
+    except Exception as e:
+        log.exception(f"CRITICAL error in on_message processing topic {getattr(msg, 'topic', 'unknown')}: {e}")
+        if trace: trace.event("on_message error: %s", str(e))
+
+def store_decoded_message(robot_id, sub_topic, payload, is_error_payload, size, received_ms, trace=None):
+    """Store stage of the ingest pipeline: publish the decoded payload to the state store and emit it."""
+    # --- Data Storage & Emission ---
+    if payload is None: # Should not happen with current logic, but safety check
+        log.error(f"CRITICAL: Payload is None before storage for {robot_id}/{sub_topic}!")
+        return
 
-            if direction != 'r2s' or robot_id not in KNOWN_ROBOTS:
+    data_to_store = make_topic_entry(payload, received_ms, size) # Immutable, shared by store and emit
+
+    INGEST_LATENCY.observe(max(0.0, time.time() - received_ms / 1000.0), sub_topic)
+    if trace:
+        if is_error_payload:
+            trace.event("stored error payload: %s", payload)
+        if SERVES_CLIENTS:
+            tracer.hand_off((robot_id, sub_topic), received_ms, trace) # Picked up by emit_mqtt_data unless coalesced
+        started = time.perf_counter()
+    commit_topic_entry(robot_id, sub_topic, data_to_store)
+    if trace:
+        trace.add_span('store', started)
+        if trace.log:
+            log.info("🔎 %s", trace)
+    # log.debug(f"Processed: {robot_id}/{sub_topic}")
+
+def commit_topic_entry(robot_id, sub_topic, data_to_store):
+    """Store a topic entry, record its history and fan it out (state bus and/or local clients)."""
+    # Store (copy-on-write swap, no deep copy) and emit
+    started = time.perf_counter()
+    if state_store.update_topic(robot_id, sub_topic, data_to_store) is None:
+        log.error(f"CRITICAL: Attempted to store data for {robot_id} which is not in the state store!")
+        return
+    if sub_topic in HISTORY_SUB_TOPICS: # Error strings carry no numeric fields and are skipped
+        history_store.record(robot_id, sub_topic, data_to_store['timestamp'], resolve_payload(data_to_store['payload']))
+    if state_bus_server:
+        state_bus_server.publish(['topic', robot_id, sub_topic, data_to_store])
+    if SERVES_CLIENTS: # Ingest and partition processes have no Socket.IO clients
+        presence_tracker.seen(robot_id, sub_topic, data_to_store['timestamp'])
+        record = state_store.get_robot(robot_id)
+        last_seen = record['last_seen'] if record else data_to_store['timestamp'] # Not moved back by a late message
+        emit_scheduler.submit(robot_id, sub_topic, robot_id, sub_topic, data_to_store, last_seen)
+    STORE_SECONDS.observe(time.perf_counter() - started, sub_topic)
+
+decode_pipeline = DecodePipeline(store_decoded_message, DECODE_WORKERS,
+                                 DecodeProcessPool(DECODE_PROCESS_WORKERS) if DECODE_PROCESS_WORKERS > 0 else None)
+
+# --- Robot Registry ---
+class RobotRegistry:
+    """Robots currently managed by the dashboard.
+
+    Pinned robots (KNOWN_ROBOTS) are always present. Any other robot matching the allowlist
+    is registered on its first r2s message and evicted after `idle_ttl` seconds of silence.
+    Membership is a dict lookup, so the per-message cost stays flat as the fleet grows.
+    """
+
+    REJECTED_CACHE_SIZE = 10000
+
+    def __init__(self, allow_patterns, idle_ttl, max_robots):
+        self.allow_regex = re.compile('|'.join(fnmatch.translate(p) for p in allow_patterns)) if allow_patterns else None
+        self.idle_ttl = idle_ttl
+        self.max_robots = max_robots
+        self.registered_at = {} # robot_id -> ms
+        self.pinned = set()
+        self.rejected = {} # robot_id -> messages dropped by the allowlist
+        self.over_capacity = 0 # messages dropped because max_robots was reached
+        self.rejected_uncached = 0 # allowlist rejections after the rejected cache filled up
+        self.lock = threading.Lock()
+        self.sweeper_thread = None
+
+    def is_known(self, robot_id):
+        return isinstance(robot_id, str) and robot_id in self.registered_at # Client-supplied ids may be any JSON value
+
+    def robot_ids(self):
+        return sorted(self.registered_at)
+
+    def admit(self, robot_id, now_ms):
+        """True if messages from robot_id should be processed, registering it if needed."""
+        if robot_id in self.registered_at:
+            return True
+        if robot_id in self.rejected:
+            self.rejected[robot_id] += 1
+            return False
+        if self.allow_regex is not None and not self.allow_regex.match(robot_id):
+            if len(self.rejected) < self.REJECTED_CACHE_SIZE:
+                self.rejected[robot_id] = 1
+                log.warning(f"Ignoring robot '{robot_id}': not in ROBOT_ALLOWLIST")
+            else: # Unknown ids past the cache are only counted, so a misbehaving publisher cannot flood the log
+                if not self.rejected_uncached:
+                    log.warning(f"Rejected robot cache is full ({self.REJECTED_CACHE_SIZE}); further ids outside ROBOT_ALLOWLIST are dropped without logging")
+                self.rejected_uncached += 1
+            return False
+        if len(self.registered_at) >= self.max_robots:
+            self.over_capacity += 1
+            return False
+        self.register(robot_id, now_ms)
+        return True
+
+    def register(self, robot_id, now_ms=None, pinned=False):
+        with self.lock:
+            if pinned:
+                self.pinned.add(robot_id)
+            if robot_id in self.registered_at:
                 return
+            state_store.ensure_robot(robot_id)
+            self.registered_at[robot_id] = now_ms if now_ms is not None else int(time.time() * 1000)
+        if not pinned:
+            log.info(f"🤖 Registered new robot: {robot_id}")
+        if state_bus_server:
+            state_bus_server.publish(['robot_added', robot_id])
+        socketio.emit('robot_added', {'robot_id': robot_id})
 
-            # --- Payload Decoding ---
-            try:
-                payload = msgpack.unpackb(msg.payload, raw=False)
-                if is_target_topic:
-                    log.info(f"✅ TARGET Decoded (msgpack): Payload type={type(payload)}")
-                    # --- ADDED: Log structure if it's a dict ---
-                    if isinstance(payload, dict):
-                        log.info(f"   Payload Keys: {list(payload.keys())}")
-                        if 'data' in payload:
-                            log.info(f"   Initial 'data' field type: {type(payload['data']).__name__}, Len/Val: {str(payload['data'])[:100]}...") # Show first 100 chars/bytes
-                        else:
-                            log.info("   'data' field MISSING initially.")
-                    elif isinstance(payload, list):
-                         log.info(f"   Payload is a list, length: {len(payload)}")
-                    else:
-                         log.info(f"   Payload value (partial): {str(payload)[:100]}...")
-
-
-            except (msgpack.exceptions.UnpackException, msgpack.exceptions.ExtraData) as e_mp:
-                if is_target_topic: log.warning(f"⚠️ TARGET Not msgpack: {e_mp}")
-                try:
-                    payload_str = msg.payload.decode('utf-8')
-                    if payload_str.strip().startswith(('{', '[')):
-                        payload = json.loads(payload_str)
-                        if is_target_topic:
-                            log.info(f"✅ TARGET Decoded (JSON): Payload type={type(payload)}")
-                            if isinstance(payload, dict):
-                                log.info(f"   Payload Keys: {list(payload.keys())}")
-                                if 'data' in payload:
-                                    log.info(f"   Initial 'data' field type: {type(payload['data']).__name__}, Len/Val: {str(payload['data'])[:100]}...")
-                                else:
-                                     log.info("   'data' field MISSING initially.")
-                            elif isinstance(payload, list):
-                                 log.info(f"   Payload is a list, length: {len(payload)}")
-                            else:
-                                log.info(f"   Payload value (partial): {str(payload)[:100]}...")
-                    else:
-                        payload = payload_str # Keep as string if not JSON
-                        if is_target_topic:
-                             log.info(f"✅ TARGET Decoded (UTF-8 String): Payload is string. Value (partial): {payload[:100]}...")
-
-                except Exception as e_decode:
-                    payload = f"Error: Cannot decode payload (not msgpack/json/utf8)"
-                    log.warning(f"DecodeErr: {robot_id}/{sub_topic}: {e_decode}. Payload: {msg.payload[:60]}...")
-                    if is_target_topic: log.error(f"❌ TARGET Decode FAILED.")
-                    is_error_payload = True
-            except Exception as e_unpack:
-                 payload = f"Error: Failed to unpack msgpack payload"
-                 log.error(f"UnpackErr: {robot_id}/{sub_topic}: {e_unpack}")
-                 if is_target_topic: log.error(f"❌ TARGET Msgpack Unpack FAILED: {e_unpack}")
-                 is_error_payload = True
-
-            # --- Image Data Handling (More Robust) ---
-            image_like_topics = ['routed_map', 'camera']
-            if sub_topic in image_like_topics and not is_error_payload: # Only process if initial decode worked
-                if is_target_topic: log.info(f"--- TARGET: Entering Image Handling ---")
-                # Check if payload looks like a ROS Image message structure
-                if isinstance(payload, dict) and all(k in payload for k in ['width', 'height', 'encoding', 'data']):
-                    data_field = payload.get('data')
-                    original_data_type = type(data_field)
-                    converted_data = None
-                    if is_target_topic: log.info(f"   Image structure OK. Initial 'data' type: {original_data_type.__name__}")
-
-                    try:
-                        if isinstance(data_field, bytes):
-                            converted_data = list(data_field)
-                            if is_target_topic: log.info(f"   Converted bytes -> list (len={len(converted_data)})")
-                        elif isinstance(data_field, str):
-                            try:
-                                decoded_bytes = base64.b64decode(data_field, validate=True)
-                                converted_data = list(decoded_bytes)
-                                if is_target_topic: log.info(f"   Converted base64 string -> list (len={len(converted_data)})")
-                            except (binascii.Error, ValueError) as e_b64:
-                                payload = f"Error: Invalid Base64 data in image"
-                                log.warning(f"ImgConvErrB64: {robot_id}/{sub_topic}: {e_b64}")
-                                if is_target_topic: log.error(f"   ❌ TARGET Base64 decode FAILED: {e_b64}")
-                                is_error_payload = True
-                        elif isinstance(data_field, list):
-                            converted_data = data_field # Use as is
-                            if is_target_topic: log.info(f"   Data already a list (len={len(converted_data)}). Using as is.")
-                        elif isinstance(data_field, tuple):
-                            converted_data = list(data_field) # Convert tuple to list
-                            if is_target_topic: log.info(f"   Converted tuple -> list (len={len(converted_data)})")
-                        else:
-                            payload = f"Error: Unexpected data type '{original_data_type.__name__}' in image data field"
-                            log.warning(f"ImgConvErrType: {robot_id}/{sub_topic} - Unexpected type: {original_data_type}")
-                            if is_target_topic: log.error(f"   ❌ TARGET Unexpected data type: {original_data_type.__name__}")
-                            is_error_payload = True
-
-                        # If conversion was successful, update the payload
-                        if converted_data is not None and not is_error_payload:
-                            payload['data'] = converted_data
-                            if is_target_topic: log.info(f"   ✅ TARGET Image data successfully set to list.")
-                        elif is_error_payload and is_target_topic:
-                             log.error(f"   ❌ TARGET Image data conversion resulted in error. Payload set to error string.")
-
-
-                    except Exception as e_conv:
-                         payload = f"Error: Exception during image data conversion"
-                         log.error(f"ImgConvErrGeneric: {robot_id}/{sub_topic}: {e_conv}")
-                         if is_target_topic: log.error(f"   ❌ TARGET Generic conversion exception: {e_conv}")
-                         is_error_payload = True
-
-                elif isinstance(payload, dict): # Is a dict, but NOT the expected structure
-                     payload = f"Error: Image message structure incorrect (missing keys?)"
-                     log.warning(f"ImgStructErr: {robot_id}/{sub_topic} - Keys: {list(payload.keys())}")
-                     if is_target_topic: log.error(f"   ❌ TARGET Image structure incorrect. Keys: {list(payload.keys())}")
-                     is_error_payload = True
-                elif is_target_topic: # Not a dict, not an image structure we handle
-                    log.warning(f"   Payload is not a dict, cannot process as standard image structure. Type: {type(payload).__name__}")
-                if is_target_topic: log.info(f"--- TARGET: Exiting Image Handling ---")
-
-
-            # --- Data Storage & Emission ---
-            if payload is None: # Should not happen with current logic, but safety check
-                if is_target_topic: log.error("CRITICAL: Payload is None before storage!")
+    def remove(self, robot_id):
+        with self.lock:
+            if self.registered_at.pop(robot_id, None) is None:
                 return
+            state_store.remove_robot(robot_id)
+        emit_scheduler.forget_robot(robot_id)
+        decode_pipeline.forget_robot(robot_id)
+        delta_encoder.forget_robot(robot_id)
+        path_simplifier.forget_robot(robot_id)
+        data_response_cache.forget_robot(robot_id)
+        scan_encoder.forget_robot(robot_id)
+        tracer.forget_robot(robot_id)
+        presence_tracker.forget_robot(robot_id)
+        history_store.remove_robot(robot_id)
+        metrics_registry.remove(robot_id=robot_id)
+        log.info(f"🗑️ Removed idle robot: {robot_id}")
+        if state_bus_server:
+            state_bus_server.publish(['robot_removed', robot_id])
+        socketio.emit('robot_removed', {'robot_id': robot_id})
+
+    def start(self):
+        if self.idle_ttl <= 0 or (self.sweeper_thread and self.sweeper_thread.is_alive()):
+            return
+        self.sweeper_thread = threading.Thread(target=self._sweep_loop, name="RobotRegistrySweeper", daemon=True)
+        self.sweeper_thread.start()
 
-            data_to_store = {'payload': payload, 'timestamp': current_time_ms}
-
-            # --- ADDED: Log final payload before sending to frontend ---
-            if is_target_topic:
-                 final_payload_type = type(payload)
-                 final_data_field_type = "N/A"
-                 final_data_field_len = "N/A"
-                 if isinstance(payload, dict) and 'data' in payload:
-                     final_data_field_type = type(payload['data']).__name__
-                     if hasattr(payload['data'], '__len__'):
-                        final_data_field_len = len(payload['data'])
-                 log.info(f"--- TARGET: Final Check Before Emit ---")
-                 log.info(f"   Final Payload Type: {final_payload_type.__name__}")
-                 if isinstance(payload, dict):
-                     log.info(f"   Final Keys: {list(payload.keys())}")
-                     log.info(f"   Final 'data' field Type: {final_data_field_type}")
-                     log.info(f"   Final 'data' field Len: {final_data_field_len}")
-                     log.info(f"   Other fields: w={payload.get('width')}, h={payload.get('height')}, enc={payload.get('encoding')}")
-                 elif isinstance(payload, str) and is_error_payload:
-                      log.info(f"   Final Payload is ERROR string: {payload}")
-                 else:
-                      log.info(f"   Final Payload value (partial): {str(payload)[:100]}...")
-                 log.info(f"   Is Error Payload Flag: {is_error_payload}")
-                 log.info(f"---------------------------------------")
-
-
-            # Lock and store/emit
-            with data_lock:
-                if robot_id in latest_data:
-                    if 'topics' not in latest_data[robot_id]: latest_data[robot_id]['topics'] = {}
-                    latest_data[robot_id]['topics'][sub_topic] = copy.deepcopy(data_to_store) # Deep copy stored data
-                    latest_data[robot_id]['last_seen'] = current_time_ms
+    def _sweep_loop(self):
+        interval = max(1.0, min(30.0, self.idle_ttl / 4))
+        while not stop_event.wait(interval):
+            self.sweep()
+
+    def sweep(self, now_ms=None):
+        """Evict non-pinned robots idle for longer than the TTL."""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        robots = state_store.snapshot().robots
+        for robot_id, registered_at in list(self.registered_at.items()):
+            if robot_id in self.pinned:
+                continue
+            record = robots.get(robot_id)
+            last_activity = max(registered_at, record['last_seen'] if record else 0)
+            if now_ms - last_activity > self.idle_ttl * 1000:
+                self.remove(robot_id)
+
+    def stats(self):
+        return {
+            'robots': len(self.registered_at),
+            'pinned': sorted(self.pinned),
+            'max_robots': self.max_robots,
+            'idle_ttl_s': self.idle_ttl,
+            'over_capacity_dropped': self.over_capacity,
+            'rejected_uncached': self.rejected_uncached,
+            'rejected': dict(self.rejected),
+        }
+
+robot_registry = RobotRegistry(ROBOT_ALLOWLIST, ROBOT_IDLE_TTL, ROBOT_MAX_COUNT)
+
+# --- Robot Presence ---
+class PresenceTracker:
+    """Online/offline status per robot and staleness per watched topic, pushed to clients as transitions.
+
+    A message only records its timestamp as the key's last-seen time. Each tracked key
+    (robot_id, None) or (robot_id, sub_topic) has at most one deadline in a heap; when it
+    comes due the key is rescheduled if it was seen since, otherwise it times out. A message
+    costs O(1), a deadline O(log n), and nothing is emitted while the status stays the same.
+    """
+
+    def __init__(self, emit_func, offline_after, topic_stale_after):
+        self.emit_func = emit_func
+        self.offline_after = offline_after
+        self.topic_stale_after = {sub_topic: after for sub_topic, after in topic_stale_after.items() if after > 0}
+        self.last_seen = {} # key -> ms
+        self.online = set() # robot_ids
+        self.stale = set() # (robot_id, sub_topic) keys that timed out
+        self.scheduled = {} # key -> sequence number of its live heap entry
+        self.deadlines = [] # (deadline ms, sequence, key)
+        self.transitions = 0
+        self.cond = threading.Condition()
+        self._sequence = itertools.count()
+        self.checker_thread = None
+
+    def timeout_for(self, key):
+        return self.offline_after if key[1] is None else self.topic_stale_after[key[1]]
+
+    def start(self):
+        if self.checker_thread and self.checker_thread.is_alive():
+            return
+        self.checker_thread = threading.Thread(target=self._check_loop, name="PresenceThread", daemon=True)
+        self.checker_thread.start()
+
+    def seen(self, robot_id, sub_topic, timestamp_ms):
+        """Record a message received at `timestamp_ms` (wall clock). Old timestamps never bring a key back."""
+        events = []
+        now_ms = time.time() * 1000
+        with self.cond:
+            self._touch((robot_id, None), timestamp_ms, now_ms, events)
+            if sub_topic in self.topic_stale_after:
+                self._touch((robot_id, sub_topic), timestamp_ms, now_ms, events)
+        for event in events:
+            self.emit_func(*event)
+
+    def _touch(self, key, timestamp_ms, now_ms, events):
+        if timestamp_ms <= self.last_seen.get(key, 0):
+            return
+        self.last_seen[key] = timestamp_ms
+        deadline = timestamp_ms + self.timeout_for(key) * 1000
+        if deadline <= now_ms:
+            return
+        robot_id, sub_topic = key
+        if sub_topic is None and robot_id not in self.online:
+            self.online.add(robot_id)
+            self.transitions += 1
+            events.append(('robot_online', {'robot_id': robot_id, 'last_seen': timestamp_ms}))
+        elif key in self.stale:
+            self.stale.discard(key)
+            self.transitions += 1
+            events.append(('topic_stale', {'robot_id': robot_id, 'sub_topic': sub_topic, 'stale': False, 'timestamp': timestamp_ms}))
+        if key not in self.scheduled:
+            self._schedule(key, deadline)
+
+    def _schedule(self, key, deadline):
+        sequence = next(self._sequence)
+        self.scheduled[key] = sequence
+        heapq.heappush(self.deadlines, (deadline, sequence, key))
+        self.cond.notify()
+
+    def _check_loop(self):
+        while not stop_event.is_set():
+            events = []
+            with self.cond:
+                if not self.deadlines:
+                    self.cond.wait(timeout=1.0)
+                    continue
+                now_ms = time.time() * 1000
+                deadline, sequence, key = self.deadlines[0]
+                if deadline > now_ms:
+                    self.cond.wait(timeout=min(1.0, (deadline - now_ms) / 1000))
+                    continue
+                heapq.heappop(self.deadlines)
+                if self.scheduled.get(key) != sequence:
+                    continue # Forgotten or rescheduled
+                due = self.last_seen[key] + self.timeout_for(key) * 1000
+                if due > now_ms:
+                    self._schedule(key, due) # Seen since this deadline was set
+                    continue
+                del self.scheduled[key]
+                robot_id, sub_topic = key
+                self.transitions += 1
+                if sub_topic is None:
+                    self.online.discard(robot_id)
+                    events.append(('robot_offline', {'robot_id': robot_id, 'last_seen': self.last_seen[key]}))
                 else:
-                    log.error(f"CRITICAL: Attempted to store data for {robot_id} which is not in latest_data structure!")
-                    return
-
-            # Use the original data_to_store for emit (avoids deep copying cost again)
-            socketio.emit('mqtt_data', {
-                'robot_id': robot_id,
-                'sub_topic': sub_topic,
-                'data': data_to_store, # Send the original dict containing payload+timestamp
-                'robot_last_seen': current_time_ms
-            })
-            # log.debug(f"Processed: {robot_id}/{sub_topic}")
+                    self.stale.add(key)
+                    events.append(('topic_stale', {'robot_id': robot_id, 'sub_topic': sub_topic, 'stale': True, 'timestamp': self.last_seen[key]}))
+            for event in events:
+                try:
+                    self.emit_func(*event)
+                except Exception as e:
+                    log.exception(f"PresenceTracker: emit failed for {key}: {e}")
+
+    def status(self, robot_id, last_seen):
+        """'online', 'offline' (seen before, not within the timeout) or 'waiting' (never seen)."""
+        if robot_id in self.online:
+            return 'online'
+        return 'offline' if last_seen > 0 else 'waiting'
+
+    def stale_topics(self, robot_id):
+        return sorted(sub_topic for rid, sub_topic in list(self.stale) if rid == robot_id)
+
+    def forget_robot(self, robot_id):
+        with self.cond:
+            self.online.discard(robot_id)
+            for table in (self.last_seen, self.scheduled):
+                for key in [key for key in table if key[0] == robot_id]:
+                    del table[key]
+            self.stale = {key for key in self.stale if key[0] != robot_id}
+
+    def stats(self):
+        with self.cond:
+            return {
+                'online': sorted(self.online),
+                'stale_topics': sorted(f"{robot_id}/{sub_topic}" for robot_id, sub_topic in self.stale),
+                'tracked_keys': len(self.scheduled),
+                'heap_size': len(self.deadlines),
+                'transitions': self.transitions,
+                'offline_after_s': self.offline_after,
+                'topic_stale_after_s': self.topic_stale_after,
+            }
+
+presence_tracker = PresenceTracker(socketio.emit, ROBOT_OFFLINE_AFTER, TOPIC_STALE_AFTER)
+
+# --- Warm Start Snapshots ---
+# File writes run in tpool; packing (which may decode payloads) and the store lock stay on the hub
+snapshot_store = SnapshotStore(SNAPSHOT_PATH, io_executor=tpool.execute) if SNAPSHOT_PATH and DASHBOARD_ROLE in ('standalone', 'ingest') else None
+
+def restore_snapshot():
+    """Seed the store with the last persisted entries, marked stale. Only headers are read here;
+    payloads stay in the file map until a client asks for them."""
+    started = time.perf_counter()
+    try:
+        records = snapshot_store.load(decode_pipeline.decode_on_demand)
+    except (OSError, SnapshotError) as e:
+        log.error(f"💾 Cannot load snapshot {SNAPSHOT_PATH}: {e}. Starting empty.")
+        return
+    now_ms = int(time.time() * 1000)
+    restored = 0
+    for robot_id, sub_topic, timestamp, size, payload in sorted(records, key=lambda record: record[2]):
+        if robot_registry.admit(robot_id, now_ms): # Unheard robots are evicted again after ROBOT_IDLE_TTL
+            state_store.update_topic(robot_id, sub_topic, make_topic_entry(payload, timestamp, size, stale=True))
+            restored += 1
+    log.info(f"💾 Restored {restored} entries from {SNAPSHOT_PATH} in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+def write_snapshot():
+    """Append the entries that changed since the last call; compact the file when it has grown."""
+    robots = state_store.snapshot().robots
+    changed = []
+    for robot_id, record in robots.items():
+        for sub_topic, entry in record['topics'].items():
+            timestamp = entry['timestamp']
+            if timestamp <= 0 or entry.get('size', 0) > SNAPSHOT_MAX_ENTRY_BYTES:
+                continue
+            if snapshot_store.persisted_timestamp(robot_id, sub_topic) != timestamp:
+                changed.append((robot_id, sub_topic, timestamp, entry.get('size', 0), entry['payload']))
+    snapshot_store.forget([key for key in list(snapshot_store.live) if key[0] not in robots])
+    try:
+        if changed:
+            snapshot_store.append(changed)
+        if snapshot_store.needs_compaction():
+            snapshot_store.compact()
+    except OSError as e:
+        log.error(f"💾 Snapshot write to {SNAPSHOT_PATH} failed: {e}")
+
+def snapshot_loop():
+    while not stop_event.wait(SNAPSHOT_INTERVAL):
+        write_snapshot()
+
+# --- State Bus (multi-process fan-out) ---
+def adopt_bus_payload(payload):
+    """Undecoded payloads from the ingest process decode through this process's pipeline."""
+    if isinstance(payload, LazyPayload):
+        payload.decoder = decode_pipeline.decode_on_demand
+    return payload
+
+def apply_bus_message(message):
+    """Web role: mirror one message from the ingest process into this worker's state."""
+    kind = message[0]
+    if kind == 'topic':
+        _, robot_id, sub_topic, entry = message
+        if not robot_registry.is_known(robot_id):
+            robot_registry.register(robot_id, entry['timestamp'])
+        commit_topic_entry(robot_id, sub_topic, make_topic_entry(adopt_bus_payload(entry['payload']), entry['timestamp'], entry.get('size', 0), entry.get('stale', False)))
+    elif kind == 'robot_added':
+        robot_registry.register(message[1])
+    elif kind == 'robot_removed':
+        robot_registry.remove(message[1])
+    elif kind == 'snapshot':
+        robots = message[1]
+        for robot_id in robot_registry.robot_ids():
+            if robot_id not in robots and robot_id not in robot_registry.pinned:
+                robot_registry.remove(robot_id)
+        for robot_id, record in robots.items():
+            robot_registry.register(robot_id)
+            # Oldest first so last_seen ends on the newest entry; not emitted, clients fetch on demand
+            for sub_topic, entry in sorted(record['topics'].items(), key=lambda item: item[1]['timestamp']):
+                if entry['timestamp'] > 0:
+                    state_store.update_topic(robot_id, sub_topic, make_topic_entry(adopt_bus_payload(entry['payload']), entry['timestamp'], entry.get('size', 0), entry.get('stale', False)))
+                    if not entry.get('stale'): # Restored from a snapshot: says nothing about presence
+                        presence_tracker.seen(robot_id, sub_topic, entry['timestamp'])
+        log.info(f"🔀 State bus snapshot applied: {len(robots)} robots")
+
+state_bus_server = None
+state_bus_subscriber = None
+if DASHBOARD_ROLE in ('ingest', 'partition'):
+    state_bus_server = state_bus.create_server(STATE_BUS_URL, lambda: ['snapshot', state_store.snapshot().robots], queue_size=STATE_BUS_QUEUE_SIZE)
+elif DASHBOARD_ROLE == 'web':
+    state_bus_subscriber = state_bus.create_subscriber(STATE_BUS_URL, apply_bus_message)
+
+# --- Ingest Partitions ---
+def apply_partition_message(index, message):
+    """Supervisor: merge one message from partition `index` into this process's state.
+
+    Robots are evicted by this process's own registry, never by a partition. With shared
+    subscriptions a robot's messages are spread over partitions, so an entry older than the
+    stored one (overtaken through another partition) is dropped.
+    """
+    kind = message[0]
+    if kind == 'topic':
+        _, robot_id, sub_topic, entry = message
+        merge_partition_entry(robot_id, sub_topic, entry)
+    elif kind == 'robot_added':
+        robot_registry.admit(message[1], int(time.time() * 1000))
+    elif kind == 'snapshot':
+        robots = message[1]
+        for robot_id, record in robots.items():
+            for sub_topic, entry in sorted(record['topics'].items(), key=lambda item: item[1]['timestamp']):
+                if entry['timestamp'] > 0:
+                    merge_partition_entry(robot_id, sub_topic, entry)
+        log.info(f"🧩 Partition {index} snapshot merged: {len(robots)} robots")
+
+def merge_partition_entry(robot_id, sub_topic, entry):
+    if not robot_registry.admit(robot_id, entry['timestamp']):
+        return
+    stored = state_store.get_robot(robot_id)
+    stored = stored['topics'].get(sub_topic) if stored else None
+    if stored is not None and stored['timestamp'] >= entry['timestamp']:
+        return
+    commit_topic_entry(robot_id, sub_topic, make_topic_entry(adopt_bus_payload(entry['payload']), entry['timestamp'], entry.get('size', 0), entry.get('stale', False)))
+
+def partition_control_loop():
+    """Partition: apply control frames from the supervisor; stop when it goes away."""
+    while not stop_event.is_set():
+        message = tpool.execute(read_control, sys.stdin.buffer) # Blocking pipe read off the hub
+        if message is None:
+            log.warning(f"🧩 Partition {INGEST_PARTITION}: supervisor closed the control pipe; stopping")
+            signal_handler(signal.SIGTERM, None)
+            return
+        if message[0] == 'live' and partition_filter is not None:
+            partition_filter.set_live(message[1])
+            log.info(f"🧩 Partition {INGEST_PARTITION}: live partitions {message[1]}")
+
+partition_filter = None
+partition_supervisor = None
+MQTT_PROTOCOL = mqtt.MQTTv311
+MQTT_SUBSCRIBE_TOPIC = "+/r2s/#"
+if DASHBOARD_ROLE == 'partition':
+    if INGEST_PARTITION_MODE == 'shared':
+        MQTT_PROTOCOL = mqtt.MQTTv5
+        MQTT_SUBSCRIBE_TOPIC = f"$share/{INGEST_SHARE_GROUP}/+/r2s/#"
+    else:
+        partition_filter = PartitionFilter(INGEST_PARTITION, INGEST_PARTITIONS)
+elif INGEST_PARTITIONS > 1 and DASHBOARD_ROLE != 'web':
+    partition_supervisor = PartitionSupervisor(INGEST_PARTITIONS, INGEST_PARTITION_BUS_URL, apply_partition_message,
+                                               INGEST_PARTITION_MODE, script=os.path.abspath(__file__),
+                                               health_interval=PARTITION_HEALTH_INTERVAL, stall_timeout=PARTITION_STALL_TIMEOUT)
 
-    except Exception as e:
-        log.exception(f"CRITICAL error in on_message processing topic {getattr(msg, 'topic', 'unknown')}: {e}")
-        if is_target_topic: log.error(f"--- TARGET: CRITICAL error in on_message: {e} ---")
 
 # --- MQTT Listener Thread ---
+def make_listener_client():
+    """A configured, unconnected listener client (a new one for every connection attempt)."""
+    if MQTT_PROTOCOL == mqtt.MQTTv5: # Shared subscriptions; MQTT 5 has no clean_session flag
+        listener_client = mqtt.Client(client_id=MQTT_LISTENER_CLIENT_ID, protocol=mqtt.MQTTv5)
+    else:
+        listener_client = mqtt.Client(client_id=MQTT_LISTENER_CLIENT_ID, protocol=mqtt.MQTTv311, clean_session=True)
+    listener_client.username_pw_set(MQTT_USER, MQTT_PASS)
+    listener_client.on_connect = on_connect
+    listener_client.on_message = on_message
+    listener_client.on_disconnect = on_disconnect
+    return listener_client
+
 # (Giữ nguyên phần còn lại của mqtt_listener_thread_func)
 def mqtt_listener_thread_func():
-    """Function containing the MQTT listener loop."""
+    """Function containing the MQTT listener loop (MQTT_DRIVER=thread)."""
     listener_client = None
     log.info("MQTT Listener thread started.")
     while not stop_event.is_set():
         try:
-            listener_client = mqtt.Client(client_id=MQTT_LISTENER_CLIENT_ID, protocol=mqtt.MQTTv311, clean_session=True)
-            listener_client.username_pw_set(MQTT_USER, MQTT_PASS)
-            listener_client.on_connect = on_connect
-            listener_client.on_message = on_message
-            listener_client.on_disconnect = on_disconnect
+            listener_client = make_listener_client()
 
             log.info(f"MQTT Listener: Attempting connection to {MQTT_HOST}:{MQTT_PORT}...")
             listener_client.connect(MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE)
@@ -326,44 +1191,753 @@ def mqtt_listener_thread_func():
 
     log.info("MQTT Listener thread finished.")
 
+mqtt_listener_driver = GreenMQTTDriver(make_listener_client, MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE, stop_event,
+                                       MQTT_RECONNECT_MIN, MQTT_RECONNECT_MAX) if MQTT_DRIVER == 'green' else None
+
+
+# --- MQTT Command Publisher ---
+def command_label(command_type):
+    """Metrics label for a client-supplied command type (bounded to the known s2r topics)."""
+    return command_type if command_type in ROBOT_SUB_TOPICS_S2R else 'other'
+
+class MQTTPublisher:
+    """Long-lived pool of authenticated publisher connections fed by a non-blocking queue.
+
+    Each pooled client runs its own paho network loop and reconnects in the background.
+    A worker drains the queue, publishes on the next connected client (round-robin) and
+    reports the publish latency back to the requesting Socket.IO client via 'command_feedback'.
+    """
+
+    def __init__(self, pool_size, queue_size):
+        self.pool_size = max(1, pool_size)
+        self.clients = []
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = {} # (client_index, mid) -> command info, waiting for on_publish
+        self.early_acks = {} # (client_index, mid) -> ack time, on_publish fired before registration
+        self.pending_lock = threading.Lock()
+        self.connected = threading.Event()
+        self.worker_thread = None
+        self._rr = itertools.count()
+
+    def start(self):
+        if self.worker_thread and self.worker_thread.is_alive():
+            return
+        for index in range(self.pool_size):
+            client_id = f"{MQTT_PUBLISHER_CLIENT_ID_PREFIX}{index}_{int(time.time())}"
+            client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv311, clean_session=True)
+            client.username_pw_set(MQTT_USER, MQTT_PASS)
+            client.reconnect_delay_set(min_delay=1, max_delay=MQTT_RECONNECT_DELAY)
+            client.on_connect = self._on_connect
+            client.on_disconnect = self._on_disconnect
+            client.on_publish = lambda c, userdata, mid, index=index: self._on_publish(index, mid)
+            client.connect_async(MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE)
+            client.loop_start() # paho reconnects automatically inside its loop thread
+            self.clients.append(client)
+        self.worker_thread = threading.Thread(target=self._worker, name="MQTTPublisherThread", daemon=True)
+        self.worker_thread.start()
+        log.info(f"📤 MQTT Publisher started with {self.pool_size} connection(s).")
+
+    def stop(self):
+        for client in self.clients:
+            try:
+                client.disconnect()
+                client.loop_stop()
+            except Exception: pass
+        self.clients = []
+        self.connected.clear()
+
+    def submit(self, topic, serialized_payload, sid, robot_id, command_type):
+        """Queue a command for publishing. Returns False if the queue is full."""
+        try:
+            self.queue.put_nowait((topic, serialized_payload, sid, robot_id, command_type, time.perf_counter()))
+            return True
+        except queue.Full:
+            return False
+
+    def publish_now(self, topic, serialized_payload):
+        """Publish on the next connected client, bypassing the command queue. Returns True if paho accepted it."""
+        index, client = self._next_connected_client()
+        if client is None:
+            return False
+        try:
+            return client.publish(topic, serialized_payload, qos=0).rc == mqtt.MQTT_ERR_SUCCESS
+        except Exception as e:
+            log.error(f"MQTT Publisher: Error publishing to {topic}: {e}")
+            return False
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            log.info("✅ MQTT Publisher connected.")
+            self.connected.set()
+        else:
+            log.error(f"❌ MQTT Publisher connection failed. Code: {rc}.")
+
+    def _on_disconnect(self, client, userdata, rc):
+        if not any(c.is_connected() for c in self.clients if c is not client):
+            self.connected.clear()
+        if rc != 0:
+            log.warning(f"🔌 MQTT Publisher unexpectedly disconnected. Code: {rc}. Reconnecting in background.")
+
+    def _next_connected_client(self):
+        for _ in range(self.pool_size):
+            index = next(self._rr) % self.pool_size
+            if index < len(self.clients) and self.clients[index].is_connected():
+                return index, self.clients[index]
+        return None, None
+
+    def _worker(self):
+        while not stop_event.is_set():
+            try:
+                command = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            topic, serialized_payload, sid, robot_id, command_type, queued_at = command
+            index, client = self._next_connected_client()
+            if client is None and self.connected.wait(timeout=MQTT_PUBLISH_CONNECT_WAIT):
+                index, client = self._next_connected_client()
+            if client is None:
+                log.error(f"MQTT Publisher: No broker connection, dropping command for {topic}.")
+                COMMANDS.inc(command_label(command_type), 'not_connected')
+                socketio.emit('command_feedback', {'status': 'error', 'message': 'MQTT Publisher not connected.'}, room=sid)
+                continue
+            try:
+                msg_info = client.publish(topic, serialized_payload, qos=0) # qos=0 for fire-and-forget
+            except Exception as e:
+                log.exception(f"MQTT Publisher: Unexpected error publishing command to {topic}: {e}")
+                COMMANDS.inc(command_label(command_type), 'error')
+                socketio.emit('command_feedback', {'status': 'error', 'message': f'Publishing Error: {e}'}, room=sid)
+                continue
+            if msg_info.rc != mqtt.MQTT_ERR_SUCCESS:
+                log.warning(f"⚠️ Publish command to {topic} may have failed (rc={msg_info.rc}).")
+                COMMANDS.inc(command_label(command_type), 'error')
+                socketio.emit('command_feedback', {'status': 'warning', 'message': f'Command publish failed (rc={msg_info.rc}) for {robot_id}.'}, room=sid)
+                continue
+            info = (topic, len(serialized_payload), sid, robot_id, command_type, queued_at)
+            key = (index, msg_info.mid)
+            with self.pending_lock:
+                acked_at = self.early_acks.pop(key, None)
+                if acked_at is None:
+                    self.pending[key] = info
+            if acked_at is not None:
+                self._report(info, acked_at)
+
+    def _on_publish(self, index, mid):
+        acked_at = time.perf_counter()
+        key = (index, mid)
+        with self.pending_lock:
+            info = self.pending.pop(key, None)
+            if info is None:
+                self.early_acks[key] = acked_at
+                return
+        self._report(info, acked_at)
+
+    def _report(self, info, acked_at):
+        topic, size, sid, robot_id, command_type, queued_at = info
+        latency_ms = round((acked_at - queued_at) * 1000, 2)
+        label = command_label(command_type)
+        COMMANDS.inc(label, 'success')
+        PUBLISH_LATENCY.observe(acked_at - queued_at, label)
+        log.info(f"✅ Command '{command_type}' published to {topic} ({size} bytes, {latency_ms} ms).")
+        socketio.emit('command_feedback', {
+            'status': 'success',
+            'message': f'{command_type} command sent to {robot_id}.',
+            'command_type': command_type,
+            'latency_ms': latency_ms,
+        }, room=sid)
+
+mqtt_publisher = MQTTPublisher(MQTT_PUBLISHER_POOL_SIZE, MQTT_PUBLISH_QUEUE_SIZE)
+
+# --- Teleoperation ---
+def teleop_stop_payload(payload):
+    """The last joystick command with every velocity set to zero."""
+    stop = dict(payload)
+    stop['joystick_vel_cmd'] = {'linear': {'x': 0.0, 'y': 0.0, 'z': 0.0}, 'angular': {'x': 0.0, 'y': 0.0, 'z': 0.0}}
+    stop['direct_high_cmd'] = 0.0
+    return stop
+
+class TeleopChannel:
+    """Latest-only joystick stream per robot, published at a fixed control rate with a stale-input watchdog.
+
+    'teleop' events only replace the robot's current command (no logging, no queue). A ticker
+    publishes the newest command of every active robot on each tick straight onto a pooled
+    publisher connection, so joystick traffic never waits behind queued commands. A robot
+    whose input is older than `stale_timeout`, or whose controlling client left, is sent a
+    zero-velocity stop `stop_repeat` times and then dropped from the stream.
+    """
+
+    def __init__(self, publisher, command_type, rate_hz, stale_timeout, stop_repeat):
+        self.publisher = publisher
+        self.command_type = command_type
+        self.interval = 1.0 / rate_hz if rate_hz > 0 else 0.05
+        self.stale_timeout = stale_timeout
+        self.stop_repeat = max(1, stop_repeat)
+        self.streams = {} # robot_id -> {'payload', 'sid', 'received_at', 'fresh', 'stops_left', counters}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.watchdog_stops = 0
+        self.late_ticks = 0
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._loop, name="TeleopThread", daemon=True)
+        self.thread.start()
+
+    def update(self, robot_id, payload, sid):
+        """Replace the robot's command. Returns the last input-to-publish latency in ms (None before the first)."""
+        now = time.perf_counter()
+        with self.lock:
+            stream = self.streams.get(robot_id)
+            if stream is None:
+                stream = self.streams[robot_id] = {'published': 0, 'coalesced': 0, 'latency_ms': None}
+            elif stream.get('fresh'):
+                stream['coalesced'] += 1 # Replaced before the next tick published it
+            stream.update(payload=payload, sid=sid, received_at=now, fresh=True, stops_left=0)
+            return stream['latency_ms']
+
+    def release(self, robot_id=None, sid=None):
+        """Stop a robot's stream now, or every stream controlled by `sid` (client disconnected)."""
+        with self.lock:
+            for key, stream in self.streams.items():
+                if (robot_id is None or key == robot_id) and (sid is None or stream['sid'] == sid) and not stream['stops_left']:
+                    stream['stops_left'] = self.stop_repeat
+
+    def _loop(self):
+        next_tick = time.monotonic()
+        while not stop_event.is_set():
+            self._tick()
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.late_ticks += 1
+                next_tick = time.monotonic() # Overloaded: skip missed ticks instead of bursting
+
+    def _tick(self):
+        now = time.perf_counter()
+        frames = []
+        with self.lock:
+            for robot_id, stream in list(self.streams.items()):
+                if not stream['stops_left'] and now - stream['received_at'] > self.stale_timeout:
+                    stream['stops_left'] = self.stop_repeat
+                    self.watchdog_stops += 1
+                    log.warning(f"🛑 Teleop input for {robot_id} is stale ({now - stream['received_at']:.2f}s), stopping robot.")
+                if stream['stops_left']:
+                    frames.append((robot_id, 'stop', teleop_stop_payload(stream['payload']), None))
+                    stream['stops_left'] -= 1
+                    if not stream['stops_left']:
+                        del self.streams[robot_id]
+                else:
+                    frames.append((robot_id, 'command', stream['payload'], stream['received_at'] if stream['fresh'] else None))
+                    stream['fresh'] = False
+        for robot_id, kind, payload, received_at in frames:
+            ok = self.publisher.publish_now(f"{robot_id}/s2r/{self.command_type}", msgpack.dumps(payload, use_bin_type=True))
+            TELEOP_PUBLISHES.inc(kind, 'success' if ok else 'not_connected')
+            if ok and received_at is not None:
+                latency = time.perf_counter() - received_at
+                TELEOP_LATENCY.observe(latency)
+                with self.lock:
+                    stream = self.streams.get(robot_id)
+                    if stream is not None:
+                        stream['published'] += 1
+                        stream['latency_ms'] = round(latency * 1000, 2)
+
+    def stats(self):
+        now = time.perf_counter()
+        with self.lock:
+            streams = {robot_id: {'age_s': round(now - stream['received_at'], 3), 'stopping': bool(stream['stops_left']),
+                                  'published': stream['published'], 'coalesced': stream['coalesced'],
+                                  'latency_ms': stream['latency_ms']}
+                       for robot_id, stream in self.streams.items()}
+        return {'rate_hz': round(1.0 / self.interval, 2), 'stale_timeout': self.stale_timeout,
+                'watchdog_stops': self.watchdog_stops, 'late_ticks': self.late_ticks, 'streams': streams}
+
+teleop_channel = TeleopChannel(mqtt_publisher, TELEOP_COMMAND_TYPE, TELEOP_RATE_HZ, TELEOP_STALE_TIMEOUT, TELEOP_STOP_REPEAT)
+
 
 # --- Flask Routes ---
 # (Giữ nguyên các route / và /data)
 @app.route("/")
 def index():
-    return render_template("index.html")
+    return render_template("index.html", socketio_transports=SOCKETIO_TRANSPORTS)
+
+@app.route("/stats/bus")
+def bus_stats_endpoint():
+    bus = state_bus_server or state_bus_subscriber
+    return jsonify({'role': DASHBOARD_ROLE, **(bus.stats() if bus else {})})
+
+@app.route("/stats/emit")
+def emit_stats_endpoint():
+    return jsonify(emit_scheduler.stats())
+
+@app.route("/stats/robots")
+def robot_stats_endpoint():
+    return jsonify(robot_registry.stats())
+
+@app.route("/stats/delta")
+def delta_stats_endpoint():
+    return jsonify(delta_encoder.stats())
+
+@app.route("/stats/paths")
+def path_stats_endpoint():
+    return jsonify(path_simplifier.stats())
+
+@app.route("/stats/scans")
+def scan_stats_endpoint():
+    return jsonify(scan_encoder.stats())
+
+@app.route("/stats/teleop")
+def teleop_stats_endpoint():
+    return jsonify(teleop_channel.stats())
+
+@app.route("/stats/partitions")
+def partition_stats_endpoint():
+    return jsonify(partition_supervisor.stats() if partition_supervisor else {'partitions': INGEST_PARTITIONS, 'role': DASHBOARD_ROLE})
+
+@app.route("/stats/mqtt")
+def mqtt_stats_endpoint():
+    if mqtt_listener_driver:
+        return jsonify(mqtt_listener_driver.stats())
+    return jsonify({'driver': MQTT_DRIVER, 'running': mqtt_listener_thread_obj is not None and mqtt_listener_thread_obj.is_alive()})
+
+@app.route("/stats/presence")
+def presence_stats_endpoint():
+    return jsonify(presence_tracker.stats())
+
+@app.route("/stats/snapshot")
+def snapshot_stats_endpoint():
+    return jsonify(snapshot_store.stats() if snapshot_store else {'enabled': False})
+
+def admin_denied():
+    """401 response unless the request carries ADMIN_TOKEN (None when no token is configured)."""
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'error': 'Admin token required.'}), 401
+    return None
+
+@app.route("/admin/trace", methods=['GET', 'POST', 'DELETE'])
+@app.route("/admin/trace/<int:rule_id>", methods=['DELETE'])
+def trace_rules_endpoint(rule_id=None):
+    """GET: rules and buffer stats. POST {robot, topic, sample, log}: add a rule. DELETE: remove one/all rules."""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if request.method == 'POST':
+        spec = request.get_json(silent=True) or {}
+        try:
+            rule = tracer.add_rule(str(spec.get('robot', '*')), str(spec.get('topic', '*')),
+                                   int(spec.get('sample', 1)), bool(spec.get('log', False)))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid trace rule.'}), 400
+        log.info(f"🔎 Trace rule added: {rule.to_dict()}")
+        return jsonify(rule.to_dict()), 201
+    if request.method == 'DELETE':
+        removed = tracer.remove_rule(rule_id)
+        if rule_id is not None and not removed:
+            return jsonify({'error': f'No trace rule {rule_id}.'}), 404
+        log.info(f"🔎 Removed {removed} trace rule(s).")
+        return jsonify({'removed': removed})
+    return jsonify(tracer.stats())
+
+@app.route("/admin/traces")
+def traces_endpoint():
+    """Recent traces, newest first: ?robot_id=&sub_topic=&limit= (default 100)."""
+    denied = admin_denied()
+    if denied:
+        return denied
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify(tracer.recent(request.args.get('robot_id'), request.args.get('sub_topic'), max(1, limit)))
+
+@app.route("/stats/decode")
+def decode_stats_endpoint():
+    return jsonify(decode_pipeline.stats())
+
+# --- Metrics Endpoint ---
+metrics_registry.gauge('dashboard_robots', 'Registered robots', lambda: len(robot_registry.robot_ids()))
+metrics_registry.gauge('dashboard_robots_online', 'Robots heard from within ROBOT_OFFLINE_AFTER', lambda: len(presence_tracker.online))
+metrics_registry.gauge('dashboard_decode_queue_depth', 'Messages waiting in the decode pipeline',
+                       lambda: sum(stats['depth'] for stats in decode_pipeline.stats().values()))
+metrics_registry.gauge('dashboard_publish_queue_depth', 'Commands waiting for the MQTT publisher', lambda: mqtt_publisher.queue.qsize())
+metrics_registry.gauge('dashboard_store_version', 'State store version (writes since start)', lambda: state_store.version)
+metrics_registry.gauge('dashboard_history_bytes', 'Memory allocated by the history ring buffers', lambda: history_store.allocated_bytes)
+METRICS_ROOM = 'metrics'
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # Per process: with DASHBOARD_ROLE=web each worker reports its own emit/store metrics
+    return Response(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def metrics_emit_loop():
+    """Push a JSON snapshot plus per robot/topic message rates to the metrics room."""
+    previous, previous_time = dict(MQTT_MESSAGES.series), time.monotonic()
+    while not stop_event.wait(METRICS_EMIT_INTERVAL):
+        now = time.monotonic()
+        current = dict(MQTT_MESSAGES.series)
+        elapsed = now - previous_time
+        rates = {
+            f"{robot_id}/{sub_topic}": round((count - previous.get((robot_id, sub_topic), 0)) / elapsed, 2)
+            for (robot_id, sub_topic), count in current.items()
+        }
+        previous, previous_time = current, now
+        socketio.emit('metrics', {'rates': rates, 'metrics': metrics_registry.snapshot()}, to=METRICS_ROOM)
+
+# --- /data Response Cache ---
+STORE_EPOCH = f"{int(time.time()):x}" # Keeps ETags from a previous process from matching
+DATA_FORMATS = {'application/json': 'json', 'application/msgpack': 'msgpack', 'application/x-msgpack': 'msgpack'}
+
+class ResponseCache:
+    """LRU of serialized /data bodies keyed on (scope, format, encoding), bounded by total body bytes.
+
+    Scopes are '*', robot_id or 'robot_id/sub_topic'; one version per key is kept.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict() # key -> (version, body, content_encoding)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None and cached[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+            return None
+
+    def put(self, key, version, body, content_encoding):
+        with self.lock:
+            self._drop(key)
+            if len(body) > self.max_bytes:
+                return # Would evict everything else; served uncached
+            self.entries[key] = (version, body, content_encoding)
+            self.total_bytes += len(body)
+            while self.total_bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        cached = self.entries.pop(key, None)
+        if cached is not None:
+            self.total_bytes -= len(cached[1])
+
+    def forget_robot(self, robot_id):
+        """Drop the robot's bodies and the full-state ones (they include it)."""
+        prefix = robot_id + '/'
+        with self.lock:
+            for key in [key for key in self.entries if key[0] in ('*', robot_id) or key[0].startswith(prefix)]:
+                self._drop(key)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+data_response_cache = ResponseCache(DATA_CACHE_MAX_BYTES)
+
+def _negotiate_data_format():
+    best = request.accept_mimetypes.best_match(list(DATA_FORMATS), default='application/json')
+    return DATA_FORMATS[best]
+
+def _negotiate_encoding():
+    for encoding in ('gzip', 'deflate'):
+        if request.accept_encodings[encoding] > 0:
+            return encoding
+    return 'identity'
+
+def cached_state_response(scope, version, build_data):
+    """Serve a state view with ETag/If-None-Match, msgpack negotiation and compression.
+
+    The serialized (and compressed) body is cached per scope/format/encoding until `version` changes,
+    so unchanged polls cost a dict lookup, or just a 304 when the client sends its ETag back.
+    """
+    data_format = _negotiate_data_format()
+    encoding = _negotiate_encoding()
+    etag = f"{STORE_EPOCH}-{version}-{data_format}-{encoding}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        key = (scope, data_format, encoding)
+        cached = data_response_cache.get(key, version)
+        if cached is not None:
+            body, content_encoding = cached[1], cached[2]
+        else:
+            data = build_data()
+            if data_format == 'msgpack':
+                body = msgpack.packb(data, use_bin_type=True, default=msgpack_default) # Image bytes stay binary
+            else:
+                body = app.json.dumps(data).encode('utf-8')
+            content_encoding = None
+            if encoding != 'identity' and len(body) >= DATA_COMPRESS_MIN_BYTES:
+                if encoding == 'gzip':
+                    body = gzip.compress(body, compresslevel=DATA_COMPRESS_LEVEL)
+                else:
+                    body = zlib.compress(body, DATA_COMPRESS_LEVEL)
+                content_encoding = encoding
+            data_response_cache.put(key, version, body, content_encoding)
+        response = Response(body, mimetype='application/msgpack' if data_format == 'msgpack' else 'application/json')
+        if content_encoding:
+            response.headers['Content-Encoding'] = content_encoding
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache' # Always revalidate; 304 makes that cheap
+    return response
+
+@app.route("/data/<robot_id>/<path:sub_topic>")
+def topic_data_endpoint(robot_id, sub_topic):
+    record = state_store.get_robot(robot_id)
+    if record is None:
+        return jsonify({"error": "Robot not found"}), 404
+    if sub_topic not in record['topics']:
+        return jsonify({"error": "Topic not found"}), 404
+    # Versioned by this topic's last write: updates to sibling topics keep the cached body
+    return cached_state_response(f"{robot_id}/{sub_topic}", state_store.topic_version(robot_id, sub_topic) or 0, lambda: record['topics'][sub_topic])
 
 @app.route("/data")
 @app.route("/data/<robot_id>")
 def data_endpoint(robot_id=None):
-    with data_lock:
-        if robot_id:
-            if robot_id in latest_data:
-                return jsonify(copy.deepcopy(latest_data[robot_id]))
-            else:
-                return jsonify({"error": "Robot not found"}), 404
+    if robot_id:
+        record = state_store.get_robot(robot_id) # Frozen record, safe to serialize without copying
+        if record is not None:
+            return cached_state_response(robot_id, state_store.robot_version(robot_id) or 0, lambda: record)
         else:
-            return jsonify(copy.deepcopy(latest_data))
+            return jsonify({"error": "Robot not found"}), 404
+    else:
+        snapshot = state_store.snapshot()
+        return cached_state_response('*', snapshot.version, lambda: snapshot.robots)
+
+# --- Image Frames ---
+frame_cache = FrameCache(FRAME_CACHE_MAX_BYTES)
+
+@app.route("/frame/<robot_id>/<path:sub_topic>")
+def frame_endpoint(robot_id, sub_topic):
+    """Latest image of a robot/topic as PNG/JPEG: ?ts=&format=png|jpeg&max_dim=&quality=
+
+    Frames are encoded once per (timestamp, format, size bucket) and shared by every client.
+    A URL whose `ts` matches the served frame never changes, so it is cached immutably.
+    """
+    record = state_store.get_robot(robot_id)
+    if record is None or sub_topic not in record['topics']:
+        return jsonify({"error": "Topic not found"}), 404
+    entry = record['topics'][sub_topic]
+    payload = resolve_payload(entry['payload'])
+    if not isinstance(payload, dict) or 'data' not in payload:
+        return jsonify({"error": "No image available"}), 404
+    image_format = request.args.get('format') or FRAME_FORMATS.get(sub_topic, 'jpeg')
+    if image_format not in IMAGE_FORMATS:
+        return jsonify({"error": f"Unsupported format '{image_format}'"}), 400
+    bucket = size_bucket(request.args.get('max_dim', type=int))
+    quality = max(1, min(95, request.args.get('quality', FRAME_JPEG_QUALITY, type=int)))
+    key = (robot_id, sub_topic, entry['timestamp'], image_format, bucket, quality if image_format == 'jpeg' else None)
+    try:
+        # Pillow releases the GIL while encoding, so run it on a native thread instead of blocking the hub
+        body = frame_cache.get_or_encode(key, lambda: tpool.execute(transcode, payload, image_format, bucket, quality))
+    except TranscodeError as e:
+        return jsonify({"error": str(e)}), 415
+    response = Response(body, mimetype=IMAGE_FORMATS[image_format][1])
+    response.set_etag(f"{STORE_EPOCH}-{'-'.join(map(str, key))}")
+    if request.args.get('ts', type=int) == entry['timestamp']:
+        response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route("/stats/data_cache")
+def data_cache_stats_endpoint():
+    return jsonify(data_response_cache.stats())
+
+@app.route("/stats/frames")
+def frame_stats_endpoint():
+    return jsonify(frame_cache.stats())
+
+# --- Topic History ---
+@app.route("/history/<robot_id>/<path:sub_topic>")
+def history_endpoint(robot_id, sub_topic):
+    """Columnar numeric history: ?since=<ms>&fields=a,gps.latitude&downsample=<buckets>"""
+    if not state_store.has_robot(robot_id):
+        return jsonify({"error": "Robot not found"}), 404
+    fields = [f for f in request.args.get('fields', '').split(',') if f] or None
+    since = request.args.get('since', type=int)
+    downsample = request.args.get('downsample', type=int)
+    if downsample is not None and downsample <= 0:
+        return jsonify({"error": "downsample must be a positive bucket count"}), 400
+    history = history_store.query(robot_id, sub_topic, since=since, fields=fields, downsample=downsample)
+    if history is None:
+        return jsonify({"error": "No history for topic"}), 404
+    history.update(robot_id=robot_id, sub_topic=sub_topic, available_fields=history_store.fields(robot_id, sub_topic))
+    return jsonify(history)
+
+@app.route("/stats/history")
+def history_stats_endpoint():
+    return jsonify(history_store.stats())
 
 
 # --- SocketIO Events ---
+initial_metadata_cache = None # (store version, membership version, monotonic build time, JSON text)
+
+def initial_metadata_json():
+    """(store version, JSON text) of the store metadata for initial_state, shared between connects.
+
+    Rebuilt when robots were added or removed, or when the cached text is older than
+    INITIAL_STATE_MAX_AGE: under live traffic the store version changes on every message, so
+    a reconnect storm would otherwise serialize the whole fleet's metadata once per client.
+    Newer timestamps reach the client through the live events that follow.
+    """
+    global initial_metadata_cache
+    cached = initial_metadata_cache
+    now = time.monotonic()
+    if (cached is None or cached[1] != state_store.membership_version
+            or (cached[0] != state_store.version and now - cached[2] >= INITIAL_STATE_MAX_AGE)):
+        metadata = state_store.metadata()
+        cached = initial_metadata_cache = (metadata.version, state_store.membership_version, now,
+                                           app.json.dumps(metadata.robots, separators=(',', ':')))
+    return cached[0], cached[3]
+
 # (Giữ nguyên các event connect, disconnect, send_command)
 @socketio.on('connect')
 def handle_connect():
     sid = request.sid
     log.info(f'✅ Client connected via SocketIO (SID: {sid})')
-    with data_lock:
-        # Use deepcopy when sending initial state to avoid modifying shared data
-        initial_state = {
-            'known_robots': KNOWN_ROBOTS,
-            'all_data': copy.deepcopy(latest_data),
-            'robot_sub_topics': ALL_EXPECTED_SUB_TOPICS
-        }
+    # Metadata only (last_seen + per-topic timestamp/size/type); payloads are fetched on demand
+    # via 'subscribe' / 'get_topic' or /data/<robot_id>/<sub_topic>. Sent pre-serialized (all_data_json).
+    version, all_data_json = initial_metadata_json()
+    robot_ids = robot_registry.robot_ids()
+    initial_state = {
+        'known_robots': robot_ids,
+        'all_data_json': all_data_json,
+        'robot_status': {robot_id: presence_tracker.status(robot_id, (state_store.get_robot(robot_id) or {}).get('last_seen', 0)) for robot_id in robot_ids},
+        'stale_topics': {robot_id: presence_tracker.stale_topics(robot_id) for robot_id in robot_ids},
+        'robot_sub_topics': ALL_EXPECTED_SUB_TOPICS,
+        'version': version,
+        'path_sub_topics': sorted(PATH_SUB_TOPICS),
+    }
     socketio.emit('initial_state', initial_state, room=sid)
 
+@socketio.on('get_topic')
+def handle_get_topic(data):
+    """Ack with the latest {payload, timestamp, size} entry for one robot/topic.
+
+    Delta topics answer with the last entry emitted on the stream plus its `seq`, so the
+    client can apply the following 'mqtt_delta' patches on top of it (also used to resync).
+    """
+    robot_id = data.get('robot_id') if isinstance(data, dict) else None
+    sub_topic = data.get('sub_topic') if isinstance(data, dict) else None
+    record = state_store.get_robot(robot_id)
+    if record is None or sub_topic not in record['topics']:
+        return {'status': 'error', 'message': 'Topic not found'}
+    if sub_topic in DELTA_SUB_TOPICS:
+        current = delta_encoder.current((robot_id, sub_topic))
+        if current is not None:
+            return {'status': 'ok', 'robot_last_seen': record['last_seen'], 'data': current[1], 'seq': current[0]}
+    return {'status': 'ok', 'robot_last_seen': record['last_seen'], 'data': client_topic_entry(robot_id, sub_topic, record['topics'][sub_topic])}
+
 @socketio.on('disconnect')
 def handle_disconnect():
     log.info(f'❌ Client disconnected via SocketIO (SID: {request.sid})')
+    teleop_channel.release(sid=request.sid) # Never leave a robot driving on its last joystick command
+
+def _parse_subscription(data):
+    """Validate a subscribe/unsubscribe request. Returns (robot_id, sub_topic or None) or None."""
+    if not isinstance(data, dict):
+        return None
+    robot_id = data.get('robot_id')
+    sub_topic = data.get('sub_topic')
+    if not robot_id or not robot_registry.is_known(robot_id):
+        return None
+    if sub_topic is not None and not isinstance(sub_topic, str):
+        return None
+    return robot_id, sub_topic or None
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    sid = request.sid
+    parsed = _parse_subscription(data)
+    if parsed is None:
+        log.warning(f"Invalid subscribe request from {sid}: {data}")
+        return {'status': 'error', 'message': 'Invalid subscription.'}
+    robot_id, sub_topic = parsed
+    join_room(robot_room(robot_id) if sub_topic is None else topic_room(robot_id, sub_topic))
+    log.debug(f"Client {sid} subscribed to {robot_id}/{sub_topic or '*'}")
+
+    # Send the current values right away; broadcast topics are already up to date on the client
+    record = state_store.get_robot(robot_id)
+    if record:
+        for name, entry in record['topics'].items():
+            if (sub_topic is None or name == sub_topic) and name not in BROADCAST_SUB_TOPICS and entry['timestamp'] > 0:
+                message = {
+                    'robot_id': robot_id,
+                    'sub_topic': name,
+                    'data': client_topic_entry(robot_id, name, entry),
+                    'robot_last_seen': record['last_seen']
+                }
+                current = delta_encoder.current((robot_id, name)) if name in DELTA_SUB_TOPICS else None
+                if current is not None: # Base for the deltas that follow
+                    message['seq'], message['data'] = current
+                socketio.emit('mqtt_data', message, room=sid)
+    return {'status': 'ok'}
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(data):
+    parsed = _parse_subscription(data)
+    if parsed is None:
+        return {'status': 'error', 'message': 'Invalid subscription.'}
+    robot_id, sub_topic = parsed
+    leave_room(robot_room(robot_id) if sub_topic is None else topic_room(robot_id, sub_topic))
+    return {'status': 'ok'}
+
+def _leave_path_rooms(robot_id, sub_topic):
+    prefix = path_room(robot_id, sub_topic, '')
+    for room in client_rooms():
+        if isinstance(room, str) and room.startswith(prefix):
+            leave_room(room)
+
+@socketio.on('subscribe_path')
+def handle_subscribe_path(data):
+    """Follow a robot's simplified GPS path at a map zoom level: {robot_id, sub_topic, zoom}.
+
+    Acks the full simplified path; 'path_update' events then carry {version, base_version,
+    keep, points}: keep the first `keep` points of `base_version` and append `points`.
+    """
+    parsed = _parse_subscription(data)
+    sub_topic = (data.get('sub_topic') if isinstance(data, dict) else None) or 'gloal_path_gps'
+    zoom = data.get('zoom') if isinstance(data, dict) else None
+    if parsed is None or sub_topic not in PATH_SUB_TOPICS or not isinstance(zoom, (int, float)):
+        return {'status': 'error', 'message': 'Invalid path subscription.'}
+    robot_id = parsed[0]
+    zoom = path_simplifier.clamp_zoom(zoom)
+    _leave_path_rooms(robot_id, sub_topic) # One zoom level per client and path
+    join_room(path_room(robot_id, sub_topic, zoom))
+    record = state_store.get_robot(robot_id)
+    entry = record['topics'].get(sub_topic) if record else None
+    if entry is None or entry['timestamp'] <= 0:
+        return {'status': 'ok', 'zoom': zoom, 'version': None, 'points': []}
+    state = path_simplifier.update((robot_id, sub_topic), resolve_payload(entry['payload']), entry['timestamp'])
+    if state is None:
+        return {'status': 'error', 'message': 'Unrecognized path format.'}
+    return dict(path_simplifier.full(state, zoom), status='ok', zoom=zoom,
+                timestamp=entry['timestamp'], robot_last_seen=record['last_seen'])
+
+@socketio.on('unsubscribe_path')
+def handle_unsubscribe_path(data):
+    parsed = _parse_subscription(data)
+    if parsed is None:
+        return {'status': 'error', 'message': 'Invalid path subscription.'}
+    _leave_path_rooms(parsed[0], data.get('sub_topic') or 'gloal_path_gps')
+    return {'status': 'ok'}
+
+@socketio.on('subscribe_metrics')
+def handle_subscribe_metrics(data=None):
+    """Join the room receiving a 'metrics' event every METRICS_EMIT_INTERVAL seconds; acks the current snapshot."""
+    join_room(METRICS_ROOM)
+    return {'status': 'ok', 'interval_s': METRICS_EMIT_INTERVAL, 'metrics': metrics_registry.snapshot()}
+
+@socketio.on('unsubscribe_metrics')
+def handle_unsubscribe_metrics(data=None):
+    leave_room(METRICS_ROOM)
+    return {'status': 'ok'}
 
 @socketio.on('send_command')
 def handle_send_command(data):
@@ -376,7 +1950,7 @@ def handle_send_command(data):
     command_type = data.get('command_type')
     payload_dict = data.get('payload')
 
-    if not robot_id or robot_id not in KNOWN_ROBOTS:
+    if not robot_id or not robot_registry.is_known(robot_id):
         log.warning(f"Invalid command: Unknown robot_id '{robot_id}' from {sid}.")
         socketio.emit('command_feedback', {'status': 'error', 'message': f'Invalid robot ID: {robot_id}.'}, room=sid)
         return
@@ -400,42 +1974,30 @@ def handle_send_command(data):
         socketio.emit('command_feedback', {'status': 'error', 'message': f'Serialization Error: {e}'}, room=sid)
         return
 
-    publisher_client = None
-    try:
-        pub_client_id = f"{MQTT_PUBLISHER_CLIENT_ID_PREFIX}{sid}_{int(time.time()*1000)}"
-        publisher_client = mqtt.Client(client_id=pub_client_id, protocol=mqtt.MQTTv311)
-        publisher_client.username_pw_set(MQTT_USER, MQTT_PASS)
-        # Short connect timeout for publishing
-        publisher_client.connect(MQTT_HOST, MQTT_PORT, 5)
-        publisher_client.loop_start() # Start network loop for callbacks
-
-        # Publish the message
-        msg_info = publisher_client.publish(topic_to, serialized_payload, qos=0) # qos=0 for fire-and-forget
-        msg_info.wait_for_publish(timeout=1) # Wait briefly for acknowledgment (best effort with qos=0)
-
-        if msg_info.rc == mqtt.MQTT_ERR_SUCCESS:
-             log.info(f"✅ Command '{command_type}' published to {topic_to} ({len(serialized_payload)} bytes).")
-             # Feedback to the specific client that sent the command
-             socketio.emit('command_feedback', {'status': 'success', 'message': f'{command_type} command sent to {robot_id}.'}, room=sid)
-        else:
-             log.warning(f"⚠️ Publish command to {topic_to} may have failed (rc={msg_info.rc}).")
-             socketio.emit('command_feedback', {'status': 'warning', 'message': f'Command publish failed (rc={msg_info.rc}) for {robot_id}.'}, room=sid)
+    if not mqtt_publisher.submit(topic_to, serialized_payload, sid, robot_id, command_type):
+        log.warning(f"MQTT Publisher: Queue full, rejecting command for {topic_to}.")
+        COMMANDS.inc(command_label(command_type), 'queue_full')
+        socketio.emit('command_feedback', {'status': 'error', 'message': 'Command queue full, try again.'}, room=sid)
 
-    except ConnectionRefusedError:
-        log.error(f"MQTT Publisher: Connection Refused for {topic_to}.")
-        socketio.emit('command_feedback', {'status': 'error', 'message': 'MQTT Connection Refused (Publisher).'}, room=sid)
-    except OSError as e:
-        log.error(f"MQTT Publisher: Network Error for {topic_to}: {e}")
-        socketio.emit('command_feedback', {'status': 'error', 'message': f'MQTT Network Error (Publisher): {e}.'}, room=sid)
-    except Exception as e:
-        log.exception(f"MQTT Publisher: Unexpected error publishing command to {topic_to}: {e}")
-        socketio.emit('command_feedback', {'status': 'error', 'message': f'Publishing Error: {e}'}, room=sid)
-    finally:
-        if publisher_client:
-            try:
-                publisher_client.loop_stop() # Stop network loop
-                publisher_client.disconnect()
-            except Exception: pass # Ignore errors during cleanup
+
+@socketio.on('teleop')
+def handle_teleop(data):
+    """Latest joystick command for a robot; published by the teleop channel at its fixed rate."""
+    robot_id = data.get('robot_id') if isinstance(data, dict) else None
+    if not isinstance(robot_id, str) or not robot_registry.is_known(robot_id) or not isinstance(data.get('payload'), dict):
+        return {'status': 'error', 'message': 'Invalid teleop command.'}
+    if stop_event.is_set():
+        return {'status': 'error', 'message': 'Server shutting down.'}
+    return {'status': 'ok', 'latency_ms': teleop_channel.update(robot_id, data['payload'], request.sid)}
+
+@socketio.on('teleop_stop')
+def handle_teleop_stop(data):
+    robot_id = data.get('robot_id') if isinstance(data, dict) else None
+    if not isinstance(robot_id, str) or not robot_id:
+        return {'status': 'error', 'message': 'Invalid teleop stop.'}
+    teleop_channel.release(robot_id=robot_id)
+    log.info(f"🛑 Teleop released for {robot_id} by {request.sid}")
+    return {'status': 'ok'}
 
 
 # --- Graceful Shutdown Handling ---
@@ -448,23 +2010,64 @@ def signal_handler(signum, frame):
         log.info("Signaled MQTT listener thread to stop...")
         # No need to explicitly disconnect client here, loop_forever exit should handle it
         time.sleep(0.5) # Give thread a moment to exit loop
+    mqtt_publisher.stop()
+    decode_pipeline.stop()
+    if partition_supervisor:
+        partition_supervisor.stop()
+    for bus in (state_bus_server, state_bus_subscriber):
+        if bus:
+            bus.stop()
+    if mqtt_recorder:
+        mqtt_recorder.close()
+    if snapshot_store:
+        write_snapshot()
+        snapshot_store.close()
     log.info("Attempting graceful server shutdown...")
     # Flask-SocketIO doesn't have a specific shutdown function like Flask's dev server
     # rely on the signal terminating the process after cleanup.
 
 # --- Application Initialization (for both development and production) ---
 def start_mqtt_listener():
-    """Start MQTT listener thread - called both in __main__ and by Gunicorn"""
+    """Start the background services of this DASHBOARD_ROLE - called both in __main__ and by Gunicorn"""
     global mqtt_listener_thread_obj
-    if mqtt_listener_thread_obj is None or not mqtt_listener_thread_obj.is_alive():
+    if DASHBOARD_ROLE == 'web':
+        running = state_bus_subscriber.thread is not None and state_bus_subscriber.thread.is_alive()
+    elif partition_supervisor:
+        running = partition_supervisor.running()
+    else:
+        running = mqtt_listener_thread_obj is not None and mqtt_listener_thread_obj.is_alive()
+    if not running:
         initialize_robot_data()
-        log.info("🚀 Starting Dashboard Application...")
+        log.info(f"🚀 Starting Dashboard Application (role: {DASHBOARD_ROLE})...")
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
 
-        mqtt_listener_thread_obj = threading.Thread(target=mqtt_listener_thread_func, name="MQTTListenerThread", daemon=True)
-        mqtt_listener_thread_obj.start()
-        log.info("📡 MQTT Listener thread started for production deployment")
+        if DASHBOARD_ROLE == 'web':
+            state_bus_subscriber.start() # Updates come from the ingest process
+        else:
+            if snapshot_store:
+                restore_snapshot() # Before the listener, so live messages always supersede restored ones
+                threading.Thread(target=snapshot_loop, name="SnapshotThread", daemon=True).start()
+            if partition_supervisor:
+                partition_supervisor.start() # The partitions subscribe and decode
+            else:
+                listener_target = mqtt_listener_driver.run if mqtt_listener_driver else mqtt_listener_thread_func
+                mqtt_listener_thread_obj = threading.Thread(target=listener_target, name="MQTTListenerThread", daemon=True)
+                mqtt_listener_thread_obj.start()
+                log.info(f"📡 MQTT Listener thread started for production deployment ({MQTT_DRIVER} driver)")
+                decode_pipeline.start()
+            if DASHBOARD_ROLE == 'partition':
+                threading.Thread(target=partition_control_loop, name="PartitionControl", daemon=True).start()
+            robot_registry.start()
+            if state_bus_server:
+                state_bus_server.start()
+        if SERVES_CLIENTS:
+            emit_scheduler.start()
+            presence_tracker.start()
+            mqtt_publisher.start()
+            teleop_channel.start()
+            if METRICS_EMIT_INTERVAL > 0:
+                threading.Thread(target=metrics_emit_loop, name="MetricsEmitThread", daemon=True).start()
 
 # Initialize when module is imported (for Gunicorn)
 start_mqtt_listener()
@@ -476,6 +2079,12 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     host = '0.0.0.0'
     
+    if not SERVES_CLIENTS:
+        # No HTTP server here; web workers (DASHBOARD_ROLE=web) serve clients from the state bus
+        log.info(f"📈 Ingest process running; publishing on {STATE_BUS_URL}")
+        while not stop_event.wait(1.0):
+            pass
+        sys.exit(0)
     log.info(f"📈 Dashboard available at http://{host}:{port}")
     try:
         # Use socketio.run for deployment compatibility
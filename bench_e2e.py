@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""End-to-end benchmark: fake MQTT source -> on_message -> decode -> store -> emit -> Socket.IO clients.
+
+Runs the real app in-process (MQTT_HOST defaults to localhost so no live traffic mixes in),
+feeds synthetic robot_status / scan_multi / camera messages at the configured rates and
+measures ingest throughput, ingest-to-emit latency per topic, emit cost with N simulated
+Socket.IO clients, state store lock hold times and memory per robot. Results are printed
+and optionally saved as JSON for regression tracking.
+
+    python bench_e2e.py [--robots 4] [--clients 10] [--duration 10] [--rates robot_status=20,scan_multi=5,camera=5]
+                        [--image-format msgpack|base64] [--speed 1|max] [--out results.json]
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('MQTT_HOST', '127.0.0.1')
+os.environ.setdefault('MQTT_PORT', '1')
+
+import msgpack
+import paho.mqtt.client as mqtt
+
+import app as dashboard_app
+from bench_state_store import TimedLock, summarize
+
+DEFAULT_RATES = 'robot_status=20,scan_multi=5,camera=5'
+SEQ_FIELD = 'bench_seq'
+
+
+def make_payload(sub_topic, robot_index, seq, image_format):
+    """Synthetic payload shaped like the real topic, tagged with a sequence number."""
+    if sub_topic == 'robot_status':
+        return {
+            'gps': {'latitude': 21.0285 + seq * 1e-6, 'longitude': 105.8542 + robot_index * 1e-4},
+            'battery': 100 - (seq % 100), 'speed': (seq % 30) / 10.0, 'state': seq % 4,
+            'confirmation': 0, 'operation_mode': 2, SEQ_FIELD: seq,
+        }
+    if sub_topic == 'scan_multi':
+        ranges = [2.0 + math.sin((i + seq) / 20.0) for i in range(720)]
+        return {'angle_min': -math.pi, 'angle_max': math.pi, 'angle_increment': 2 * math.pi / 720,
+                'range_min': 0.1, 'range_max': 30.0, 'ranges': ranges, SEQ_FIELD: seq}
+    if sub_topic in ('camera', 'routed_map'):
+        pixels = CAMERA_FRAME
+        data = base64.b64encode(pixels).decode('ascii') if image_format == 'base64' else pixels
+        return {'width': 640, 'height': 480, 'encoding': 'bgr8', 'step': 640 * 3, 'data': data, SEQ_FIELD: seq}
+    return {'value': seq, SEQ_FIELD: seq}
+
+
+CAMERA_FRAME = bytes((i * 7) & 0xFF for i in range(640 * 480 * 3))
+
+
+def parse_rates(spec):
+    rates = {}
+    for item in spec.split(','):
+        topic, _, rate = item.partition('=')
+        rates[topic.strip()] = float(rate)
+    return rates
+
+
+def build_schedule(robots, rates, duration):
+    """Sorted (offset_s, robot_index, sub_topic) send times, evenly spaced per robot/topic."""
+    schedule = []
+    for robot_index in range(robots):
+        for sub_topic, rate in rates.items():
+            count = int(duration * rate)
+            phase = (robot_index / max(robots, 1)) / rate # Spread robots within the period
+            schedule.extend((phase + i / rate, robot_index, sub_topic) for i in range(count))
+    schedule.sort()
+    return schedule
+
+
+class EmitProbe:
+    """Wraps the emit scheduler's emit function to timestamp every emit and time its cost."""
+
+    def __init__(self, emit_func):
+        self.emit_func = emit_func
+        self.sent_at = {} # (robot_id, sub_topic, seq) -> perf_counter at on_message
+        self.latencies = {} # sub_topic -> [seconds]
+        self.emit_costs = {} # sub_topic -> [seconds]
+
+    def __call__(self, robot_id, sub_topic, data_to_store, robot_last_seen):
+        now = time.perf_counter()
+        payload = data_to_store['payload']
+        seq = payload.get(SEQ_FIELD) if isinstance(payload, dict) else None
+        sent = self.sent_at.pop((robot_id, sub_topic, seq), None)
+        if sent is not None:
+            self.latencies.setdefault(sub_topic, []).append(now - sent)
+        self.emit_func(robot_id, sub_topic, data_to_store, robot_last_seen)
+        self.emit_costs.setdefault(sub_topic, []).append(time.perf_counter() - now)
+
+
+def wait_for_drain(timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not any(stats['depth'] for stats in dashboard_app.decode_pipeline.stats().values()):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def measure_memory(robots, rates, image_format):
+    """Traced allocation growth for one message per topic per robot in a fresh set of robots."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    feed_ids = [f"bench_mem_{i}" for i in range(robots)]
+    for robot_index, robot_id in enumerate(feed_ids):
+        for sub_topic in rates:
+            feed(robot_id, sub_topic, make_payload(sub_topic, robot_index, 0, image_format))
+    wait_for_drain()
+    time.sleep(0.5) # Let pending emits flush
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    for robot_id in feed_ids:
+        dashboard_app.robot_registry.remove(robot_id)
+    return {'traced_bytes': used, 'per_robot_bytes': used // max(robots, 1)}
+
+
+def feed(robot_id, sub_topic, payload):
+    msg = mqtt.MQTTMessage(topic=f"{robot_id}/r2s/{sub_topic}".encode('utf-8'))
+    msg.payload = msgpack.packb(payload, use_bin_type=True)
+    dashboard_app.on_message(None, None, msg)
+
+
+def run(args):
+    rates = parse_rates(args.rates)
+    robot_ids = [f"bench_robot_{i}" for i in range(args.robots)]
+
+    store_lock = TimedLock()
+    dashboard_app.state_store._write_lock = store_lock
+    probe = EmitProbe(dashboard_app.emit_scheduler.emit_func)
+    dashboard_app.emit_scheduler.emit_func = probe
+
+    # Register robots up front so clients can subscribe before the load starts
+    for robot_index, robot_id in enumerate(robot_ids):
+        feed(robot_id, 'robot_status', make_payload('robot_status', robot_index, -1, args.image_format))
+    wait_for_drain()
+    clients = [dashboard_app.socketio.test_client(dashboard_app.app) for _ in range(args.clients)]
+    for client in clients:
+        for robot_id in robot_ids:
+            client.emit('subscribe', {'robot_id': robot_id}, callback=True)
+        client.get_received()
+    store_lock.hold_times = []
+    probe.latencies.clear()
+    probe.emit_costs.clear()
+
+    schedule = build_schedule(args.robots, rates, args.duration)
+    realtime = args.speed != 'max'
+    feed_times = []
+    wall_start = time.monotonic()
+    for seq, (offset, robot_index, sub_topic) in enumerate(schedule):
+        if realtime:
+            delay = wall_start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        payload = make_payload(sub_topic, robot_index, seq, args.image_format)
+        robot_id = robot_ids[robot_index]
+        probe.sent_at[(robot_id, sub_topic, seq)] = time.perf_counter()
+        started = time.perf_counter()
+        feed(robot_id, sub_topic, payload)
+        feed_times.append(time.perf_counter() - started)
+    feed_wall = time.monotonic() - wall_start
+    drained = wait_for_drain()
+    time.sleep(1.0) # Last coalesced emits flush after their rate window
+    total_wall = time.monotonic() - wall_start
+
+    decode_stats = dashboard_app.decode_pipeline.stats()
+    bench_keys = {k: v for k, v in decode_stats.items() if k.startswith('bench_robot_')}
+    processed = sum(v['processed'] for v in bench_keys.values()) - args.robots # Minus the registration messages
+    packets = sum(len(client.get_received()) for client in clients)
+    for client in clients:
+        client.disconnect()
+
+    results = {
+        'config': dict(vars(args), rates=rates),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'time': int(time.time())},
+        'throughput': {
+            'messages': len(schedule),
+            'feed_wall_s': round(feed_wall, 3),
+            'total_wall_s': round(total_wall, 3),
+            'ingest_msgs_per_s': round(len(schedule) / feed_wall, 1) if feed_wall else None,
+            'processed': processed,
+            'processed_msgs_per_s': round(processed / total_wall, 1) if total_wall else None,
+            'dropped': sum(v['dropped'] for v in bench_keys.values()),
+            'drained': drained,
+            'client_packets': packets,
+        },
+        'on_message_call': summarize(feed_times),
+        'ingest_to_emit_latency': {topic: summarize(samples) for topic, samples in sorted(probe.latencies.items())},
+        'emit_call': {topic: summarize(samples) for topic, samples in sorted(probe.emit_costs.items())},
+        'never_emitted': len(probe.sent_at), # Coalesced or dropped before emit
+        'store_lock_hold': summarize(store_lock.hold_times),
+        'memory': measure_memory(args.robots, rates, args.image_format),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--robots', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of synthetic traffic')
+    parser.add_argument('--rates', default=DEFAULT_RATES, help='messages/s per robot, e.g. robot_status=20,camera=5')
+    parser.add_argument('--image-format', choices=('msgpack', 'base64'), default='msgpack',
+                        help='camera pixels as msgpack bin or as a base64 string')
+    parser.add_argument('--speed', choices=('1', 'max'), default='1', help="'max' ignores the rates' timing")
+    parser.add_argument('--out', help='write the results JSON here')
+    args = parser.parse_args()
+
+    results = run(args)
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output)
+    sys.stdout.flush()
+    os._exit(0) # Background MQTT/decode threads are daemons; skip their shutdown
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Lock hold time: legacy deepcopy-under-lock dict vs the copy-on-write StateStore.
+
+Simulates the on_message store path (one write per message) and the handle_connect /
+/data read path (full-state snapshot) for a fleet with 640x480 bgr8 camera frames.
+`--scale` then measures the per-write cost at several fleet sizes, against a store that
+copies the whole root map on every write, to show it stays flat as robots register.
+
+    python bench_state_store.py [--robots 4] [--writes 200] [--reads 20] [--scale 10,100,1000]
+"""
+import argparse
+import copy
+import json
+import statistics
+import threading
+import time
+
+from state_store import FrozenDict, StateStore, make_robot_record, make_topic_entry
+
+SUB_TOPICS = ["robot_status", "lane_follow_cmd", "scan_multi", "gloal_path_gps", "camera", "routed_map"]
+
+
+def make_payload(sub_topic, as_list):
+    if sub_topic in ("camera", "routed_map"):
+        data = bytes(640 * 480 * 3)
+        return {'width': 640, 'height': 480, 'encoding': 'bgr8', 'step': 640 * 3, 'data': list(data) if as_list else data}
+    return {'gps': {'latitude': 21.0285, 'longitude': 105.8542}, 'speed': 1.2, 'state': 2}
+
+
+class TimedLock:
+    """Wraps a lock and records how long it is held."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hold_times = []
+        self._acquired_at = 0.0
+
+    def __enter__(self):
+        self.lock.acquire()
+        self._acquired_at = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.hold_times.append(time.perf_counter() - self._acquired_at)
+        self.lock.release()
+
+
+def summarize(samples):
+    ms = sorted(s * 1000 for s in samples)
+    if not ms:
+        return {}
+    return {
+        'count': len(ms),
+        'p50_ms': round(statistics.median(ms), 4),
+        'p99_ms': round(ms[min(len(ms) - 1, int(len(ms) * 0.99))], 4),
+        'max_ms': round(ms[-1], 4),
+    }
+
+
+def bench_legacy(robots, writes, reads):
+    """Old app.py behaviour: list image data, deepcopy on store and on every full read."""
+    latest_data = {r: {'last_seen': 0, 'topics': {t: {'payload': "waiting...", 'timestamp': 0} for t in SUB_TOPICS}} for r in robots}
+    lock = TimedLock()
+    for i in range(writes):
+        robot_id, sub_topic = robots[i % len(robots)], SUB_TOPICS[i % len(SUB_TOPICS)]
+        data_to_store = {'payload': make_payload(sub_topic, as_list=True), 'timestamp': i}
+        with lock:
+            latest_data[robot_id]['topics'][sub_topic] = copy.deepcopy(data_to_store)
+            latest_data[robot_id]['last_seen'] = i
+    write_times, lock.hold_times = lock.hold_times, []
+    for _ in range(reads):
+        with lock:
+            copy.deepcopy(latest_data)
+    return summarize(write_times), summarize(lock.hold_times)
+
+
+def bench_store(robots, writes, reads):
+    """StateStore: bytes image data, shallow copy-on-write under the lock, lock-free reads."""
+    store = StateStore()
+    timed = TimedLock()
+    store._write_lock = timed # Measure the store's own write lock
+    for r in robots:
+        store.ensure_robot(r, SUB_TOPICS)
+    timed.hold_times = []
+    for i in range(writes):
+        robot_id, sub_topic = robots[i % len(robots)], SUB_TOPICS[i % len(SUB_TOPICS)]
+        store.update_topic(robot_id, sub_topic, make_topic_entry(make_payload(sub_topic, as_list=False), i))
+    read_times = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        store.snapshot()
+        read_times.append(time.perf_counter() - start) # No lock taken; time to obtain the snapshot
+    return summarize(timed.hold_times), summarize(read_times)
+
+
+def bench_scaling(robot_counts, writes):
+    """Per-write time at each fleet size: StateStore vs copying the whole root map per write."""
+    payload = make_payload('robot_status', as_list=False)
+    results = {}
+    for count in robot_counts:
+        robots = [f"robot_{i}" for i in range(count)]
+        store = StateStore()
+        for r in robots:
+            store.ensure_robot(r, SUB_TOPICS)
+        store_times = []
+        for i in range(writes):
+            entry = make_topic_entry(payload, i)
+            start = time.perf_counter()
+            store.update_topic(robots[i % count], SUB_TOPICS[i % len(SUB_TOPICS)], entry)
+            store_times.append(time.perf_counter() - start)
+        root = FrozenDict({r: make_robot_record(0, {t: make_topic_entry("waiting...", 0) for t in SUB_TOPICS}) for r in robots})
+        root_times = []
+        for i in range(writes):
+            robot_id, sub_topic = robots[i % count], SUB_TOPICS[i % len(SUB_TOPICS)]
+            entry = make_topic_entry(payload, i)
+            start = time.perf_counter()
+            topics = dict(root[robot_id]['topics'])
+            topics[sub_topic] = entry
+            new_root = dict(root)
+            new_root[robot_id] = make_robot_record(i, topics)
+            root = FrozenDict(new_root)
+            root_times.append(time.perf_counter() - start)
+        results[count] = {'state_store_write': summarize(store_times), 'root_copy_write': summarize(root_times)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--robots', type=int, default=4)
+    parser.add_argument('--writes', type=int, default=200)
+    parser.add_argument('--reads', type=int, default=20)
+    parser.add_argument('--scale', default='10,100,1000', help="Fleet sizes for the per-write scaling case")
+    args = parser.parse_args()
+    robots = [f"robot_{i}" for i in range(args.robots)]
+
+    legacy_write, legacy_read = bench_legacy(robots, args.writes, args.reads)
+    store_write, store_read = bench_store(robots, args.writes, args.reads)
+    scaling = bench_scaling([int(count) for count in args.scale.split(',') if count.strip()], max(args.writes, 2000))
+    print(json.dumps({
+        'config': vars(args),
+        'legacy_deepcopy': {'store_lock_hold': legacy_write, 'snapshot_lock_hold': legacy_read},
+        'cow_state_store': {'store_lock_hold': store_write, 'snapshot_lock_hold': store_read},
+        'write_cost_by_robot_count': scaling,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Field-level deltas for structured topics (robot_status, lane_follow_cmd...).
+
+Every (robot_id, sub_topic) stream remembers the last payload it emitted and a sequence
+number. A new payload is sent as a patch against that one:
+
+    {'set': [[path, value], ...], 'unset': [path, ...]}
+
+where `path` is the list of nested dict keys. Lists and scalars are replaced whole.
+A full keyframe is sent for the first message, periodically, and whenever the payload
+is not a dict, so clients that missed a sequence number can recover without asking.
+"""
+import threading
+import time
+
+
+def diff(old, new, path=(), ops=None):
+    """Structural diff of two dicts -> {'set': [[path, value]], 'unset': [path]}."""
+    if ops is None:
+        ops = {'set': [], 'unset': []}
+    for key, value in new.items():
+        if key not in old:
+            ops['set'].append([list(path) + [key], value])
+            continue
+        previous = old[key]
+        if isinstance(value, dict) and isinstance(previous, dict):
+            diff(previous, value, path + (key,), ops)
+        elif value != previous or type(value) is not type(previous):
+            ops['set'].append([list(path) + [key], value])
+    for key in old:
+        if key not in new:
+            ops['unset'].append(list(path) + [key])
+    return ops
+
+
+class DeltaStream:
+    __slots__ = ('seq', 'entry', 'last_keyframe', 'lock')
+
+    def __init__(self):
+        self.seq = 0
+        self.entry = None # Last emitted topic entry (see state_store.make_topic_entry)
+        self.last_keyframe = 0.0
+        self.lock = threading.Lock()
+
+
+class DeltaEncoder:
+    """Per-stream sequence numbers and last-emitted payloads.
+
+    `encode` calls `emit(kind, seq, body)` while holding the stream lock, so the order in
+    which messages are handed to Socket.IO always matches their sequence numbers.
+    """
+
+    def __init__(self, keyframe_interval_s):
+        self.keyframe_interval_s = keyframe_interval_s
+        self.streams = {} # (robot_id, sub_topic) -> DeltaStream
+        self.keyframes = 0
+        self.deltas = 0
+        self.unchanged = 0 # Deltas with no operations (only the timestamp moved)
+        self._streams_lock = threading.Lock()
+
+    def _stream(self, key):
+        stream = self.streams.get(key)
+        if stream is None:
+            with self._streams_lock:
+                stream = self.streams.setdefault(key, DeltaStream())
+        return stream
+
+    def encode(self, key, entry, emit):
+        """Emit `entry` as a keyframe (body = entry) or a delta (body = ops)."""
+        stream = self._stream(key)
+        with stream.lock:
+            now = time.monotonic()
+            previous = stream.entry
+            stream.seq += 1
+            stream.entry = entry
+            if (previous is None or not isinstance(previous['payload'], dict) or not isinstance(entry['payload'], dict)
+                    or now - stream.last_keyframe >= self.keyframe_interval_s):
+                stream.last_keyframe = now
+                self.keyframes += 1
+                emit('keyframe', stream.seq, entry)
+                return
+            ops = diff(previous['payload'], entry['payload'])
+            self.deltas += 1
+            if not ops['set'] and not ops['unset']:
+                self.unchanged += 1
+            emit('delta', stream.seq, ops)
+
+    def forget_robot(self, robot_id):
+        with self._streams_lock:
+            for key in [key for key in self.streams if key[0] == robot_id]:
+                del self.streams[key]
+
+    def current(self, key):
+        """(seq, entry) last emitted on a stream, or None. Used to resync a client."""
+        stream = self.streams.get(key)
+        if stream is None:
+            return None
+        with stream.lock:
+            return (stream.seq, stream.entry) if stream.entry is not None else None
+
+    def stats(self):
+        return {
+            'streams': len(self.streams),
+            'keyframes': self.keyframes,
+            'deltas': self.deltas,
+            'unchanged': self.unchanged,
+            'keyframe_interval_s': self.keyframe_interval_s,
+        }
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""Cooperative paho-mqtt network loop on the eventlet hub (MQTT_DRIVER=green).
+
+paho's loop_forever() selects on the MQTT socket plus an internal wake-up socket pair,
+reads one packet per select, and handles reconnects with its own fixed sleep. This driver
+parks on the hub until the MQTT socket is readable (eventlet.hubs.trampoline). It then
+calls loop_read until the socket is drained (up to `max_packets`) and uses loop_write /
+loop_misc for queued packets and keepalive. The MQTT socket is one more fd on the hub,
+and a burst of messages is handled in one wake-up.
+
+Reconnects use exponential backoff with full jitter, so many dashboards restarting
+together do not hit the broker in lockstep. A failed connect only sleeps this green
+thread:
+
+    driver = GreenMQTTDriver(make_client, host, port, keepalive, stop_event)
+    eventlet.spawn(driver.run)
+"""
+import logging
+import random
+import socket
+import time
+
+import paho.mqtt.client as mqtt
+from eventlet.hubs import trampoline
+from eventlet.timeout import Timeout
+
+log = logging.getLogger('DashboardApp')
+
+
+def backoff_delays(initial, maximum, rng=random):
+    """Full-jitter exponential backoff: attempt n waits uniform(0, min(maximum, initial * 2**n))."""
+    attempt = 0
+    while True:
+        yield rng.uniform(0, min(maximum, initial * 2 ** attempt))
+        attempt += 1
+
+
+class GreenMQTTDriver:
+    """Runs one paho client's connection on the calling green thread, reconnecting until `stop_event` is set.
+
+    `client_factory()` returns a configured, unconnected client (callbacks, credentials);
+    a fresh client is built for every connection attempt.
+    """
+
+    def __init__(self, client_factory, host, port, keepalive, stop_event,
+                 backoff_initial=1.0, backoff_max=60.0, max_packets=256, tick=1.0):
+        self.client_factory = client_factory
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.stop_event = stop_event
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_packets = max_packets
+        self.tick = tick # Max wait for data before loop_misc runs (keepalive pings)
+        self.client = None
+        self.connected_since = None
+        self.connects = 0
+        self.reconnect_attempts = 0
+        self.wakeups = 0
+        self.packets = 0
+        self.max_batch = 0
+        self.last_backoff = None
+        self.last_error = None
+
+    def run(self):
+        delays = None
+        log.info("MQTT Listener: green driver started.")
+        while not self.stop_event.is_set():
+            client = self.client = self.client_factory()
+            session_ok = False
+            try:
+                log.info(f"MQTT Listener: Attempting connection to {self.host}:{self.port}...")
+                client.connect(self.host, self.port, self.keepalive) # Green socket: only this green thread waits
+                session_ok = self._loop(client)
+            except OSError as e:
+                self.last_error = str(e)
+                log.error(f"MQTT Listener: Network Error: {e}")
+            except Exception as e:
+                self.last_error = str(e)
+                log.exception(f"MQTT Listener: Unexpected error in green driver: {e}")
+            finally:
+                self.connected_since = None
+                try:
+                    client.disconnect()
+                except Exception: pass
+            if self.stop_event.is_set():
+                break
+            if session_ok or delays is None:
+                delays = backoff_delays(self.backoff_initial, self.backoff_max) # Start over after a good session
+            self.last_backoff = next(delays)
+            self.reconnect_attempts += 1
+            log.warning(f"MQTT Listener: reconnecting in {self.last_backoff:.1f}s")
+            self.stop_event.wait(self.last_backoff)
+        log.info("MQTT Listener: green driver finished.")
+
+    def _loop(self, client):
+        """Serve one connection until it drops. Returns True if the broker accepted it."""
+        accepted = False
+        while not self.stop_event.is_set():
+            sock = client.socket()
+            if sock is None:
+                break
+            if client.want_write() and client.loop_write() != mqtt.MQTT_ERR_SUCCESS:
+                break
+            try:
+                trampoline(sock, read=True, timeout=self.tick)
+                readable = True
+            except Timeout:
+                readable = False
+            if readable and self._drain(client, sock) != mqtt.MQTT_ERR_SUCCESS:
+                break
+            if client.loop_misc() != mqtt.MQTT_ERR_SUCCESS:
+                break
+            if not accepted and client.is_connected():
+                accepted = True
+                self.connects += 1
+                self.connected_since = time.time()
+        return accepted
+
+    def _drain(self, client, sock):
+        """loop_read (one packet per call) until the socket has nothing buffered."""
+        self.wakeups += 1
+        for count in range(1, self.max_packets + 1):
+            rc = client.loop_read()
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                return rc
+            try:
+                more = sock.recv(1, socket.MSG_PEEK)
+            except BlockingIOError:
+                more = None
+            except OSError: # Closed by paho while handling the packet
+                more = None
+            if not more:
+                if more == b'': # EOF: one more read lets paho notice and report the lost connection
+                    return client.loop_read()
+                break
+        self.packets += count
+        self.max_batch = max(self.max_batch, count)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def is_connected(self):
+        return self.client is not None and self.client.is_connected()
+
+    def stats(self):
+        return {
+            'driver': 'green',
+            'connected': self.is_connected(),
+            'connected_since': self.connected_since,
+            'connects': self.connects,
+            'reconnect_attempts': self.reconnect_attempts,
+            'last_backoff_s': round(self.last_backoff, 3) if self.last_backoff is not None else None,
+            'last_error': self.last_error,
+            'wakeups': self.wakeups,
+            'packets': self.packets,
+            'avg_packets_per_wakeup': round(self.packets / self.wakeups, 2) if self.wakeups else None,
+            'max_packets_per_wakeup': self.max_batch,
+        }
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Bounded time-series history of numeric topic fields (robot_status battery, speed, GPS...).
+
+Each (robot_id, sub_topic) gets a fixed-capacity ring buffer: one float64 NumPy column for
+the receive timestamps and one per numeric field, addressed by dotted path ("gps.latitude").
+Columns are allocated when a field first appears, and no more are allocated once the
+configured memory budget is spent. Queries return data columnar, optionally downsampled to
+min/max/avg buckets.
+"""
+import threading
+
+import numpy as np
+
+_BYTES_PER_SAMPLE = 8 # float64
+
+
+def extract_numeric_fields(payload, prefix='', max_depth=4, out=None):
+    """Flatten the numeric (and bool) leaves of nested dicts to {'a.b': float}. Lists are skipped."""
+    if out is None:
+        out = {}
+    if not isinstance(payload, dict) or max_depth < 0:
+        return out
+    for key, value in payload.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, (int, float)): # bool is an int subclass
+            out[path] = float(value)
+        elif isinstance(value, dict):
+            extract_numeric_fields(value, path + '.', max_depth - 1, out)
+    return out
+
+
+class TopicHistory:
+    """Ring buffer for one robot/topic. `head` is the next write slot; `count` samples are valid."""
+    __slots__ = ('capacity', 'timestamps', 'columns', 'head', 'count', 'lock')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.columns = {} # field -> float64 array, NaN where the field was absent
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def nbytes(self):
+        return self.timestamps.nbytes + sum(column.nbytes for column in self.columns.values())
+
+    def ordered(self, column):
+        """Valid samples of a column, oldest first."""
+        if self.count < self.capacity:
+            return column[:self.count].copy()
+        return np.concatenate((column[self.head:], column[:self.head]))
+
+
+class HistoryStore:
+    """Per robot/topic TopicHistory ring buffers sharing one memory budget."""
+
+    def __init__(self, capacity, max_bytes, max_fields=32):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.max_fields = max_fields
+        self.series = {} # (robot_id, sub_topic) -> TopicHistory
+        self.allocated_bytes = 0
+        self.dropped_fields = 0 # Values not stored because their column would exceed the budget / field limit
+        self._alloc_lock = threading.Lock()
+
+    def _reserve(self, nbytes):
+        with self._alloc_lock:
+            if self.allocated_bytes + nbytes > self.max_bytes:
+                self.dropped_fields += 1
+                return False
+            self.allocated_bytes += nbytes
+            return True
+
+    def _get_series(self, robot_id, sub_topic):
+        key = (robot_id, sub_topic)
+        history = self.series.get(key)
+        if history is None:
+            with self._alloc_lock:
+                history = self.series.get(key)
+                if history is None:
+                    if self.allocated_bytes + self.capacity * _BYTES_PER_SAMPLE > self.max_bytes:
+                        return None
+                    history = TopicHistory(self.capacity)
+                    self.allocated_bytes += history.timestamps.nbytes
+                    self.series[key] = history
+        return history
+
+    def record(self, robot_id, sub_topic, timestamp_ms, payload):
+        """Append the numeric fields of a decoded payload. Returns False if nothing was stored."""
+        fields = extract_numeric_fields(payload)
+        if not fields:
+            return False
+        history = self._get_series(robot_id, sub_topic)
+        if history is None:
+            return False
+        with history.lock:
+            slot = history.head
+            history.timestamps[slot] = timestamp_ms
+            for field, value in fields.items():
+                column = history.columns.get(field)
+                if column is None:
+                    if len(history.columns) >= self.max_fields:
+                        self.dropped_fields += 1
+                        continue
+                    if not self._reserve(self.capacity * _BYTES_PER_SAMPLE):
+                        continue
+                    column = history.columns[field] = np.full(self.capacity, np.nan)
+                column[slot] = value
+            for field, column in history.columns.items():
+                if field not in fields:
+                    column[slot] = np.nan
+            history.head = (slot + 1) % history.capacity
+            history.count = min(history.count + 1, history.capacity)
+        return True
+
+    def remove_robot(self, robot_id):
+        """Free every series of a robot and return its bytes to the budget."""
+        with self._alloc_lock:
+            for key in [key for key in self.series if key[0] == robot_id]:
+                self.allocated_bytes -= self.series.pop(key).nbytes()
+
+    def fields(self, robot_id, sub_topic):
+        history = self.series.get((robot_id, sub_topic))
+        return sorted(history.columns) if history else []
+
+    def query(self, robot_id, sub_topic, since=None, fields=None, downsample=None):
+        """Columnar history: {'timestamp': [...], 'columns': {field: [...]}}.
+
+        With `downsample=N`, samples are split into at most N equal-count buckets and every
+        field becomes {'min': [...], 'max': [...], 'avg': [...]}; 'timestamp' is each bucket's
+        first sample. Missing values are None. Returns None for an unknown robot/topic.
+        """
+        history = self.series.get((robot_id, sub_topic))
+        if history is None:
+            return None
+        with history.lock:
+            names = [f for f in (fields or sorted(history.columns)) if f in history.columns]
+            timestamps = history.ordered(history.timestamps)
+            columns = {name: history.ordered(history.columns[name]) for name in names}
+        if since is not None:
+            keep = timestamps >= since
+            timestamps = timestamps[keep]
+            columns = {name: column[keep] for name, column in columns.items()}
+
+        if downsample and 0 < downsample < len(timestamps):
+            starts = np.unique(np.linspace(0, len(timestamps), downsample, endpoint=False).astype(np.intp))
+            result_columns = {}
+            for name, column in columns.items():
+                present = ~np.isnan(column)
+                counts = np.add.reduceat(present, starts)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    avg = np.add.reduceat(np.where(present, column, 0.0), starts) / counts
+                result_columns[name] = {
+                    'min': _to_list(np.fmin.reduceat(column, starts)),
+                    'max': _to_list(np.fmax.reduceat(column, starts)),
+                    'avg': _to_list(avg),
+                }
+            return {'timestamp': timestamps[starts].astype(np.int64).tolist(), 'columns': result_columns, 'downsampled': True}
+        return {
+            'timestamp': timestamps.astype(np.int64).tolist(),
+            'columns': {name: _to_list(column) for name, column in columns.items()},
+            'downsampled': False,
+        }
+
+    def stats(self):
+        return {
+            'series': len(self.series),
+            'capacity': self.capacity,
+            'allocated_bytes': self.allocated_bytes,
+            'max_bytes': self.max_bytes,
+            'dropped_fields': self.dropped_fields,
+            'samples': {f"{robot_id}/{sub_topic}": history.count for (robot_id, sub_topic), history in self.series.items()},
+        }
+
+
+def _to_list(column):
+    """float array -> list with None for NaN (JSON has no NaN)."""
+    return [None if value != value else value for value in column.tolist()]
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Server-side transcoding of ROS Image payloads (camera, routed_map) to PNG/JPEG.
+
+Pixel conversion is vectorized with NumPy and mirrors the browser decoder (drawMap in
+static/js/app.js). Encoded frames are kept in a small LRU cache keyed on the frame
+timestamp and output size, so every viewer of a frame shares one encode.
+"""
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+# encoding -> bytes per pixel
+SUPPORTED_ENCODINGS = {
+    'mono8': 1, '8UC1': 1, 'mono16': 2, '16UC1': 2,
+    'rgb8': 3, 'bgr8': 3, '8UC3': 3, 'rgba8': 4, 'bgra8': 4,
+}
+IMAGE_FORMATS = {'png': ('PNG', 'image/png'), 'jpeg': ('JPEG', 'image/jpeg')}
+# Requested sizes are rounded up to one of these max dimensions (None = full resolution)
+FRAME_SIZE_BUCKETS = (160, 320, 640, 1280)
+
+
+class TranscodeError(ValueError):
+    """The image message cannot be converted (bad structure, encoding or size)."""
+
+
+def image_to_array(image_msg):
+    """Convert a ROS Image dict ({width, height, encoding, step?, data}) to an HxW[xC] uint8 array."""
+    try:
+        width, height = int(image_msg['width']), int(image_msg['height'])
+        encoding = image_msg['encoding']
+        data = image_msg['data']
+    except (KeyError, TypeError, ValueError) as e:
+        raise TranscodeError(f"Invalid image message: {e}")
+    if encoding not in SUPPORTED_ENCODINGS:
+        raise TranscodeError(f"Unsupported encoding '{encoding}'")
+    if width <= 0 or height <= 0:
+        raise TranscodeError(f"Invalid image size {width}x{height}")
+    bpp = SUPPORTED_ENCODINGS[encoding]
+    row_bytes = width * bpp
+    step = int(image_msg.get('step') or row_bytes)
+    if step < row_bytes:
+        step = row_bytes
+
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        buf = np.frombuffer(data, dtype=np.uint8)
+    else:
+        buf = np.asarray(data, dtype=np.uint8) # Legacy list-of-ints payloads
+    if buf.size < step * (height - 1) + row_bytes:
+        raise TranscodeError(f"Image data too short ({buf.size} bytes for {width}x{height} {encoding})")
+    if buf.size < step * height:
+        buf = np.pad(buf, (0, step * height - buf.size)) # Last row may omit its padding
+    rows = buf[:step * height].reshape(height, step)[:, :row_bytes]
+
+    if bpp == 1:
+        return rows
+    if bpp == 2: # 16-bit grey -> 8-bit, honouring is_bigendian like the JS decoder (little endian default)
+        dtype = '>u2' if image_msg.get('is_bigendian') else '<u2'
+        return (np.ascontiguousarray(rows).view(dtype) >> 8).astype(np.uint8)
+    pixels = rows.reshape(height, width, bpp)
+    if encoding in ('bgr8', '8UC3'):
+        return pixels[:, :, ::-1]
+    if encoding == 'bgra8':
+        return pixels[:, :, [2, 1, 0, 3]]
+    return pixels
+
+
+def size_bucket(max_dim):
+    """Round a requested max dimension up to a cache bucket; None/0/too large means full size."""
+    if not max_dim:
+        return None
+    for bucket in FRAME_SIZE_BUCKETS:
+        if max_dim <= bucket:
+            return bucket
+    return None
+
+
+def transcode(image_msg, image_format='jpeg', max_dim=None, quality=80):
+    """Encode an image message as PNG/JPEG bytes, downscaled so neither side exceeds max_dim."""
+    if image_format not in IMAGE_FORMATS:
+        raise TranscodeError(f"Unsupported output format '{image_format}'")
+    image = Image.fromarray(np.ascontiguousarray(image_to_array(image_msg))) # L, RGB or RGBA from the shape
+    if max_dim and max(image.size) > max_dim:
+        scale = max_dim / max(image.size)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BILINEAR)
+    pil_format, _ = IMAGE_FORMATS[image_format]
+    if pil_format == 'JPEG' and image.mode == 'RGBA':
+        image = image.convert('RGB')
+    out = io.BytesIO()
+    if pil_format == 'JPEG':
+        image.save(out, pil_format, quality=quality)
+    else:
+        image.save(out, pil_format, compress_level=6)
+    return out.getvalue()
+
+
+class FrameCache:
+    """Thread-safe LRU of encoded frames keyed on (robot_id, sub_topic, timestamp, format, size)."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_or_encode(self, key, encode):
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+                self.hits += 1
+                return frame
+            self.misses += 1
+        frame = encode() # Outside the lock; a concurrent duplicate encode is harmless
+        with self.lock:
+            if key not in self.frames:
+                self.frames[key] = frame
+                self.total_bytes += len(frame)
+            while self.total_bytes > self.max_bytes and len(self.frames) > 1:
+                _, evicted = self.frames.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return frame
+
+    def stats(self):
+        with self.lock:
+            return {'frames': len(self.frames), 'bytes': self.total_bytes, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""Partitioned MQTT ingestion (INGEST_PARTITIONS > 1).
+
+The process that serves clients (DASHBOARD_ROLE=standalone or ingest) supervises N
+`python app.py` children with DASHBOARD_ROLE=partition. Each child runs the usual listener
+and decode pipeline on its share of the traffic and publishes its stored entries on its own
+state bus; the supervisor mirrors every partition bus into its store. The traffic is
+split in one of two ways:
+
+    shared  every partition joins the MQTT 5 shared subscription $share/<group>/+/r2s/#; the
+            broker delivers each message to one member and rebalances when a member leaves
+    hash    every partition subscribes to +/r2s/# and keeps only the robots that
+            rendezvous-hash to it among the live partitions, so when a partition dies only
+            its robots move, and they move back when it is healthy again
+
+Control frames go to each child's stdin (4-byte big-endian length + msgpack):
+['live', [partition indexes]]. A child stops when its stdin closes, so partitions never
+outlive their supervisor.
+"""
+import hashlib
+import logging
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import msgpack
+
+import state_bus
+
+log = logging.getLogger('DashboardApp')
+
+_FRAME_HEADER = struct.Struct('>I')
+PARTITION_MODES = ('shared', 'hash')
+
+
+def partition_for(robot_id, live):
+    """Owner of robot_id among the live partition indexes (rendezvous hashing, same in every process)."""
+    return max(live, key=lambda index: hashlib.blake2b(f"{index}:{robot_id}".encode(), digest_size=8).digest())
+
+
+class PartitionFilter:
+    """Hash mode, inside a partition: whether a robot belongs to this partition. Cached per robot."""
+
+    def __init__(self, index, count):
+        self.index = index
+        self._state = (tuple(range(count)), {}) # (live indexes, robot_id -> owned), replaced together
+
+    @property
+    def live(self):
+        return self._state[0]
+
+    def owns(self, robot_id):
+        live, owned = self._state
+        result = owned.get(robot_id)
+        if result is None:
+            result = owned[robot_id] = partition_for(robot_id, live) == self.index
+        return result
+
+    def set_live(self, live):
+        self._state = (tuple(sorted(live)) or (self.index,), {})
+
+
+def write_control(stream, message):
+    body = msgpack.packb(message, use_bin_type=True)
+    stream.write(_FRAME_HEADER.pack(len(body)) + body)
+    stream.flush()
+
+
+def read_control(stream):
+    """Next control frame, or None once the supervisor has closed the pipe."""
+    header = stream.read(_FRAME_HEADER.size)
+    if len(header) < _FRAME_HEADER.size:
+        return None
+    (size,) = _FRAME_HEADER.unpack(header)
+    body = stream.read(size)
+    if len(body) < size:
+        return None
+    return msgpack.unpackb(body, raw=False)
+
+
+class Partition:
+    __slots__ = ('index', 'bus_url', 'proc', 'subscriber', 'healthy', 'since', 'restarts', 'failures', 'next_restart')
+
+    def __init__(self, index, bus_url):
+        self.index = index
+        self.bus_url = bus_url
+        self.proc = None
+        self.subscriber = None
+        self.healthy = False
+        self.since = 0.0 # monotonic time of the last spawn or healthy check
+        self.restarts = 0
+        self.failures = 0 # Consecutive failures, for the restart backoff
+        self.next_restart = 0.0
+
+
+class PartitionSupervisor:
+    """Spawns the partition processes, mirrors their buses and restarts the ones that fail.
+
+    A partition is healthy while its process runs and its bus is connected. Losing either
+    takes it out of the live set that hash-mode partitions split the robots over. A dead
+    process is respawned with exponential backoff. A process whose bus stays down for
+    `stall_timeout` seconds is killed and respawned.
+    """
+
+    def __init__(self, count, bus_url_template, handler, mode='shared', script=None, env=None,
+                 health_interval=2.0, stall_timeout=15.0, restart_delay=1.0, max_restart_delay=30.0):
+        if mode not in PARTITION_MODES:
+            raise ValueError(f"Unknown partition mode '{mode}' (expected one of {', '.join(PARTITION_MODES)})")
+        self.count = count
+        self.mode = mode
+        self.handler = handler # (partition index, bus message)
+        self.script = script or os.path.abspath(sys.argv[0])
+        self.env = env or {}
+        self.health_interval = health_interval
+        self.stall_timeout = stall_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.partitions = [Partition(index, bus_url_template.format(index=index)) for index in range(count)]
+        self.live_broadcasts = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.monitor_thread = None
+
+    def running(self):
+        return self.monitor_thread is not None and self.monitor_thread.is_alive()
+
+    def start(self):
+        if self.running():
+            return
+        for partition in self.partitions:
+            partition.subscriber = state_bus.create_subscriber(
+                partition.bus_url, lambda message, index=partition.index: self.handler(index, message))
+            self._spawn(partition)
+            partition.subscriber.start()
+        self.monitor_thread = threading.Thread(target=self._monitor_loop, name="PartitionSupervisor", daemon=True)
+        self.monitor_thread.start()
+        log.info(f"🧩 Started {self.count} ingest partitions ({self.mode} mode)")
+
+    def _spawn(self, partition):
+        if partition.proc is not None and partition.proc.stdin is not None:
+            try:
+                partition.proc.stdin.close() # The previous process's control pipe
+            except OSError:
+                pass
+        env = dict(os.environ, **self.env,
+                   DASHBOARD_ROLE='partition', INGEST_PARTITION=str(partition.index), INGEST_PARTITIONS=str(self.count),
+                   INGEST_PARTITION_MODE=self.mode, STATE_BUS_URL=partition.bus_url)
+        partition.proc = subprocess.Popen([sys.executable, self.script], stdin=subprocess.PIPE, env=env)
+        partition.since = time.monotonic()
+        log.info(f"🧩 Partition {partition.index} started (pid {partition.proc.pid})")
+
+    def _monitor_loop(self):
+        while not self.stopped.wait(self.health_interval):
+            try:
+                self.check()
+            except Exception as e:
+                log.exception(f"Partition health check failed: {e}")
+
+    def check(self):
+        """One health pass: update the live set, restart dead or stalled partitions."""
+        now = time.monotonic()
+        changed = False
+        with self.lock:
+            for partition in self.partitions:
+                exit_code = partition.proc.poll()
+                if exit_code is not None:
+                    if partition.healthy:
+                        log.warning(f"🧩 Partition {partition.index} exited with code {exit_code}")
+                    changed |= self._set_health(partition, False)
+                    if now >= partition.next_restart:
+                        partition.failures += 1
+                        partition.restarts += 1
+                        partition.next_restart = now + min(self.max_restart_delay, self.restart_delay * 2 ** partition.failures)
+                        self._spawn(partition)
+                elif partition.subscriber.connected:
+                    if not partition.healthy:
+                        partition.failures = 0
+                    changed |= self._set_health(partition, True)
+                    partition.since = now
+                else:
+                    changed |= self._set_health(partition, False)
+                    if now - partition.since > self.stall_timeout:
+                        log.warning(f"🧩 Partition {partition.index} bus down for {self.stall_timeout}s; restarting it")
+                        partition.proc.kill() # Respawned by the next pass
+        if changed:
+            self.broadcast_live()
+
+    def _set_health(self, partition, healthy):
+        if partition.healthy == healthy:
+            return False
+        partition.healthy = healthy
+        log.info(f"🧩 Partition {partition.index} is {'healthy' if healthy else 'down'}")
+        return True
+
+    def live(self):
+        return [partition.index for partition in self.partitions if partition.healthy]
+
+    def broadcast_live(self):
+        live = self.live()
+        for partition in self.partitions:
+            if partition.proc is None or partition.proc.poll() is not None:
+                continue
+            try:
+                write_control(partition.proc.stdin, ['live', live])
+            except (OSError, ValueError):
+                pass # Dying; the next health pass notices
+        self.live_broadcasts += 1
+        log.info(f"🧩 Live partitions: {live}")
+
+    def stop(self):
+        self.stopped.set()
+        for partition in self.partitions:
+            if partition.subscriber is not None:
+                partition.subscriber.stop()
+            if partition.proc is not None and partition.proc.poll() is None:
+                try:
+                    partition.proc.stdin.close() # The child shuts down when its control pipe closes
+                except OSError:
+                    pass
+        deadline = time.monotonic() + 3.0
+        for partition in self.partitions:
+            if partition.proc is None:
+                continue
+            try:
+                partition.proc.wait(timeout=max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                partition.proc.kill()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'live': self.live(),
+                'live_broadcasts': self.live_broadcasts,
+                'partitions': [{
+                    'index': partition.index,
+                    'pid': partition.proc.pid if partition.proc else None,
+                    'healthy': partition.healthy,
+                    'restarts': partition.restarts,
+                    'bus': partition.subscriber.stats() if partition.subscriber else None,
+                } for partition in self.partitions],
+            }
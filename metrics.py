@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""Low-overhead counters, gauges and fixed-bucket histograms, rendered as Prometheus text.
+
+Metrics are registered once at import time and updated from the hot paths (on_message,
+decode, store, emit, publish). An update is a dict lookup plus a few integer/float
+additions and takes no lock: every caller runs on an eventlet green thread, and green
+threads never switch in the middle of these methods. Series are keyed by label values
+in declaration order:
+
+    MESSAGES = registry.counter('dashboard_mqtt_messages_total', 'Messages received', ('robot_id', 'sub_topic'))
+    MESSAGES.inc('bulldog01_5f899b', 'robot_status')
+"""
+import bisect
+import threading
+import time
+
+# Seconds; covers sub-millisecond lock waits up to multi-second publish stalls
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _finite(value):
+    return None if value == float('inf') else value # JSON has no Infinity
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.series = {} # label values tuple -> value / histogram state
+
+    def remove(self, **labels):
+        """Drop every series whose labels match, e.g. remove(robot_id='sim_robot_1')."""
+        positions = [(self.label_names.index(name), value) for name, value in labels.items()]
+        for key in [key for key in self.series if all(key[i] == value for i, value in positions)]:
+            self.series.pop(key, None)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self.series.get(label_values, 0)
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+    def snapshot(self):
+        return [{'labels': dict(zip(self.label_names, key)), 'value': value} for key, value in sorted(self.series.items())]
+
+
+class Gauge(_Metric):
+    """Value read from `func` at render time: func() -> number, or {label values tuple: number}."""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, func, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self.func = func
+
+    def _values(self):
+        value = self.func()
+        return sorted(value.items()) if isinstance(value, dict) else [((), value)]
+
+    def render(self):
+        lines = self.header()
+        for key, value in self._values():
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+    def snapshot(self):
+        return [{'labels': dict(zip(self.label_names, key)), 'value': value} for key, value in self._values()]
+
+
+class Histogram(_Metric):
+    """Fixed upper bounds; each series is [count per bucket (+Inf last)..., sum, count]."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.bounds = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series.setdefault(label_values, [0] * (len(self.bounds) + 1) + [0.0, 0])
+        series[bisect.bisect_left(self.bounds, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def quantile(self, q, *label_values):
+        """Upper bound of the bucket holding the q-th observation (None without data)."""
+        series = self.series.get(label_values)
+        if not series or not series[-1]:
+            return None
+        rank = q * series[-1]
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),), series):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = self.header()
+        for key, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float('inf'),), series):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+    def snapshot(self):
+        result = []
+        for key, series in sorted(self.series.items()):
+            count = series[-1]
+            result.append({
+                'labels': dict(zip(self.label_names, key)),
+                'count': count,
+                'sum': series[-2],
+                'avg': series[-2] / count if count else None,
+                'p50': _finite(self.quantile(0.5, *key)),
+                'p99': _finite(self.quantile(0.99, *key)),
+            })
+        return result
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock() # Registration only
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, func, label_names=()):
+        return self._register(Gauge(name, help_text, func, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def remove(self, **labels):
+        """Drop matching series from every metric that has those labels (e.g. a removed robot)."""
+        for metric in list(self.metrics.values()):
+            if all(name in metric.label_names for name in labels) and not isinstance(metric, Gauge):
+                metric.remove(**labels)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """JSON-friendly view: {name: {'type', 'help', 'series': [...]}}; histograms carry avg/p50/p99."""
+        return {
+            name: {'type': metric.kind, 'help': metric.help, 'series': metric.snapshot()}
+            for name, metric in list(self.metrics.items())
+        }
+
+
+class InstrumentedLock:
+    """Drop-in for threading.Lock in `with` blocks that records the wait to acquire it."""
+
+    def __init__(self, histogram, *label_values, lock=None):
+        self.lock = lock or threading.Lock()
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        self.histogram.observe(time.perf_counter() - started, *self.label_values)
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
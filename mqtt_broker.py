@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Minimal local MQTT broker for development and load tests, without the production broker.
+
+QoS 0 delivery only (QoS 1 publishes are acknowledged, then delivered as QoS 0), no
+retained messages, will messages or authentication. Clients may speak MQTT 3.1.1 or 5.
+Shared subscriptions (`$share/<group>/<filter>`) deliver each message to one member of the
+group in turn, so partitioned ingestion (INGEST_PARTITIONS) can be exercised locally:
+
+    python mqtt_broker.py --port 1883
+    MQTT_HOST=127.0.0.1 MQTT_PORT=1883 INGEST_PARTITIONS=4 python app.py
+    python mqtt_recorder.py replay traffic.rec --target broker --host 127.0.0.1 --port 1883
+"""
+import argparse
+import itertools
+import logging
+import socket
+import struct
+import threading
+
+log = logging.getLogger('MQTTBroker')
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+MQTT_V5 = 5
+_UINT16 = struct.Struct('>H')
+
+
+class ProtocolError(Exception):
+    """The client sent a malformed or unsupported packet."""
+
+
+def topic_matches(topic_filter, topic):
+    """MQTT wildcard match: '+' is one level, a trailing '#' any number of levels (including none)."""
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _packet(packet_type, body, flags=0):
+    return bytes([packet_type << 4 | flags]) + _encode_length(len(body)) + body
+
+
+def _utf8(value):
+    data = value.encode('utf-8')
+    return _UINT16.pack(len(data)) + data
+
+
+def _read_length(read):
+    length, multiplier = 0, 1
+    for _ in range(4):
+        byte = read(1)[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return length
+        multiplier *= 128
+    raise ProtocolError("Malformed remaining length")
+
+
+class _Reader:
+    """Cursor over one packet body."""
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def take(self, size):
+        if self.offset + size > len(self.data):
+            raise ProtocolError("Packet shorter than its fields")
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def uint16(self):
+        return _UINT16.unpack(self.take(2))[0]
+
+    def utf8(self):
+        return self.take(self.uint16()).decode('utf-8')
+
+    def skip_properties(self):
+        self.take(_read_length(self.take))
+
+    def rest(self):
+        return self.data[self.offset:]
+
+
+class _Session:
+    __slots__ = ('sock', 'address', 'client_id', 'protocol', 'lock', 'subscriptions', 'received', 'sent')
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.client_id = None
+        self.protocol = 4
+        self.lock = threading.Lock()
+        self.subscriptions = set() # Topic filters as subscribed, including $share/<group>/ prefixes
+        self.received = 0
+        self.sent = 0
+
+    def send(self, data):
+        with self.lock:
+            self.sock.sendall(data)
+
+
+class Broker:
+    """Threaded broker: one thread per client connection."""
+
+    def __init__(self, host='127.0.0.1', port=1883):
+        self.host = host
+        self.port = port
+        self.sessions = set()
+        self.shared = {} # (group, filter) -> [sessions]
+        self.shared_turn = {} # (group, filter) -> itertools.count for round-robin
+        self.lock = threading.Lock()
+        self.listener = None
+        self.stopped = threading.Event()
+        self.published = 0
+
+    def start(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(128)
+        self.port = listener.getsockname()[1] # Resolves port 0
+        self.listener = listener
+        threading.Thread(target=self._accept_loop, name="BrokerAccept", daemon=True).start()
+        log.info(f"MQTT broker listening on {self.host}:{self.port}")
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.listener is not None:
+            self.listener.close()
+        with self.lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            self.disconnect(session)
+
+    def disconnect(self, session):
+        """Drop a client connection (also used by tests to simulate a network failure)."""
+        try:
+            session.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _accept_loop(self):
+        while not self.stopped.is_set():
+            try:
+                sock, address = self.listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _Session(sock, address)
+            threading.Thread(target=self._serve, args=(session,), name=f"Broker-{address[1]}", daemon=True).start()
+
+    def _serve(self, session):
+        stream = session.sock.makefile('rb')
+
+        def read(size):
+            data = stream.read(size)
+            if len(data) < size:
+                raise ProtocolError("Connection closed mid-packet")
+            return data
+
+        try:
+            while not self.stopped.is_set():
+                header = stream.read(1)
+                if not header:
+                    break
+                body = read(_read_length(read))
+                packet_type, flags = header[0] >> 4, header[0] & 0x0F
+                if packet_type == DISCONNECT:
+                    break
+                self._handle(session, packet_type, flags, _Reader(body))
+        except (OSError, ProtocolError, IndexError, UnicodeDecodeError) as e:
+            log.info(f"Client {session.client_id or session.address} dropped: {e}")
+        finally:
+            self._remove(session)
+            try:
+                session.sock.close()
+            except OSError:
+                pass
+
+    def _handle(self, session, packet_type, flags, reader):
+        if packet_type == CONNECT:
+            reader.utf8() # Protocol name
+            session.protocol = reader.take(1)[0]
+            reader.take(3) # Connect flags, keepalive
+            if session.protocol == MQTT_V5:
+                reader.skip_properties()
+            session.client_id = reader.utf8() or f"anonymous-{session.address[1]}"
+            with self.lock:
+                self.sessions.add(session)
+            session.send(_packet(CONNACK, b'\x00\x00\x00' if session.protocol == MQTT_V5 else b'\x00\x00'))
+        elif packet_type == PUBLISH:
+            topic = reader.utf8()
+            qos = (flags >> 1) & 0x03
+            packet_id = reader.uint16() if qos else None
+            if session.protocol == MQTT_V5:
+                reader.skip_properties()
+            session.received += 1
+            if packet_id is not None:
+                session.send(_packet(PUBACK, _UINT16.pack(packet_id)))
+            self.publish(topic, reader.rest())
+        elif packet_type == SUBSCRIBE:
+            packet_id = reader.uint16()
+            if session.protocol == MQTT_V5:
+                reader.skip_properties()
+            codes = bytearray()
+            while reader.offset < len(reader.data):
+                self._subscribe(session, reader.utf8())
+                reader.take(1) # Requested options; everything is granted QoS 0
+                codes.append(0)
+            props = b'\x00' if session.protocol == MQTT_V5 else b''
+            session.send(_packet(SUBACK, _UINT16.pack(packet_id) + props + bytes(codes)))
+        elif packet_type == UNSUBSCRIBE:
+            packet_id = reader.uint16()
+            if session.protocol == MQTT_V5:
+                reader.skip_properties()
+            count = 0
+            while reader.offset < len(reader.data):
+                self._unsubscribe(session, reader.utf8())
+                count += 1
+            tail = b'\x00' + b'\x00' * count if session.protocol == MQTT_V5 else b''
+            session.send(_packet(UNSUBACK, _UINT16.pack(packet_id) + tail))
+        elif packet_type == PINGREQ:
+            session.send(_packet(PINGRESP, b''))
+        elif packet_type != PUBACK:
+            raise ProtocolError(f"Unsupported packet type {packet_type}")
+
+    @staticmethod
+    def _shared_key(topic_filter):
+        if not topic_filter.startswith('$share/'):
+            return None
+        _, group, shared_filter = topic_filter.split('/', 2)
+        return group, shared_filter
+
+    def _subscribe(self, session, topic_filter):
+        with self.lock:
+            session.subscriptions.add(topic_filter)
+            key = self._shared_key(topic_filter)
+            if key is not None:
+                members = self.shared.setdefault(key, [])
+                if session not in members:
+                    members.append(session)
+                self.shared_turn.setdefault(key, itertools.count())
+
+    def _unsubscribe(self, session, topic_filter):
+        with self.lock:
+            session.subscriptions.discard(topic_filter)
+            key = self._shared_key(topic_filter)
+            if key is not None and session in self.shared.get(key, ()):
+                self.shared[key].remove(session)
+
+    def _remove(self, session):
+        with self.lock:
+            self.sessions.discard(session)
+            for members in self.shared.values():
+                if session in members:
+                    members.remove(session) # The group's next messages go to the remaining members
+
+    def publish(self, topic, payload):
+        """Deliver to every matching plain subscriber and one member of each matching shared group."""
+        targets = set()
+        with self.lock:
+            self.published += 1
+            for session in self.sessions:
+                if any(not f.startswith('$share/') and topic_matches(f, topic) for f in session.subscriptions):
+                    targets.add(session)
+            for (group, shared_filter), members in self.shared.items():
+                if members and topic_matches(shared_filter, topic):
+                    targets.add(members[next(self.shared_turn[(group, shared_filter)]) % len(members)])
+        topic_bytes = _utf8(topic)
+        for session in targets:
+            props = b'\x00' if session.protocol == MQTT_V5 else b''
+            try:
+                session.send(_packet(PUBLISH, topic_bytes + props + payload))
+                session.sent += 1
+            except OSError:
+                pass # The session's reader thread cleans up
+
+    def stats(self):
+        with self.lock:
+            return {
+                'clients': {s.client_id: {'subscriptions': sorted(s.subscriptions), 'received': s.received, 'sent': s.sent}
+                            for s in self.sessions},
+                'shared_groups': {f"{group}/{shared_filter}": len(members) for (group, shared_filter), members in self.shared.items()},
+                'published': self.published,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    broker = Broker(args.host, args.port).start()
+    try:
+        broker.stopped.wait()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Record raw robot MQTT traffic to a file and replay it at 1x, Nx or maximum speed.
+
+File format (append-only, big-endian):
+    <path>      b'AAMQREC1' then records: [ts_us:u64][topic_len:u16][payload_len:u32][topic][payload]
+    <path>.idx  one [offset:u64][ts_us:u64] entry per record, for counting and seeking by time
+
+The index can always be rebuilt from the data file; a partial record left by a crash is
+truncated when the file is reopened for recording.
+
+    python mqtt_recorder.py record traffic.rec [--topic '+/r2s/#'] [--duration 600]
+    python mqtt_recorder.py info traffic.rec
+    python mqtt_recorder.py replay traffic.rec --speed 1|5|max --target broker|app [--host 127.0.0.1]
+"""
+import argparse
+import bisect
+import os
+import struct
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+MAGIC = b'AAMQREC1'
+RECORD_HEADER = struct.Struct('>QHI')
+INDEX_ENTRY = struct.Struct('>QQ')
+
+
+class RecordingError(Exception):
+    """The file is not a recording or is corrupted beyond its last complete record."""
+
+
+def _scan(data_file, start_offset):
+    """Yield (offset, ts_us, topic_len, payload_len) of complete records from start_offset."""
+    data_file.seek(0, os.SEEK_END)
+    end = data_file.tell()
+    offset = start_offset
+    while offset + RECORD_HEADER.size <= end:
+        data_file.seek(offset)
+        ts_us, topic_len, payload_len = RECORD_HEADER.unpack(data_file.read(RECORD_HEADER.size))
+        if offset + RECORD_HEADER.size + topic_len + payload_len > end:
+            return # Torn write
+        yield offset, ts_us, topic_len, payload_len
+        offset += RECORD_HEADER.size + topic_len + payload_len
+
+
+def rebuild_index(path):
+    """Rewrite <path>.idx from the data file. Returns the offset just past the last complete record."""
+    with open(path, 'rb') as data_file:
+        if data_file.read(len(MAGIC)) != MAGIC:
+            raise RecordingError(f"{path} is not an MQTT recording")
+        end = len(MAGIC)
+        with open(path + '.idx', 'wb') as index_file:
+            for offset, ts_us, topic_len, payload_len in _scan(data_file, len(MAGIC)):
+                index_file.write(INDEX_ENTRY.pack(offset, ts_us))
+                end = offset + RECORD_HEADER.size + topic_len + payload_len
+    return end
+
+
+class MqttRecorder:
+    """Thread-safe appender; `write` is cheap enough to call from an MQTT on_message callback."""
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            end = rebuild_index(path) # Resume after the last complete record
+            with open(path, 'r+b') as data_file:
+                data_file.truncate(end)
+            self.data_file = open(path, 'ab')
+        else:
+            self.data_file = open(path, 'wb')
+            self.data_file.write(MAGIC)
+            open(path + '.idx', 'wb').close()
+        self.index_file = open(path + '.idx', 'ab')
+        self.offset = self.data_file.tell()
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.records = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def write(self, topic, payload, ts=None):
+        """Append one message; `ts` is the receive time in seconds (default: now)."""
+        topic_bytes = topic.encode('utf-8')
+        ts_us = int((ts if ts is not None else time.time()) * 1_000_000)
+        with self.lock:
+            self.data_file.write(RECORD_HEADER.pack(ts_us, len(topic_bytes), len(payload)))
+            self.data_file.write(topic_bytes)
+            self.data_file.write(payload)
+            self.index_file.write(INDEX_ENTRY.pack(self.offset, ts_us))
+            size = RECORD_HEADER.size + len(topic_bytes) + len(payload)
+            self.offset += size
+            self.records += 1
+            self.bytes += size
+            now = time.monotonic()
+            if now - self.last_flush >= self.flush_interval:
+                self.data_file.flush() # Data before index, so the index never points past the data
+                self.index_file.flush()
+                self.last_flush = now
+
+    def close(self):
+        with self.lock:
+            self.data_file.close()
+            self.index_file.close()
+
+    def stats(self):
+        return {'path': self.path, 'records': self.records, 'bytes': self.bytes}
+
+
+class MqttRecording:
+    """Read side: len(), time range and iteration over (ts_seconds, topic, payload)."""
+
+    def __init__(self, path):
+        self.path = path
+        index_path = path + '.idx'
+        if not os.path.exists(index_path) or os.path.getsize(index_path) % INDEX_ENTRY.size:
+            rebuild_index(path)
+        with open(index_path, 'rb') as index_file:
+            raw = index_file.read()
+        data_size = os.path.getsize(path)
+        entries = [INDEX_ENTRY.unpack_from(raw, i) for i in range(0, len(raw), INDEX_ENTRY.size)]
+        entries = [entry for entry in entries if entry[0] + RECORD_HEADER.size <= data_size] # Index flushed ahead of data
+        self.offsets = [offset for offset, _ in entries]
+        self.timestamps_us = [ts_us for _, ts_us in entries]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def start_time(self):
+        return self.timestamps_us[0] / 1e6 if self.offsets else None
+
+    @property
+    def duration(self):
+        return (self.timestamps_us[-1] - self.timestamps_us[0]) / 1e6 if self.offsets else 0.0
+
+    def messages(self, start_offset_s=0.0):
+        """Yield (ts_seconds, topic, payload), starting `start_offset_s` into the recording."""
+        if not self.offsets:
+            return
+        first = bisect.bisect_left(self.timestamps_us, self.timestamps_us[0] + int(start_offset_s * 1_000_000))
+        with open(self.path, 'rb') as data_file:
+            for offset in self.offsets[first:]:
+                data_file.seek(offset)
+                ts_us, topic_len, payload_len = RECORD_HEADER.unpack(data_file.read(RECORD_HEADER.size))
+                topic = data_file.read(topic_len).decode('utf-8')
+                yield ts_us / 1e6, topic, data_file.read(payload_len)
+
+    def topic_counts(self):
+        counts = {}
+        for _, topic, _ in self.messages():
+            counts[topic] = counts.get(topic, 0) + 1
+        return counts
+
+
+def replay(recording, sink, speed=1.0, start_offset_s=0.0, stop_event=None):
+    """Feed recorded messages to sink(topic, payload).
+
+    speed 1.0 = real time, N = N times faster, 0 = as fast as possible. Send times are
+    scheduled against the replay start, so per-message sleep error does not accumulate.
+    Returns (messages sent, wall seconds).
+    """
+    sent = 0
+    wall_start = time.monotonic()
+    first_ts = None
+    for ts, topic, payload in recording.messages(start_offset_s):
+        if stop_event is not None and stop_event.is_set():
+            break
+        if first_ts is None:
+            first_ts = ts
+        if speed > 0:
+            delay = wall_start + (ts - first_ts) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        sink(topic, payload)
+        sent += 1
+    return sent, time.monotonic() - wall_start
+
+
+def on_message_sink(on_message, client=None, userdata=None):
+    """Sink calling a paho-style on_message(client, userdata, msg) handler in-process."""
+    def sink(topic, payload):
+        msg = mqtt.MQTTMessage(topic=topic.encode('utf-8'))
+        msg.payload = payload
+        on_message(client, userdata, msg)
+    return sink
+
+
+def broker_sink(client, qos=0):
+    """Sink republishing to a broker through a connected paho client."""
+    def sink(topic, payload):
+        client.publish(topic, payload, qos=qos)
+    return sink
+
+
+def _connect(args, client_id, on_connect=None, on_message=None):
+    client = mqtt.Client(client_id=client_id, clean_session=True)
+    if args.user:
+        client.username_pw_set(args.user, args.password)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.host, args.port, 60)
+    client.loop_start()
+    return client
+
+
+def cmd_record(args):
+    recorder = MqttRecorder(args.path)
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(args.topic)
+            print(f"✅ Connected, recording '{args.topic}' to {args.path}")
+        else:
+            print(f"❌ Connection failed with code {rc}")
+
+    def on_message(client, userdata, msg):
+        recorder.write(msg.topic, msg.payload)
+
+    client = _connect(args, f"dashboard_recorder_{int(time.time())}", on_connect, on_message)
+    deadline = time.monotonic() + args.duration if args.duration else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(1)
+            print(f"📼 {recorder.records} messages, {recorder.bytes / 1e6:.1f} MB", end='\r')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        recorder.close()
+        print(f"\n👋 Recorded {recorder.records} messages to {args.path}")
+
+
+def cmd_info(args):
+    recording = MqttRecording(args.path)
+    print(f"📼 {args.path}: {len(recording)} messages over {recording.duration:.1f}s")
+    for topic, count in sorted(recording.topic_counts().items()):
+        print(f"   {topic}: {count}")
+
+
+def cmd_replay(args):
+    recording = MqttRecording(args.path)
+    speed = 0.0 if args.speed == 'max' else float(args.speed)
+    if args.target == 'app':
+        # In-process replay must not mix with live traffic: default the app's broker to localhost
+        os.environ.setdefault('MQTT_HOST', '127.0.0.1')
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import app as dashboard_app
+        sink = on_message_sink(dashboard_app.on_message)
+        client = None
+    else:
+        client = _connect(args, f"dashboard_replayer_{int(time.time())}")
+        sink = broker_sink(client, args.qos)
+    rate = f"{speed:g}x" if speed else "max speed"
+    print(f"▶️ Replaying {len(recording)} messages ({recording.duration:.1f}s recorded) at {rate} into {args.target}")
+    try:
+        sent, elapsed = replay(recording, sink, speed, args.start)
+    finally:
+        if client:
+            client.loop_stop()
+            client.disconnect()
+    print(f"✅ Sent {sent} messages in {elapsed:.2f}s ({sent / elapsed if elapsed else 0:.0f} msg/s)")
+    if args.target == 'app':
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and any(s['depth'] for s in dashboard_app.decode_pipeline.stats().values()):
+            time.sleep(0.1) # Let the decode pipeline drain before exiting
+        print(f"📊 Decode: {dashboard_app.decode_pipeline.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name in ('record', 'replay'):
+        p = sub.add_parser(name)
+        p.add_argument('path')
+        p.add_argument('--host', default=os.environ.get('MQTT_HOST', '127.0.0.1'))
+        p.add_argument('--port', type=int, default=int(os.environ.get('MQTT_PORT', 1883)))
+        p.add_argument('--user', default=os.environ.get('MQTT_USER'))
+        p.add_argument('--password', default=os.environ.get('MQTT_PASS'))
+    sub.choices['record'].add_argument('--topic', default='+/r2s/#')
+    sub.choices['record'].add_argument('--duration', type=float, default=0, help='seconds (0 = until Ctrl+C)')
+    sub.choices['replay'].add_argument('--speed', default='1', help="playback rate, e.g. 1, 5 or 'max'")
+    sub.choices['replay'].add_argument('--target', choices=('broker', 'app'), default='broker')
+    sub.choices['replay'].add_argument('--start', type=float, default=0.0, help='seconds into the recording')
+    sub.choices['replay'].add_argument('--qos', type=int, default=0)
+    sub.add_parser('info').add_argument('path')
+    args = parser.parse_args()
+    {'record': cmd_record, 'info': cmd_info, 'replay': cmd_replay}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Zoom-dependent simplification and incremental updates of GPS paths (gloal_path_gps).
+
+A path is split into fixed-size chunks of raw points (neighbouring chunks share their end
+point) and every chunk is simplified on its own with Douglas-Peucker. When a new path
+shares a prefix with the previous one, chunks that lie completely inside that prefix keep
+their cached result, so the simplified output also keeps its prefix and only the appended
+or changed suffix has to be computed and sent:
+
+    {'version', 'base_version', 'keep': <points of the base version to keep>, 'points': [[lat, lon], ...]}
+
+The tolerance is a number of screen pixels converted to degrees at the requested Web
+Mercator zoom level, so zoomed-out views get far fewer points.
+"""
+import math
+import threading
+
+import numpy as np
+
+_METERS_PER_DEGREE = 111320.0
+_EQUATOR_METERS_PER_PIXEL = 156543.03392 # Web Mercator ground resolution at zoom 0 (256 px tiles)
+
+
+def extract_points(payload):
+    """(N, 2) float64 [lat, lon] array from the path layouts the dashboard draws, or None.
+
+    Supported: {'poses': [{'pose': {'position': {x, y}}}]}, [{latitude, longitude}], [[lat, lon]],
+    {'routes': [{latitude, longitude} | {x, y}]}. Invalid points are skipped.
+    """
+    if isinstance(payload, dict) and isinstance(payload.get('poses'), list):
+        positions = [((p.get('pose') or {}).get('position') if isinstance(p, dict) else None) for p in payload['poses']]
+        pairs = [(pos.get('x'), pos.get('y')) for pos in positions if isinstance(pos, dict)]
+    elif isinstance(payload, dict) and isinstance(payload.get('routes'), list):
+        pairs = []
+        for p in payload['routes']:
+            if isinstance(p, dict):
+                pairs.append((p.get('latitude'), p.get('longitude')) if 'latitude' in p else (p.get('x'), p.get('y')))
+    elif isinstance(payload, list) and payload and isinstance(payload[0], dict):
+        pairs = [(p.get('latitude'), p.get('longitude')) for p in payload if isinstance(p, dict)]
+    elif isinstance(payload, list) and payload and isinstance(payload[0], (list, tuple)):
+        pairs = [(p[0], p[1]) for p in payload if isinstance(p, (list, tuple)) and len(p) >= 2]
+    else:
+        return None
+    points = [pair for pair in pairs if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in pair)]
+    return np.array(points, dtype=np.float64).reshape(-1, 2)
+
+
+def zoom_tolerance(zoom, latitude, pixels):
+    """`pixels` at Web Mercator `zoom` around `latitude`, in degrees."""
+    meters_per_pixel = _EQUATOR_METERS_PER_PIXEL * math.cos(math.radians(latitude)) / (2 ** zoom)
+    return pixels * meters_per_pixel / _METERS_PER_DEGREE
+
+
+def douglas_peucker(xy, tolerance):
+    """Indices of the points kept by Douglas-Peucker (first and last always kept).
+
+    Distances for each segment are computed in one NumPy pass; the recursion is an explicit stack.
+    """
+    count = len(xy)
+    if count < 3:
+        return np.arange(count)
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        origin = xy[start]
+        direction = xy[end] - origin
+        offsets = xy[start + 1:end] - origin
+        length = math.hypot(direction[0], direction[1])
+        if length == 0.0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+def common_prefix(a, b):
+    """Number of leading rows two (N, 2) arrays have in common."""
+    size = min(len(a), len(b))
+    if size == 0:
+        return 0
+    differs = np.flatnonzero(np.any(a[:size] != b[:size], axis=1))
+    return int(differs[0]) if len(differs) else size
+
+
+class PathState:
+    __slots__ = ('version', 'source', 'points', 'xy', 'chunks', 'simplified', 'emitted')
+
+    def __init__(self, version, source, points):
+        self.version = version
+        self.source = source # Store timestamp of the topic entry the path came from
+        self.points = points
+        self.xy = None # Points projected to a local plane (lon scaled by cos(lat0)), built on first use
+        self.chunks = {} # (chunk index, zoom) -> kept raw indices
+        self.simplified = {} # zoom -> (N, 2) simplified points of this version
+        self.emitted = {} # zoom -> (version, simplified points) last sent to that zoom's clients
+
+
+class PathSimplifier:
+    """Per-robot path versions with cached, chunked simplification per zoom level."""
+
+    def __init__(self, tolerance_px=1.5, chunk_size=256, min_zoom=3, max_zoom=20):
+        self.tolerance_px = tolerance_px
+        self.chunk_size = max(2, chunk_size)
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.paths = {} # (robot_id, sub_topic) -> PathState
+        self.lock = threading.Lock()
+        self.updates = 0
+        self.chunks_reused = 0
+        self.chunks_computed = 0
+
+    def clamp_zoom(self, zoom):
+        return max(self.min_zoom, min(self.max_zoom, int(zoom)))
+
+    def update(self, key, payload, source):
+        """Register the path of a topic entry. Returns its PathState, or None if it has no points.
+
+        Calling again with the same `source` timestamp is a no-op.
+        """
+        with self.lock:
+            previous = self.paths.get(key)
+            if previous is not None and previous.source == source:
+                return previous
+            points = extract_points(payload)
+            if points is None:
+                return None
+            state = PathState(previous.version + 1 if previous else 1, source, points)
+            if previous is not None:
+                state.emitted = previous.emitted
+                if len(points) and len(previous.points) and points[0, 0] == previous.points[0, 0]:
+                    # Same origin latitude, so same projection and tolerances: keep chunks inside the shared prefix
+                    prefix = common_prefix(points, previous.points)
+                    for (chunk, zoom), kept in previous.chunks.items():
+                        if (chunk + 1) * self.chunk_size < prefix:
+                            state.chunks[(chunk, zoom)] = kept
+            self.paths[key] = state
+            self.updates += 1
+            return state
+
+    def _project(self, state):
+        if state.xy is None:
+            points = state.points
+            scale = math.cos(math.radians(points[0, 0])) if len(points) else 1.0
+            state.xy = np.column_stack((points[:, 1] * scale, points[:, 0]))
+        return state.xy
+
+    def simplified(self, state, zoom):
+        """(N, 2) simplified [lat, lon] points of a path version at a zoom level (memoized)."""
+        zoom = self.clamp_zoom(zoom)
+        result = state.simplified.get(zoom)
+        if result is not None:
+            return result
+        with self.lock:
+            points = state.points
+            if len(points) < 3:
+                result = points
+            else:
+                xy = self._project(state)
+                tolerance = zoom_tolerance(zoom, points[0, 0], self.tolerance_px)
+                last = len(points) - 1
+                parts = []
+                for chunk, start in enumerate(range(0, last, self.chunk_size)):
+                    kept = state.chunks.get((chunk, zoom))
+                    if kept is None:
+                        end = min(start + self.chunk_size, last)
+                        kept = state.chunks[(chunk, zoom)] = douglas_peucker(xy[start:end + 1], tolerance) + start
+                        self.chunks_computed += 1
+                    else:
+                        self.chunks_reused += 1
+                    parts.append(kept[:-1]) # The end point is the next chunk's start
+                parts.append(np.array([last]))
+                result = points[np.concatenate(parts)]
+            state.simplified[zoom] = result
+        return result
+
+    def diff(self, state, zoom):
+        """Update for clients at `zoom`: the suffix after the part shared with the last version sent to them."""
+        zoom = self.clamp_zoom(zoom)
+        current = self.simplified(state, zoom)
+        with self.lock:
+            base = state.emitted.get(zoom)
+            state.emitted[zoom] = (state.version, current)
+        if base is None:
+            return {'version': state.version, 'base_version': None, 'keep': 0, 'points': current.tolist(), 'total': len(current)}
+        keep = common_prefix(current, base[1])
+        return {'version': state.version, 'base_version': base[0], 'keep': keep, 'points': current[keep:].tolist(), 'total': len(current)}
+
+    def full(self, state, zoom):
+        """Complete simplified path, used when a client (re)subscribes.
+
+        Leaves the zoom's `emitted` base alone: clients already following at this zoom still
+        need the diff from what they last received. A newly subscribed client ignores
+        updates up to the version it got here.
+        """
+        zoom = self.clamp_zoom(zoom)
+        current = self.simplified(state, zoom)
+        return {'version': state.version, 'base_version': None, 'keep': 0, 'points': current.tolist(), 'total': len(current)}
+
+    def get(self, key):
+        return self.paths.get(key)
+
+    def forget_robot(self, robot_id):
+        with self.lock:
+            for key in [key for key in self.paths if key[0] == robot_id]:
+                del self.paths[key]
+
+    def stats(self):
+        return {
+            'paths': {f"{robot_id}/{sub_topic}": {'version': state.version, 'points': len(state.points),
+                                                 'zooms': sorted(state.simplified)}
+                      for (robot_id, sub_topic), state in list(self.paths.items())},
+            'updates': self.updates,
+            'chunks_computed': self.chunks_computed,
+            'chunks_reused': self.chunks_reused,
+            'tolerance_px': self.tolerance_px,
+            'chunk_size': self.chunk_size,
+        }
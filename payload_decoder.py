@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""MQTT payload decoding, shared by the dashboard and its decode worker processes.
+
+This module must stay importable without side effects (no eventlet, Flask or MQTT
+connections): worker processes started by DecodeProcessPool run it as a script.
+"""
+import base64
+import binascii
+import json
+import logging
+import os
+import queue
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import msgpack
+
+log = logging.getLogger('DashboardApp')
+
+IMAGE_LIKE_TOPICS = ('routed_map', 'camera')
+
+
+def decode_payload(robot_id, sub_topic, raw, binary_images=True, trace=None):
+    """Decode one raw MQTT payload (msgpack, then JSON/UTF-8 fallback) and normalize image data.
+
+    Returns (payload, is_error_payload); on failure payload is an "Error: ..." string.
+    `trace` (tracing.Trace) receives decode/convert spans and events for sampled messages.
+    """
+    payload = None
+    is_error_payload = False
+    started = time.perf_counter()
+
+    # --- Payload Decoding ---
+    try:
+        payload = msgpack.unpackb(raw, raw=False)
+        if trace: trace.event("decoded msgpack: %s", payload)
+    except (msgpack.exceptions.UnpackException, msgpack.exceptions.ExtraData) as e_mp:
+        if trace: trace.event("not msgpack: %s", str(e_mp))
+        try:
+            payload_str = raw.decode('utf-8')
+            if payload_str.strip().startswith(('{', '[')):
+                payload = json.loads(payload_str)
+                if trace: trace.event("decoded JSON: %s", payload)
+            else:
+                payload = payload_str # Keep as string if not JSON
+                if trace: trace.event("decoded UTF-8 string: %s", payload)
+
+        except Exception as e_decode:
+            payload = f"Error: Cannot decode payload (not msgpack/json/utf8)"
+            log.warning(f"DecodeErr: {robot_id}/{sub_topic}: {e_decode}. Payload: {raw[:60]}...")
+            if trace: trace.event("decode failed: %s", str(e_decode))
+            is_error_payload = True
+    except Exception as e_unpack:
+         payload = f"Error: Failed to unpack msgpack payload"
+         log.error(f"UnpackErr: {robot_id}/{sub_topic}: {e_unpack}")
+         if trace: trace.event("msgpack unpack failed: %s", str(e_unpack))
+         is_error_payload = True
+    if trace: trace.add_span('decode', started, bytes=len(raw))
+
+    # --- Image Data Handling (More Robust) ---
+    if sub_topic in IMAGE_LIKE_TOPICS and not is_error_payload: # Only process if initial decode worked
+        started = time.perf_counter()
+        # Check if payload looks like a ROS Image message structure
+        if isinstance(payload, dict) and all(k in payload for k in ['width', 'height', 'encoding', 'data']):
+            data_field = payload.get('data')
+            original_data_type = type(data_field)
+            converted_data = None
+
+            try:
+                if isinstance(data_field, (bytes, bytearray, memoryview)):
+                    # Binary mode: keep the buffer as-is, Socket.IO ships it as an attachment
+                    converted_data = bytes(data_field) if binary_images else list(data_field)
+                elif isinstance(data_field, str):
+                    try:
+                        decoded_bytes = base64.b64decode(data_field, validate=True)
+                        converted_data = decoded_bytes if binary_images else list(decoded_bytes)
+                    except (binascii.Error, ValueError) as e_b64:
+                        payload = f"Error: Invalid Base64 data in image"
+                        log.warning(f"ImgConvErrB64: {robot_id}/{sub_topic}: {e_b64}")
+                        is_error_payload = True
+                elif isinstance(data_field, (list, tuple)):
+                    if binary_images:
+                        # JSON publishers send uint8[] as a number list; pack it once here
+                        converted_data = bytes(data_field)
+                    else:
+                        converted_data = data_field if isinstance(data_field, list) else list(data_field)
+                else:
+                    payload = f"Error: Unexpected data type '{original_data_type.__name__}' in image data field"
+                    log.warning(f"ImgConvErrType: {robot_id}/{sub_topic} - Unexpected type: {original_data_type}")
+                    is_error_payload = True
+
+                # If conversion was successful, update the payload
+                if converted_data is not None and not is_error_payload:
+                    payload['data'] = converted_data
+                    if trace: trace.event("image data %s -> %s", original_data_type.__name__, converted_data)
+
+            except Exception as e_conv:
+                 payload = f"Error: Exception during image data conversion"
+                 log.error(f"ImgConvErrGeneric: {robot_id}/{sub_topic}: {e_conv}")
+                 is_error_payload = True
+
+        elif isinstance(payload, dict): # Is a dict, but NOT the expected structure
+             payload_keys = list(payload.keys())
+             payload = f"Error: Image message structure incorrect (missing keys?)"
+             log.warning(f"ImgStructErr: {robot_id}/{sub_topic} - Keys: {payload_keys}")
+             is_error_payload = True
+        elif trace: # Not a dict, not an image structure we handle
+            trace.event("not an image structure: %s", payload)
+        if trace:
+            if is_error_payload:
+                trace.event("image conversion failed: %s", payload)
+            trace.add_span('convert', started)
+
+    return payload, is_error_payload
+
+
+# --- Lazy Payloads ---
+def detect_codec(raw):
+    """Guess the codec from the first byte: 'msgpack' (map/array), 'json', 'empty' or 'unknown'."""
+    if not raw:
+        return 'empty'
+    first = raw[0]
+    if 0x80 <= first <= 0x9f or first in (0xdc, 0xdd, 0xde, 0xdf):
+        return 'msgpack'
+    if first in (0x7b, 0x5b) and len(raw) > 1: # '{' / '[' (a lone byte would be a msgpack int)
+        return 'json'
+    return 'unknown'
+
+
+def extract_fields(raw, names):
+    """Partial decode: the top-level `names` of a msgpack map; every other value is skipped unparsed.
+
+    Returns {} if the payload is not a msgpack map or is malformed (the full decode reports that).
+    """
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(raw)
+    fields = {}
+    try:
+        for _ in range(unpacker.read_map_header()):
+            key = unpacker.unpack()
+            if key in names:
+                fields[key] = unpacker.unpack()
+                if len(fields) == len(names):
+                    break
+            else:
+                unpacker.skip()
+    except Exception:
+        return {}
+    return fields
+
+
+class LazyPayload:
+    """Raw MQTT bytes plus a cheap header (size, codec, eagerly extracted fields), decoded on first use.
+
+    `decode()` runs `decoder(robot_id, sub_topic, raw) -> (payload, is_error_payload)` once,
+    memoizes the result and releases the raw bytes. Instances are shared between readers
+    like any other stored payload and must not be mutated apart from that.
+    """
+    __slots__ = ('robot_id', 'sub_topic', 'raw', 'size', 'codec', 'fields', 'decoder', '_result', '_lock')
+
+    def __init__(self, robot_id, sub_topic, raw, decoder=None, eager_fields=()):
+        self.robot_id = robot_id
+        self.sub_topic = sub_topic
+        self.raw = bytes(raw)
+        self.size = len(self.raw)
+        self.codec = detect_codec(self.raw)
+        self.fields = extract_fields(self.raw, eager_fields) if eager_fields and self.codec == 'msgpack' else {}
+        self.decoder = decoder # None: decode_payload with binary images
+        self._result = None
+        self._lock = threading.Lock()
+
+    @property
+    def decoded(self):
+        return self._result is not None
+
+    def decode(self):
+        result = self._result
+        if result is None:
+            with self._lock:
+                result = self._result
+                if result is None:
+                    decoder = self.decoder or decode_payload
+                    result = self._result = tuple(decoder(self.robot_id, self.sub_topic, self.raw))
+                    self.raw = None
+        return result
+
+    def value(self):
+        return self.decode()[0]
+
+    def describe(self):
+        """Metadata type label; stable whether or not the payload has been decoded yet."""
+        return f"lazy/{self.codec}"
+
+    def __repr__(self):
+        return f"<LazyPayload {self.robot_id}/{self.sub_topic} {self.codec} {self.size} bytes{' decoded' if self.decoded else ''}>"
+
+
+# --- Decode Worker Processes ---
+# Frames on the worker's stdin/stdout: 4-byte big-endian length + msgpack body.
+# Request: [robot_id, sub_topic, raw, binary_images]  Response: [payload, is_error_payload]
+_FRAME_HEADER = struct.Struct('>I')
+
+
+class DecodeWorkerError(Exception):
+    """A decode worker process died or sent an invalid frame."""
+
+
+def _write_frame(stream, obj):
+    body = msgpack.packb(obj, use_bin_type=True)
+    stream.write(_FRAME_HEADER.pack(len(body)) + body)
+    stream.flush()
+
+
+def _read_exact(stream, size):
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            raise DecodeWorkerError("decode worker pipe closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _read_frame(stream):
+    (size,) = _FRAME_HEADER.unpack(_read_exact(stream, _FRAME_HEADER.size))
+    return msgpack.unpackb(_read_exact(stream, size), raw=False)
+
+
+class DecodeProcessPool:
+    """Fixed set of `python payload_decoder.py` worker processes for large payloads.
+
+    Uses plain subprocess pipes rather than multiprocessing, which deadlocks under
+    eventlet's monkey patching. Each call borrows one idle worker; a dead worker is
+    respawned and the call raises DecodeWorkerError so the caller can decode inline. The
+    same happens while the pool is not running (not started in this process, or stopped).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.idle = None
+        self.lock = threading.Lock()
+
+    def _spawn(self):
+        return subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0,
+        )
+
+    def start(self):
+        with self.lock:
+            if self.idle is not None or self.size <= 0:
+                return
+            self.idle = queue.Queue()
+            for _ in range(self.size):
+                self.idle.put(self._spawn())
+        log.info(f"🧵 Decode process pool started with {self.size} worker(s).")
+
+    def stop(self):
+        with self.lock:
+            idle, self.idle = self.idle, None
+        if idle is None:
+            return
+        while not idle.empty():
+            proc = idle.get_nowait()
+            try:
+                proc.kill()
+            except Exception: pass
+
+    def decode(self, robot_id, sub_topic, raw, binary_images=True):
+        idle = self.idle
+        if idle is None:
+            raise DecodeWorkerError("Decode process pool is not running")
+        proc = idle.get()
+        try:
+            _write_frame(proc.stdin, [robot_id, sub_topic, raw, binary_images])
+            payload, is_error_payload = _read_frame(proc.stdout)
+        except (DecodeWorkerError, OSError, ValueError) as e:
+            log.warning(f"Decode worker {proc.pid} failed ({e}); respawning.")
+            try:
+                proc.kill()
+            except Exception: pass
+            proc = self._spawn()
+            raise DecodeWorkerError(str(e))
+        finally:
+            idle.put(proc)
+        return payload, is_error_payload
+
+
+def worker_main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    while True:
+        try:
+            robot_id, sub_topic, raw, binary_images = _read_frame(stdin)
+        except DecodeWorkerError:
+            return # Parent closed the pipe
+        try:
+            result = decode_payload(robot_id, sub_topic, raw, binary_images)
+        except Exception as e:
+            log.exception(f"Decode worker error for {robot_id}/{sub_topic}: {e}")
+            result = (f"Error: Exception during payload decoding", True)
+        _write_frame(stdout, list(result))
+
+
+if __name__ == '__main__':
+    worker_main()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Compact binary frames for LaserScan payloads (scan_multi).
+
+Ranges (and intensities, if present) are packed as a typed array instead of a list of
+JSON numbers: float32, or uint16 quantized to a fixed resolution (0 = no return).
+Scans can be decimated angularly for display; each group of beams keeps its nearest
+return, so obstacles never disappear from the view. Frame layout (little-endian, so the
+browser can view the arrays without copying):
+
+    header      [b'SCN1'][dtype:u8][flags:u8][decimation:u16][count:u32]
+                [angle_min:f32][angle_increment:f32][range_min:f32][range_max:f32][resolution:f32]
+    ranges      count values of dtype (float32: NaN = no return; uint16: value * resolution metres)
+    padding     to a multiple of 4 bytes
+    intensities count values (flags bit 0) of dtype, or float32 if flags bit 1 is set: uint16
+                frames fall back to float32 intensities unless they are all integers in 0..65535
+
+angle_min is the centre angle of the first group and angle_increment the group spacing.
+"""
+import struct
+import threading
+
+import numpy as np
+
+MAGIC = b'SCN1'
+HEADER = struct.Struct('<4sBBHIfffff')
+DTYPES = {'float32': (1, np.dtype('<f4')), 'uint16': (2, np.dtype('<u2'))}
+FLAG_INTENSITIES = 0x01
+FLAG_FLOAT32_INTENSITIES = 0x02
+UINT16_MAX = 0xFFFF
+
+
+class ScanCodecError(ValueError):
+    """The payload is not a LaserScan or the frame is malformed."""
+
+
+def is_scan(payload):
+    return isinstance(payload, dict) and isinstance(payload.get('ranges'), (list, tuple)) and len(payload['ranges']) > 0
+
+
+def _decimate(ranges, intensities, factor):
+    """Nearest return per group of `factor` beams (NaN if none); the strongest intensity per group."""
+    padding = (-len(ranges)) % factor
+    if padding:
+        ranges = np.concatenate((ranges, np.full(padding, np.nan, dtype=ranges.dtype)))
+    groups = ranges.reshape(-1, factor)
+    valid = ~np.isnan(groups)
+    nearest = np.where(valid, groups, np.inf).min(axis=1)
+    nearest[~valid.any(axis=1)] = np.nan
+    if intensities is not None:
+        if padding:
+            intensities = np.concatenate((intensities, np.zeros(padding, dtype=intensities.dtype)))
+        intensities = intensities.reshape(-1, factor).max(axis=1)
+    return nearest, intensities
+
+
+def encode_scan(payload, encoding='uint16', resolution=0.01, max_range=0.0, decimation=1):
+    """Binary frame for a LaserScan dict. max_range 0 uses the scan's own range_max.
+
+    Ranges outside [range_min, max_range] and non-finite values are encoded as no return.
+    """
+    if not is_scan(payload):
+        raise ScanCodecError("Payload has no 'ranges' list")
+    if encoding not in DTYPES:
+        raise ScanCodecError(f"Unknown scan encoding '{encoding}'")
+    try:
+        ranges = np.asarray(payload['ranges'], dtype=np.float64)
+        intensities = payload.get('intensities')
+        intensities = np.asarray(intensities, dtype=np.float64) if intensities is not None and len(intensities) == len(ranges) else None
+        angle_min = float(payload.get('angle_min', 0.0))
+        angle_increment = float(payload.get('angle_increment', 0.0))
+        range_min = float(payload.get('range_min', 0.0))
+        range_max = float(max_range or payload.get('range_max') or np.inf)
+    except (TypeError, ValueError) as e:
+        raise ScanCodecError(f"Invalid LaserScan fields: {e}")
+    ranges[~np.isfinite(ranges) | (ranges < range_min) | (ranges > range_max)] = np.nan
+
+    decimation = max(1, int(decimation))
+    if decimation > 1:
+        ranges, intensities = _decimate(ranges, intensities, decimation)
+        angle_min += angle_increment * (decimation - 1) / 2.0
+        angle_increment *= decimation
+
+    code, dtype = DTYPES[encoding]
+    if encoding == 'uint16':
+        steps = np.rint(np.nan_to_num(ranges, nan=0.0) / resolution)
+        values = np.clip(steps, 1, UINT16_MAX).astype(dtype)
+        values[np.isnan(ranges)] = 0
+        if intensities is not None:
+            intensities = np.nan_to_num(intensities)
+            exact = np.all((intensities == np.rint(intensities)) & (intensities >= 0) & (intensities <= UINT16_MAX))
+            intensities = intensities.astype(dtype if exact else DTYPES['float32'][1]) # Keep 0..1 reflectances
+    else:
+        values = ranges.astype(dtype)
+        resolution = 0.0
+        if intensities is not None:
+            intensities = intensities.astype(dtype)
+
+    flags = 0
+    if intensities is not None:
+        flags = FLAG_INTENSITIES | (FLAG_FLOAT32_INTENSITIES if intensities.dtype != dtype else 0)
+    header = HEADER.pack(MAGIC, code, flags, decimation, len(values), angle_min, angle_increment,
+                         range_min, range_max if np.isfinite(range_max) else 0.0, resolution)
+    parts = [header, values.tobytes()]
+    if intensities is not None:
+        parts.append(b'\0' * ((-values.nbytes) % 4))
+        parts.append(intensities.tobytes())
+    return b''.join(parts)
+
+
+def decode_scan(frame):
+    """Inverse of encode_scan: dict with float64 'ranges' in metres (NaN = no return) and header fields."""
+    if len(frame) < HEADER.size:
+        raise ScanCodecError("Frame shorter than its header")
+    magic, code, flags, decimation, count, angle_min, angle_increment, range_min, range_max, resolution = HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise ScanCodecError("Not a scan frame")
+    dtype = next((dtype for c, dtype in DTYPES.values() if c == code), None)
+    if dtype is None:
+        raise ScanCodecError(f"Unknown scan dtype {code}")
+    offset = HEADER.size
+    values = np.frombuffer(frame, dtype=dtype, count=count, offset=offset)
+    if dtype.kind == 'u':
+        ranges = values * resolution
+        ranges[values == 0] = np.nan
+    else:
+        ranges = values.astype(np.float64)
+    result = {'angle_min': angle_min, 'angle_increment': angle_increment, 'range_min': range_min,
+              'range_max': range_max, 'decimation': decimation, 'ranges': ranges}
+    if flags & FLAG_INTENSITIES:
+        offset += values.nbytes + (-values.nbytes) % 4
+        intensity_dtype = DTYPES['float32'][1] if flags & FLAG_FLOAT32_INTENSITIES else dtype
+        result['intensities'] = np.frombuffer(frame, dtype=intensity_dtype, count=count, offset=offset).astype(np.float64)
+    return result
+
+
+class ScanEncoder:
+    """Encodes each stored scan once, however many clients it is sent to.
+
+    One cached frame per (robot_id, sub_topic), keyed on the entry timestamp.
+    """
+
+    def __init__(self, encoding='uint16', resolution=0.01, max_range=0.0, decimation=1):
+        if encoding not in DTYPES:
+            raise ScanCodecError(f"Unknown scan encoding '{encoding}'")
+        self.encoding = encoding
+        self.resolution = resolution
+        self.max_range = max_range
+        self.decimation = max(1, int(decimation))
+        self.cache = {} # (robot_id, sub_topic) -> (timestamp, frame)
+        self.lock = threading.Lock()
+        self.encoded = 0
+        self.cache_hits = 0
+        self.values_in = 0
+        self.bytes_out = 0
+
+    def frame(self, key, payload, timestamp):
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None and cached[0] == timestamp:
+                self.cache_hits += 1
+                return cached[1]
+        frame = encode_scan(payload, self.encoding, self.resolution, self.max_range, self.decimation)
+        with self.lock:
+            self.cache[key] = (timestamp, frame)
+            self.encoded += 1
+            self.values_in += len(payload['ranges'])
+            self.bytes_out += len(frame)
+        return frame
+
+    def forget_robot(self, robot_id):
+        with self.lock:
+            for key in [key for key in self.cache if key[0] == robot_id]:
+                del self.cache[key]
+
+    def stats(self):
+        return {
+            'encoding': self.encoding,
+            'resolution': self.resolution if self.encoding == 'uint16' else None,
+            'max_range': self.max_range or None,
+            'decimation': self.decimation,
+            'encoded': self.encoded,
+            'cache_hits': self.cache_hits,
+            'bytes_per_beam': round(self.bytes_out / self.values_in, 3) if self.values_in else None,
+        }
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""Warm-start persistence of the latest topic entries in an append/compact snapshot file.
+
+Changed entries are appended periodically; a later record for the same robot/topic
+supersedes earlier ones, and the file is compacted (live records copied to a new file
+that replaces the old one) once superseded records dominate it. Layout (big-endian):
+
+    header   b'AASNAP01'
+    records  [meta_len:u32][data_len:u32][meta_crc:u32][meta][data]
+             meta = msgpack [robot_id, sub_topic, timestamp, size, kind, fields, data_crc]
+             kind 'raw': data is the original MQTT payload (decoded by the usual pipeline)
+                  'packed': data is the msgpack of the decoded payload
+
+Loading maps the file and reads only the small meta blocks, so startup does not depend
+on how large the stored frames are. Payloads are SnapshotPayloads whose bytes are copied
+out of the map on first use. A torn record left by a crash ends the scan and is
+truncated before the next append.
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+import msgpack
+
+from payload_decoder import LazyPayload, decode_payload
+
+MAGIC = b'AASNAP01'
+RECORD_HEADER = struct.Struct('>III')
+KIND_RAW = 'raw'
+KIND_PACKED = 'packed'
+
+
+class SnapshotError(Exception):
+    """The file is not a snapshot, or a stored payload failed its checksum."""
+
+
+class SnapshotPayload(LazyPayload):
+    """A payload restored from the snapshot file; its bytes are read from the map when first decoded."""
+    __slots__ = ('source', 'offset', 'length', 'data_crc', 'kind')
+
+    def __init__(self, robot_id, sub_topic, source, offset, length, data_crc, kind, fields, decoder=None):
+        self.robot_id = robot_id
+        self.sub_topic = sub_topic
+        self.raw = None # Never held: a restored payload is not re-sent as raw bytes
+        self.size = length
+        self.codec = kind
+        self.fields = fields or {}
+        self.decoder = decoder
+        self._result = None
+        self._lock = threading.Lock()
+        self.source = source
+        self.offset = offset
+        self.length = length
+        self.data_crc = data_crc
+        self.kind = kind
+
+    def read(self):
+        data = self.source[self.offset:self.offset + self.length] # mmap slice: a copy, the map stays unexported
+        if zlib.crc32(data) != self.data_crc:
+            raise SnapshotError(f"Checksum mismatch in snapshot payload {self.robot_id}/{self.sub_topic}")
+        return data
+
+    def decode(self):
+        result = self._result
+        if result is None:
+            with self._lock:
+                result = self._result
+                if result is None:
+                    try:
+                        data = self.read()
+                        if self.kind == KIND_PACKED:
+                            result = (msgpack.unpackb(data, raw=False), False)
+                        else:
+                            result = tuple((self.decoder or decode_payload)(self.robot_id, self.sub_topic, data))
+                    except (SnapshotError, ValueError, msgpack.exceptions.UnpackException) as e:
+                        result = (f"Error: Cannot restore snapshot payload ({e})", True)
+                    self._result = result
+                    self.source = None # Drop the map reference once decoded
+        return result
+
+    def describe(self):
+        return f"snapshot/{self.kind}"
+
+    def __repr__(self):
+        return f"<SnapshotPayload {self.robot_id}/{self.sub_topic} {self.kind} {self.length} bytes{' decoded' if self.decoded else ''}>"
+
+
+def _pack_payload(payload):
+    """(kind, data, fields) for a stored payload, or None if it cannot be persisted."""
+    if isinstance(payload, LazyPayload) and not payload.decoded:
+        if not isinstance(payload, SnapshotPayload):
+            raw = payload.raw # Read once: a concurrent decode releases it
+            if raw is not None:
+                return KIND_RAW, raw, payload.fields
+            return _pack_payload(payload.value())
+        try:
+            return payload.kind, payload.read(), payload.fields # Restored and never read: copy it over as-is
+        except SnapshotError:
+            return None
+    if isinstance(payload, LazyPayload):
+        payload = payload.value()
+    try:
+        return KIND_PACKED, msgpack.packb(payload, use_bin_type=True), {}
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _scan(source, start):
+    """Yield (record offset, record end, meta list, data offset, data length) of complete records."""
+    end = len(source)
+    offset = start
+    while offset + RECORD_HEADER.size <= end:
+        meta_len, data_len, meta_crc = RECORD_HEADER.unpack_from(source, offset)
+        meta_start = offset + RECORD_HEADER.size
+        data_start = meta_start + meta_len
+        record_end = data_start + data_len
+        if record_end > end:
+            return # Torn write
+        meta_bytes = source[meta_start:data_start]
+        if zlib.crc32(meta_bytes) != meta_crc:
+            return
+        try:
+            meta = msgpack.unpackb(meta_bytes, raw=False)
+        except Exception:
+            return
+        yield offset, record_end, meta, data_start, data_len
+        offset = record_end
+
+
+class SnapshotStore:
+    """Append/compact file of the latest entry per (robot_id, sub_topic).
+
+    `io_executor(func, *args)` runs the file writes, e.g. eventlet.tpool.execute to keep them
+    off the hub. Payload packing (which may decode) and the lock stay on the calling thread.
+    """
+
+    def __init__(self, path, compact_ratio=2.0, compact_min_bytes=4 * 1024 * 1024, io_executor=None):
+        self.path = path
+        self.io_executor = io_executor or (lambda func, *args: func(*args))
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self.live = {} # (robot_id, sub_topic) -> (timestamp, record bytes)
+        self.file_bytes = 0
+        self.appended = 0
+        self.compactions = 0
+        self.lock = threading.Lock()
+        self._file = None
+
+    def load(self, decoder=None):
+        """Index the file; returns [(robot_id, sub_topic, timestamp, size, SnapshotPayload)] of the live records.
+
+        The map stays open (referenced by the returned payloads) until they have all been decoded.
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return []
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise SnapshotError(f"{self.path} is not a dashboard snapshot")
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        latest = {}
+        valid_end = len(MAGIC)
+        for offset, record_end, meta, data_offset, data_len in _scan(source, len(MAGIC)):
+            robot_id, sub_topic, timestamp, size, kind, fields, data_crc = meta
+            latest[(robot_id, sub_topic)] = (timestamp, size, kind, fields, data_offset, data_len, data_crc, record_end - offset)
+            valid_end = record_end
+        with self.lock:
+            self.file_bytes = valid_end
+            self.live = {key: (item[0], item[7]) for key, item in latest.items()}
+        if valid_end < len(source):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_end) # Safe: the map only covers up to the torn record for reading
+        return [(robot_id, sub_topic, timestamp, size,
+                 SnapshotPayload(robot_id, sub_topic, source, data_offset, data_len, data_crc, kind, fields, decoder))
+                for (robot_id, sub_topic), (timestamp, size, kind, fields, data_offset, data_len, data_crc, _) in latest.items()]
+
+    def _open_for_append(self):
+        if self._file is None:
+            new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            self._file = open(self.path, 'ab')
+            if new:
+                self._file.write(MAGIC)
+                self.file_bytes = len(MAGIC)
+        return self._file
+
+    def persisted_timestamp(self, robot_id, sub_topic):
+        live = self.live.get((robot_id, sub_topic))
+        return live[0] if live else None
+
+    def append(self, entries):
+        """Append [(robot_id, sub_topic, timestamp, size, payload)]. Returns the number written."""
+        records = [] # (key, timestamp, [header, meta, data])
+        for robot_id, sub_topic, timestamp, size, payload in entries:
+            packed = _pack_payload(payload)
+            if packed is None:
+                continue
+            kind, data, fields = packed
+            meta = msgpack.packb([robot_id, sub_topic, timestamp, size, kind, fields or {}, zlib.crc32(data)], use_bin_type=True)
+            records.append(((robot_id, sub_topic), timestamp, [RECORD_HEADER.pack(len(meta), len(data), zlib.crc32(meta)), meta, data]))
+        if not records:
+            return 0
+        with self.lock:
+            self.io_executor(self._write_records, [chunk for _, _, chunks in records for chunk in chunks])
+            for key, timestamp, chunks in records:
+                record_bytes = sum(len(chunk) for chunk in chunks)
+                self.file_bytes += record_bytes
+                self.live[key] = (timestamp, record_bytes)
+            self.appended += len(records)
+        return len(records)
+
+    def _write_records(self, chunks):
+        f = self._open_for_append()
+        f.writelines(chunks)
+        f.flush()
+
+    def forget(self, keys):
+        """Stop keeping these (robot_id, sub_topic) keys; their records go away at the next compaction."""
+        with self.lock:
+            for key in keys:
+                self.live.pop(key, None)
+
+    def live_bytes(self):
+        return len(MAGIC) + sum(record_bytes for _, record_bytes in self.live.values())
+
+    def needs_compaction(self):
+        return self.file_bytes > self.compact_min_bytes and self.file_bytes > self.live_bytes() * self.compact_ratio
+
+    def compact(self):
+        """Copy the live records into a new file and atomically replace the old one."""
+        with self.lock:
+            result = self.io_executor(self._compact_file, dict(self.live))
+            if result is None:
+                return
+            self.file_bytes, kept = result
+            self.live = {key: (self.live[key][0], record_bytes) for key, record_bytes in kept.items()}
+            self.compactions += 1
+
+    def _compact_file(self, live):
+        """Returns (file size, {key: record bytes}) of the new file, or None if there is no file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not os.path.exists(self.path):
+            return None
+        tmp_path = self.path + '.compact'
+        with open(self.path, 'rb') as f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with open(tmp_path, 'wb') as out:
+                out.write(MAGIC)
+                size = len(MAGIC)
+                kept = {} # key -> record bytes
+                for offset, record_end, meta, _, _ in _scan(source, len(MAGIC)):
+                    key = (meta[0], meta[1])
+                    record = live.get(key)
+                    if record is not None and record[0] == meta[2] and key not in kept:
+                        out.write(source[offset:record_end])
+                        kept[key] = record_end - offset
+                        size += record_end - offset
+                out.flush()
+                os.fsync(out.fileno())
+        finally:
+            source.close()
+        os.replace(tmp_path, self.path) # Restored payloads keep their map of the old inode
+        return size, kept
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        return {'path': self.path, 'entries': len(self.live), 'file_bytes': self.file_bytes,
+                'live_bytes': self.live_bytes(), 'appended': self.appended, 'compactions': self.compactions}
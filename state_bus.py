@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Update bus between the ingest process and the web workers (DASHBOARD_ROLE=ingest / web).
+
+The ingest process owns the MQTT subscription and publishes every stored topic entry;
+each web worker mirrors them into its own StateStore and fans them out to its Socket.IO
+clients. Messages are msgpack lists:
+
+    ['snapshot', {robot_id: robot_record}]     always the first message after connecting
+    ['topic', robot_id, sub_topic, entry]
+    ['robot_added', robot_id] / ['robot_removed', robot_id]
+
+Undecoded payloads (payload_decoder.LazyPayload) travel as raw bytes in a msgpack
+extension type and stay undecoded on the web side until a client needs them.
+
+Backends are picked by URL scheme. `unix:///path` (one box, no external services) and
+`tcp://host:port` (several nodes) are built in; `register_backend` adds others.
+"""
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+from urllib.parse import urlparse
+
+import msgpack
+
+from payload_decoder import LazyPayload
+
+log = logging.getLogger('DashboardApp')
+
+_FRAME_HEADER = struct.Struct('>I') # Big-endian body length
+_LAZY_PAYLOAD_EXT = 1 # ExtType code: msgpack [robot_id, sub_topic, raw, eager field names]
+
+
+class BusError(Exception):
+    """The bus URL is invalid or the connection was lost."""
+
+
+def _pack_default(obj):
+    if isinstance(obj, LazyPayload):
+        raw = obj.raw
+        if raw is None: # Already decoded, and the raw bytes released
+            return obj.value()
+        return msgpack.ExtType(_LAZY_PAYLOAD_EXT, msgpack.packb([obj.robot_id, obj.sub_topic, raw, list(obj.fields)], use_bin_type=True))
+    raise TypeError(f"Cannot serialize {type(obj).__name__} on the state bus")
+
+
+def _ext_hook(code, data):
+    if code == _LAZY_PAYLOAD_EXT:
+        robot_id, sub_topic, raw, eager_fields = msgpack.unpackb(data, raw=False)
+        return LazyPayload(robot_id, sub_topic, raw, eager_fields=tuple(eager_fields))
+    return msgpack.ExtType(code, data)
+
+
+def pack_message(message):
+    body = msgpack.packb(message, use_bin_type=True, default=_pack_default)
+    return _FRAME_HEADER.pack(len(body)) + body
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise BusError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_message(sock):
+    (size,) = _FRAME_HEADER.unpack(_recv_exact(sock, _FRAME_HEADER.size))
+    return msgpack.unpackb(_recv_exact(sock, size), raw=False, ext_hook=_ext_hook)
+
+
+def _socket_address(url):
+    parsed = urlparse(url)
+    if parsed.scheme == 'unix':
+        return socket.AF_UNIX, parsed.path
+    if parsed.scheme == 'tcp':
+        if not parsed.hostname or not parsed.port:
+            raise BusError(f"tcp bus URL needs host and port: {url}")
+        return socket.AF_INET, (parsed.hostname, parsed.port)
+    raise BusError(f"Unsupported bus URL: {url}")
+
+
+class _BusClient:
+    __slots__ = ('sock', 'queue', 'name')
+
+    def __init__(self, sock, queue_size, name):
+        self.sock = sock
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.name = name
+
+
+class SocketBusServer:
+    """Publisher side: accepts subscribers and streams frames to each through a bounded queue.
+
+    A subscriber whose queue overflows is disconnected rather than slowing the ingest path;
+    it reconnects and starts again from a fresh snapshot.
+    """
+
+    def __init__(self, url, snapshot_func, queue_size=1024):
+        self.family, self.address = _socket_address(url)
+        self.url = url
+        self.snapshot_func = snapshot_func # -> message sent to every new subscriber
+        self.queue_size = queue_size
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.listener = None
+        self.published = 0
+        self.dropped_clients = 0
+        self.stopped = threading.Event()
+
+    def start(self):
+        if self.listener is not None:
+            return
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address) # Stale socket from a previous run
+        listener = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(self.address)
+        listener.listen(64)
+        self.listener = listener
+        threading.Thread(target=self._accept_loop, name="StateBusAccept", daemon=True).start()
+        log.info(f"🔀 State bus listening on {self.url}")
+
+    def stop(self):
+        self.stopped.set()
+        if self.listener is not None:
+            self.listener.close()
+        with self.lock:
+            for client in list(self.clients):
+                self._drop(client)
+
+    def _accept_loop(self):
+        counter = 0
+        while not self.stopped.is_set():
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                if self.stopped.is_set():
+                    return
+                continue
+            counter += 1
+            client = _BusClient(sock, self.queue_size, f"subscriber-{counter}")
+            with self.lock: # Updates published after this point queue up behind the snapshot
+                client.queue.put(pack_message(self.snapshot_func()))
+                self.clients.add(client)
+            threading.Thread(target=self._writer, args=(client,), name=f"StateBus-{client.name}", daemon=True).start()
+            log.info(f"🔀 State bus {client.name} connected ({len(self.clients)} total)")
+
+    def _writer(self, client):
+        while not self.stopped.is_set():
+            frame = client.queue.get()
+            if frame is None:
+                break
+            try:
+                client.sock.sendall(frame)
+            except OSError as e:
+                log.warning(f"State bus {client.name} disconnected: {e}")
+                break
+        with self.lock:
+            self._drop(client)
+
+    def _drop(self, client):
+        if client not in self.clients:
+            return
+        self.clients.discard(client)
+        try:
+            client.sock.close()
+        except OSError:
+            pass
+        try:
+            client.queue.put_nowait(None) # Wake the writer
+        except queue.Full:
+            pass
+
+    def publish(self, message):
+        if not self.clients:
+            return
+        frame = pack_message(message) # Serialized once for every subscriber
+        with self.lock:
+            self.published += 1
+            for client in list(self.clients):
+                try:
+                    client.queue.put_nowait(frame)
+                except queue.Full:
+                    log.warning(f"State bus {client.name} is too slow; disconnecting it")
+                    self.dropped_clients += 1
+                    self._drop(client)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'url': self.url,
+                'subscribers': {client.name: client.queue.qsize() for client in self.clients},
+                'published': self.published,
+                'dropped_subscribers': self.dropped_clients,
+            }
+
+
+class SocketBusSubscriber:
+    """Web worker side: connects, hands every message to `handler`, reconnects on failure."""
+
+    def __init__(self, url, handler, reconnect_delay=1.0):
+        self.family, self.address = _socket_address(url)
+        self.url = url
+        self.handler = handler
+        self.reconnect_delay = reconnect_delay
+        self.connected = False
+        self.received = 0
+        self.reconnects = 0
+        self.stopped = threading.Event()
+        self.thread = None
+        self.sock = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._run, name="StateBusSubscriber", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.sock is not None:
+            self.sock.close()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.sock = socket.socket(self.family, socket.SOCK_STREAM)
+                self.sock.connect(self.address)
+                self.connected = True
+                log.info(f"🔀 Connected to state bus {self.url}")
+                while not self.stopped.is_set():
+                    message = read_message(self.sock)
+                    self.received += 1
+                    try:
+                        self.handler(message)
+                    except Exception as e:
+                        log.exception(f"State bus handler failed for {message[:1]}: {e}")
+            except (OSError, BusError) as e:
+                if not self.stopped.is_set():
+                    log.warning(f"State bus {self.url} unavailable ({e}); retrying in {self.reconnect_delay}s")
+            finally:
+                self.connected = False
+                if self.sock is not None:
+                    self.sock.close()
+            self.reconnects += 1
+            self.stopped.wait(self.reconnect_delay)
+
+    def stats(self):
+        return {'url': self.url, 'connected': self.connected, 'received': self.received, 'reconnects': self.reconnects}
+
+
+# scheme -> (server class, subscriber class)
+BACKENDS = {
+    'unix': (SocketBusServer, SocketBusSubscriber),
+    'tcp': (SocketBusServer, SocketBusSubscriber),
+}
+
+
+def register_backend(scheme, server_cls, subscriber_cls):
+    """Plug in another transport. Classes take the same arguments as the socket ones."""
+    BACKENDS[scheme] = (server_cls, subscriber_cls)
+
+
+def _backend(url):
+    scheme = urlparse(url).scheme
+    if scheme not in BACKENDS:
+        raise BusError(f"No state bus backend for '{scheme}' (available: {', '.join(sorted(BACKENDS))})")
+    return BACKENDS[scheme]
+
+
+def create_server(url, snapshot_func, **kwargs):
+    return _backend(url)[0](url, snapshot_func, **kwargs)
+
+
+def create_subscriber(url, handler, **kwargs):
+    return _backend(url)[1](url, handler, **kwargs)
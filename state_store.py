@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Copy-on-write store for the latest value of every robot topic.
+
+Writers replace records instead of mutating them: an update builds a new topic entry and
+a new robot record (shallow copy of that robot's topics map), then swaps that one record
+into the root map. The root map itself is never copied on write, so a message costs the
+same however many robots there are. Readers take a record without locking or deep
+copies; everything reachable from a record is frozen, so it never changes under them.
+Full-state readers get a Snapshot whose root maps are copied once per store version.
+"""
+import threading
+from collections import namedtuple
+
+
+class FrozenDict(dict):
+    """A dict that refuses mutation after construction.
+
+    Stays a real `dict` subclass so json/msgpack/Socket.IO serialize it without conversion.
+    """
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict is immutable; build a new record instead")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self # Contents are never mutated in place
+
+
+EMPTY_ROBOTS = FrozenDict()
+
+# version: increments on every write; robots: FrozenDict robot_id -> robot record;
+# robot_versions: FrozenDict robot_id -> store version of that robot's last change
+Snapshot = namedtuple('Snapshot', ['version', 'robots', 'robot_versions'], defaults=(EMPTY_ROBOTS,))
+
+
+def make_topic_entry(payload, timestamp, size=0, stale=False):
+    """`size` is the raw message size in bytes, reported in the metadata view.
+
+    `stale` marks an entry restored from a warm-start snapshot rather than received live.
+    """
+    if stale:
+        return FrozenDict(payload=payload, timestamp=timestamp, size=size, stale=True)
+    return FrozenDict(payload=payload, timestamp=timestamp, size=size)
+
+
+def describe_payload(payload):
+    """Cheap type label for metadata: 'image/<encoding>', 'error', 'waiting' or the Python type name."""
+    describe = getattr(payload, 'describe', None) # Undecoded payloads label themselves (see payload_decoder.LazyPayload)
+    if describe is not None:
+        return describe()
+    if isinstance(payload, dict):
+        if 'encoding' in payload and 'data' in payload:
+            return f"image/{payload.get('encoding')}"
+        return 'dict'
+    if isinstance(payload, str):
+        if payload == "waiting...":
+            return 'waiting'
+        if payload.startswith("Error:"):
+            return 'error'
+    return type(payload).__name__
+
+
+def make_robot_record(last_seen, topics):
+    return FrozenDict(last_seen=last_seen, topics=FrozenDict(topics))
+
+
+def describe_entry(entry):
+    """Payload-free metadata of a topic entry; eagerly extracted fields of a lazy payload are included."""
+    payload = entry['payload']
+    metadata = FrozenDict(timestamp=entry['timestamp'], size=entry.get('size', 0), type=describe_payload(payload))
+    if entry.get('stale'):
+        metadata = FrozenDict(metadata, stale=True)
+    fields = getattr(payload, 'fields', None)
+    return FrozenDict(metadata, fields=fields) if fields else metadata
+
+
+class StateStore:
+    """Latest-value store: {robot_id: {'last_seen': ms, 'topics': {sub_topic: {'payload', 'timestamp'}}}}.
+
+    The write lock only covers the shallow copy of one robot's topics map, so its hold time
+    depends neither on payload size nor on the number of robots.
+    """
+
+    def __init__(self, lock=None):
+        self._write_lock = lock or threading.Lock() # Any context manager, e.g. one that times lock waits
+        self._version = 0
+        self._robots = {} # robot_id -> frozen robot record; items are swapped, never mutated
+        self._robot_versions = {} # robot_id -> store version of that robot's last change
+        self._topic_versions = {} # robot_id -> {sub_topic: store version of that entry}
+        self._snapshot_cache = Snapshot(0, EMPTY_ROBOTS)
+        self._metadata_cache = None # Snapshot of the payload-free view, see metadata()
+        self._metadata_records = {} # robot_id -> (robot version, payload-free robot record)
+        self._membership_version = 0 # Changes when a robot is added or removed
+
+    @property
+    def version(self):
+        return self._version
+
+    def snapshot(self):
+        """Return a consistent (version, robots, robot_versions) view.
+
+        The root maps are copied once per store version (O(robots), under the write lock so
+        the copies match their version) and shared by every caller until the next write.
+        Single-robot readers should use get_robot(), which never locks.
+        """
+        cached = self._snapshot_cache
+        if cached.version == self._version:
+            return cached
+        with self._write_lock: # Copies are consistent with the version they are tagged with
+            snapshot = Snapshot(self._version, FrozenDict(self._robots), FrozenDict(self._robot_versions))
+        self._snapshot_cache = snapshot
+        return snapshot
+
+    def get_robot(self, robot_id):
+        return self._robots.get(robot_id)
+
+    def has_robot(self, robot_id):
+        return robot_id in self._robots
+
+    @property
+    def membership_version(self):
+        return self._membership_version
+
+    def metadata(self):
+        """Payload-free Snapshot whose robots map is {robot_id: {'last_seen', 'topics': {sub_topic: {'timestamp', 'size', 'type'[, 'fields']}}}}.
+
+        Shared by every caller until the next write. Only robots written since the previous
+        call are described again; the others reuse their cached record.
+        """
+        snapshot = self.snapshot()
+        cached = self._metadata_cache
+        if cached is not None and cached.version == snapshot.version:
+            return cached
+        previous = self._metadata_records
+        records = {}
+        for robot_id, record in snapshot.robots.items():
+            robot_version = snapshot.robot_versions.get(robot_id)
+            described = previous.get(robot_id)
+            if described is None or described[0] != robot_version:
+                described = (robot_version, FrozenDict(
+                    last_seen=record['last_seen'],
+                    topics=FrozenDict({
+                        sub_topic: describe_entry(entry) for sub_topic, entry in record['topics'].items()
+                    }),
+                ))
+            records[robot_id] = described
+        self._metadata_records = records # Removed robots drop out here
+        metadata = snapshot._replace(robots=FrozenDict({robot_id: described[1] for robot_id, described in records.items()}))
+        self._metadata_cache = metadata
+        return metadata
+
+    def robot_version(self, robot_id):
+        return self._robot_versions.get(robot_id)
+
+    def topic_version(self, robot_id, sub_topic):
+        """Store version of the write that last replaced this topic entry (None if never written)."""
+        return self._topic_versions.get(robot_id, {}).get(sub_topic)
+
+    def _publish(self, robot_id, record, sub_topic=None):
+        """Swap in (or, with record None, drop) one robot record. Caller holds the write lock."""
+        version = self._version + 1
+        if record is None or robot_id not in self._robots:
+            self._membership_version += 1
+        if record is None:
+            del self._robots[robot_id]
+            self._robot_versions.pop(robot_id, None)
+            self._topic_versions.pop(robot_id, None)
+        else:
+            self._robots[robot_id] = record
+            self._robot_versions[robot_id] = version
+            if sub_topic is not None:
+                self._topic_versions.setdefault(robot_id, {})[sub_topic] = version
+        self._version = version
+        return version
+
+    def ensure_robot(self, robot_id, sub_topics=(), placeholder="waiting..."):
+        """Create a robot record with placeholder topics if it does not exist yet."""
+        with self._write_lock:
+            if robot_id in self._robots:
+                return self._version
+            placeholder_entry = make_topic_entry(placeholder, 0)
+            return self._publish(robot_id, make_robot_record(0, {topic: placeholder_entry for topic in sub_topics}))
+
+    def update_topic(self, robot_id, sub_topic, entry):
+        """Replace one topic entry (see `make_topic_entry`) and advance last_seen to its timestamp.
+
+        last_seen never moves backwards: an out-of-order or replayed message leaves it as is.
+
+        Returns the new store version, or None if the robot is unknown.
+        The caller must not mutate the entry's payload afterwards.
+        """
+        with self._write_lock:
+            record = self._robots.get(robot_id)
+            if record is None:
+                return None
+            topics = dict(record['topics'])
+            topics[sub_topic] = entry
+            return self._publish(robot_id, make_robot_record(max(record['last_seen'] or 0, entry['timestamp']), topics), sub_topic)
+
+    def remove_robot(self, robot_id):
+        """Drop a robot record. Returns the new store version, or None if it was not present."""
+        with self._write_lock:
+            if robot_id not in self._robots:
+                return None
+            return self._publish(robot_id, None)
@@ -3,19 +3,20 @@
     'use strict';
 
     // --- Constants ---
-    const OFFLINE_THRESHOLD = 30 * 1000; // 30 seconds in milliseconds
-    const STATUS_CHECK_INTERVAL = 5 * 1000; // Check status every 5 seconds
     const MAP_UPDATE_DEBOUNCE = 150; // Debounce map marker updates (ms)
     const FEEDBACK_CLEAR_DELAY = 10000; // Auto-clear command feedback after 10s
     const DEFAULT_MAP_CENTER = [21.0285, 105.8542]; // Hanoi (Example)
     const DEFAULT_MAP_ZOOM = 13;
     const CONTROLLER_MAP_ZOOM = 17; // Zoom level for controller map
     const ARRIVED_CONFIRMATION_CODE = 3; // Match ServerCommand.msg confirmation code for ARRIVED
+    const TELEOP_KEEPALIVE_MS = 100; // Live teleop resend interval, well below the server's stale-input watchdog
 
     // --- Socket.IO Connection ---
     const socket = io({
         reconnectionAttempts: 5,
         timeout: 10000,
+        // Set by the server: ['websocket'] when several workers serve Socket.IO without sticky sessions
+        ...(window.SOCKETIO_TRANSPORTS?.length ? { transports: window.SOCKETIO_TRANSPORTS } : {}),
     });
 
     // --- State Variables ---
@@ -23,9 +24,18 @@
     let expectedSubTopics = [];
     let latestData = {}; // { robotId: { last_seen: ms, topics: { subTopic: { payload: ..., timestamp: ms } } } }
     let robotStatus = {}; // { robotId: 'online' | 'offline' | 'waiting' }
+    let staleTopics = new Set(); // "robotId/subTopic" keys the server reported as silent
     let currentView = 'dashboard-view';
     let selectedRobot = null;
     let selectedSubTopic = null;
+    let activeSubscriptions = new Set(); // Server rooms joined: "robotId/subTopic"
+    let topicSeq = {}; // "robotId/subTopic" -> seq of the last applied keyframe/delta (delta topics only)
+    let resyncPending = new Set(); // "robotId/subTopic" keys with a get_topic resync in flight
+    let pathSubTopics = new Set(); // Topics the server sends as simplified paths ('subscribe_path' / 'path_update')
+    let pathSubscription = null; // { robotId, zoom } of the followed path; version null until the ack arrives
+    let pendingPathUpdates = []; // path_update events received before the subscribe_path ack
+    let teleopRobot = null; // Robot receiving the live teleop stream
+    let teleopTimer = null;
     // Dashboard Map
     let osmMap = null;
     let robotMarker = null;
@@ -44,7 +54,6 @@
     let sequenceActive = false;
     let currentSequenceIndex = -1;
     // Timers & Intervals
-    let statusCheckInterval = null;
     let feedbackClearTimers = {}; // { feedbackId: timerId }
 
     // --- DOM Elements Cache ---
@@ -70,6 +79,8 @@
         controllerStatusMsg: document.getElementById('controller-status'),
         cmdFeedbackArea: document.getElementById('command-feedback-area'),
         sendJoystickCmdBtn: document.getElementById('send-joystick-cmd'),
+        liveTeleopBtn: document.getElementById('joy-live-teleop'),
+        teleopLatency: document.getElementById('teleop-latency'),
         testServerCmdBtn: document.getElementById('test-server-cmd'),
         // Quick Commands
         quickNavBtn: document.getElementById('quick-nav-btn'),
@@ -146,6 +157,7 @@
                 maxZoom: 19,
                 attribution: '© OpenStreetMap contributors'
             }).addTo(osmMap);
+            osmMap.on('zoomend', () => syncPathSubscription());
             log.info("Dashboard OSM Map Initialized");
         } catch (e) {
             log.error("Dashboard OSM Map initialization failed:", e);
@@ -168,6 +180,7 @@
             }).addTo(controllerMapInstance);
 
             controllerMapInstance.on('click', handleControllerMapClick);
+            controllerMapInstance.on('zoomend', () => syncPathSubscription());
             if (!robotIcon) defineRobotIcon();
 
             // Initialize markers (hidden initially)
@@ -251,6 +264,7 @@
             dom.controllerStatusMsg.className = `status-message ${statusType}`;
             dom.controllerStatusMsg.style.display = 'block';
         }
+        stopTeleop(); // The server stops the robot when the stream ends
         // Explicitly disable buttons for clarity (though CSS overlay might suffice)
         dom.allControllerSendBtns.forEach(btn => btn.disabled = true);
         if(dom.addStorePointBtn) dom.addStorePointBtn.disabled = true;
@@ -275,31 +289,10 @@
         updateSequenceControlButtonStates(); // Correctly sets sequence/map button states
     }
 
-    // --- Robot Status Checking ---
-    function checkAllRobotStatuses() {
-        const now = Date.now();
-        let changed = false;
-        let selectedRobotIsNowOnline = false;
-
-        for (const robotId of knownRobots) {
-            const lastSeen = latestData[robotId]?.last_seen || 0;
-            let newStatus = 'offline';
-            if (lastSeen === 0) newStatus = 'waiting';
-            else if ((now - lastSeen) < OFFLINE_THRESHOLD) newStatus = 'online';
-
-            if (robotStatus[robotId] !== newStatus) {
-                log.debug(`Robot ${robotId} status changed: ${robotStatus[robotId] || 'none'} -> ${newStatus}`);
-                robotStatus[robotId] = newStatus;
-                changed = true;
-            }
-            if (robotId === selectedRobot && newStatus === 'online') {
-                selectedRobotIsNowOnline = true;
-            }
-        }
-
-        if (changed) {
-            updateRobotStatusUI(); // Update dropdown and topic header visuals
-        }
+    // --- Robot Status ---
+    function applyRobotStatuses() {
+        // Reflect robotStatus (set from the server's presence events) in the UI and controller state
+        updateRobotStatusUI(); // Update dropdown and topic header visuals
 
         // Update controller enabled/disabled state based on selected robot
         if (currentView === 'controller-view') { // Only manage controller state if it's the active view
@@ -395,12 +388,13 @@
             dom.robotSelector.value = "";
             if (selectedRobot !== null) selectRobot(null); // Deselect if previous choice is invalid
         }
-        checkAllRobotStatuses(); // Update status text immediately
+        applyRobotStatuses(); // Update status text immediately
     }
 
     function selectRobot(robotId) {
         // Handle robot selection change
         if (robotId === selectedRobot) return; // No change
+        if (teleopRobot) stopTeleop(); // Never keep driving a robot that is no longer selected
 
         if (!robotId) { // Deselecting
             if (selectedRobot === null) return; // Already deselected
@@ -421,6 +415,7 @@
             if (controllerPathPolyline) { controllerPathPolyline.remove(); controllerPathPolyline = null; }
             clearSequence(); // Clear sequence data and UI
             renderData(); // Clear data display
+            syncSubscriptions();
             disableController("Please select a robot.");
             if (dom.topicListHeader) dom.topicListHeader.textContent = "Topics";
             return;
@@ -436,6 +431,8 @@
         if (dashboardPathPolyline) { dashboardPathPolyline.remove(); dashboardPathPolyline = null; }
 
         populateTopicList(robotId);
+        syncSubscriptions();
+        fetchTopicPayload(robotId, 'robot_status'); // Position for the maps (broadcast topic, not pushed on subscribe)
         setStatus(`Select a topic for ${selectedRobot}.`, true);
         if (dom.robotSelector) {
             const promptOption = dom.robotSelector.querySelector('option[value=""]');
@@ -444,7 +441,7 @@
 
         clearSequence(); // Clear sequence from previous robot
         renderData(); // Clear data display area
-        checkAllRobotStatuses(); // Update status UI and controller state
+        applyRobotStatuses(); // Update status UI and controller state
 
         // Update maps for the newly selected robot
         updateOsmMapPositionFromStatus();
@@ -460,6 +457,96 @@
         }
     }
 
+    // --- Topic Subscriptions ---
+    function getDesiredSubscriptions() {
+        // Heavy topics are only sent to subscribers: the selected topic plus the GPS path for the maps
+        const desired = new Set();
+        if (selectedRobot) {
+            // Simplified paths come through syncPathSubscription() instead of the raw topic
+            if (!pathSubTopics.has('gloal_path_gps')) desired.add(`${selectedRobot}/gloal_path_gps`);
+            if (selectedSubTopic && !pathSubTopics.has(selectedSubTopic)) desired.add(`${selectedRobot}/${selectedSubTopic}`);
+        }
+        return desired;
+    }
+
+    function syncSubscriptions() {
+        // Join/leave server rooms so only the viewed robot/topic payloads are received
+        if (!socket.connected) return;
+        const desired = getDesiredSubscriptions();
+        activeSubscriptions.forEach(key => {
+            if (desired.has(key)) return;
+            const [robot_id, ...rest] = key.split('/');
+            socket.emit('unsubscribe', { robot_id, sub_topic: rest.join('/') });
+            activeSubscriptions.delete(key);
+        });
+        desired.forEach(key => {
+            if (activeSubscriptions.has(key)) return;
+            const [robot_id, ...rest] = key.split('/');
+            socket.emit('subscribe', { robot_id, sub_topic: rest.join('/') });
+            activeSubscriptions.add(key);
+        });
+        log.debug(`Subscriptions: ${Array.from(activeSubscriptions).join(', ') || 'none'}`);
+        syncPathSubscription();
+    }
+
+    // --- Simplified GPS Path ---
+    function currentPathZoom() {
+        // The finest zoom among the maps showing the path decides the simplification tolerance
+        const zooms = [osmMap, controllerMapInstance].filter(Boolean).map(m => m.getZoom());
+        return zooms.length ? Math.max(...zooms) : DEFAULT_MAP_ZOOM;
+    }
+
+    function syncPathSubscription(force = false) {
+        // Follow the selected robot's path at the current zoom; re-subscribing returns the full path
+        if (!socket.connected || !pathSubTopics.has('gloal_path_gps')) return;
+        const zoom = currentPathZoom();
+        const current = pathSubscription;
+        if (!force && current && current.robotId === selectedRobot && current.zoom === zoom) return;
+        if (current && current.robotId !== selectedRobot) {
+            socket.emit('unsubscribe_path', { robot_id: current.robotId, sub_topic: 'gloal_path_gps' });
+        }
+        pathSubscription = null;
+        pendingPathUpdates = [];
+        if (!selectedRobot) return;
+        const subscription = { robotId: selectedRobot, zoom, version: null };
+        pathSubscription = subscription;
+        socket.emit('subscribe_path', { robot_id: subscription.robotId, sub_topic: 'gloal_path_gps', zoom }, (response) => {
+            if (pathSubscription !== subscription) return; // Superseded by a newer subscription
+            if (response?.status !== 'ok') {
+                log.debug(`subscribe_path ${subscription.robotId}: ${response?.message || 'failed'}`);
+                return;
+            }
+            subscription.zoom = response.zoom; // Clamped by the server
+            subscription.version = response.version;
+            if (response.version !== null) applyPathPoints(subscription.robotId, response.points, response.timestamp, response.robot_last_seen);
+            const pending = pendingPathUpdates;
+            pendingPathUpdates = [];
+            pending.forEach(applyPathUpdate);
+        });
+    }
+
+    function applyPathPoints(robotId, points, timestamp, robotLastSeen) {
+        // Stored as a [lat, lon][] payload, which drawGpsPath already understands
+        handleMqttData({ robot_id: robotId, sub_topic: 'gloal_path_gps', data: { payload: points, timestamp }, robot_last_seen: robotLastSeen });
+    }
+
+    function applyPathUpdate(update) {
+        // {version, base_version, keep, points}: keep the first `keep` points of base_version, then append
+        const subscription = pathSubscription;
+        if (!subscription || update.robot_id !== subscription.robotId || update.zoom !== subscription.zoom) return;
+        if (subscription.version === null) { pendingPathUpdates.push(update); return; }
+        if (update.version <= subscription.version) return; // Already contained in the ack
+        if (update.base_version !== null && update.base_version !== subscription.version) {
+            log.debug(`Path gap for ${update.robot_id} (have v${subscription.version}, base v${update.base_version}); resubscribing`);
+            syncPathSubscription(true);
+            return;
+        }
+        const current = latestData[update.robot_id]?.topics?.['gloal_path_gps']?.payload;
+        const base = (update.base_version !== null && Array.isArray(current)) ? current.slice(0, update.keep) : [];
+        subscription.version = update.version;
+        applyPathPoints(update.robot_id, base.concat(update.points), update.timestamp, update.robot_last_seen);
+    }
+
     // --- Topic Handling ---
     function getSubTopicsForRobot(robotId) {
         // Get list of topics (expected + received) for the selected robot
@@ -497,6 +584,13 @@
             if (selectedRobot === robotId && selectedSubTopic === subTopic) {
                 topicItem.classList.add('active');
             }
+            if (latestData[robotId]?.topics?.[subTopic]?.stale) {
+                topicItem.classList.add('stale'); // Restored from the server's snapshot, nothing live yet
+                topicItem.title = 'Restored from snapshot - no live message since the server restarted';
+            } else if (staleTopics.has(`${robotId}/${subTopic}`)) {
+                topicItem.classList.add('stale');
+                topicItem.title = 'No recent message on this topic';
+            }
             dom.topicListContainer.appendChild(topicItem);
         });
     }
@@ -512,6 +606,7 @@
             item.classList.toggle('active', item.dataset.subTopic === selectedSubTopic);
         });
 
+        syncSubscriptions(); // Server pushes the current value once subscribed
         configureLayoutForTopic(subTopic); // Adjust UI layout
         renderData(); // Display data for the selected topic
     }
@@ -546,6 +641,11 @@
             dom.mapCanvasContainer.style.width = '40%';
             if (osmMap) setTimeout(() => { log.debug("Invalidating OSM map size"); osmMap.invalidateSize(); }, 50);
             updateOsmMapPositionFromStatus();
+        } else if (topic === 'camera') {
+            log.debug("Setting layout for camera: Full Canvas");
+            dom.dataDisplayElement.style.display = 'none';
+            dom.mapCanvasContainer.style.display = 'flex';
+            dom.mapCanvasContainer.style.width = '100%';
         } else if (topic === 'gloal_path_gps') {
             log.debug("Setting layout for gloal_path_gps: Full Map");
             dom.dataDisplayElement.style.display = 'none';
@@ -604,13 +704,14 @@
         }
 
         if (timestamp && timestamp > 0) headerText += ` (${formatTimeAgo(timestamp)})`;
+        if (topicEntry?.stale) headerText += ' [restored, stale]';
         if (dom.dataDisplayHeader) dom.dataDisplayHeader.textContent = headerText;
 
         // Render based on topic type
-        if (selectedSubTopic === 'routed_map') {
-            log.debug("renderData: Handling 'routed_map'");
+        if (selectedSubTopic === 'routed_map' || selectedSubTopic === 'camera') {
+            log.debug(`renderData: Handling image topic '${selectedSubTopic}'`);
             // Ensure layout is correct FIRST
-            configureLayoutForTopic('routed_map'); // Re-call to ensure layout is set
+            configureLayoutForTopic(selectedSubTopic); // Re-call to ensure layout is set
             if (isWaitingOrError) {
                 log.debug("renderData (routed_map): Waiting or Error state.");
                 if (dom.mapCtx) {
@@ -619,7 +720,7 @@
                  }
                 if (dom.canvasStatus) {
                     log.debug(`renderData (routed_map): Setting canvas status: "${statusMessage}"`);
-                    dom.canvasStatus.textContent = statusMessage || 'Waiting for map data...';
+                    dom.canvasStatus.textContent = statusMessage || 'Waiting for image data...';
                     dom.canvasStatus.className = 'canvas-status waiting';
                     dom.canvasStatus.style.display = 'block'; // Ensure visible
                 }
@@ -629,7 +730,7 @@
                 drawMap(dom.mapCanvas, dom.mapCtx, data); // data is the image message object {width, height, encoding, data:[...]}
                 if (dom.canvasStatus) dom.canvasStatus.style.display = 'none';
             }
-            if (osmMap) updateOsmMapPositionFromStatus(); // Update context map marker
+            if (osmMap && selectedSubTopic === 'routed_map') updateOsmMapPositionFromStatus(); // Update context map marker
         } else if (selectedSubTopic === 'gloal_path_gps') {
              log.debug("renderData: Handling 'gloal_path_gps'");
             // Layout handled by configureLayoutForTopic, just need to draw path
@@ -658,7 +759,7 @@
                  dom.dataContentArea.style.justifyContent = 'flex-start';
                  dom.dataContentArea.style.alignItems = 'stretch';
                 try {
-                    const displayText = (typeof data === 'object' && data !== null) ? JSON.stringify(data, null, 2) : String(data);
+                    const displayText = (typeof data === 'object' && data !== null) ? JSON.stringify(data, binaryAwareReplacer, 2) : String(data);
                     dom.dataDisplayElement.textContent = displayText;
                      log.debug(`renderData (text): Displaying data (first 100 chars): ${displayText.substring(0, 100)}...`);
                 } catch (e) {
@@ -680,6 +781,68 @@
     }
 
 
+    // --- Binary Payload Helpers ---
+    function normalizeBinaryPayload(payload) {
+        // Image 'data' fields arrive as ArrayBuffer attachments in binary transport mode.
+        // Wrap them once in a Uint8Array view so drawMap can index them like the legacy number list.
+        if (payload && typeof payload === 'object' && payload.data instanceof ArrayBuffer) {
+            payload.data = new Uint8Array(payload.data);
+        }
+        if (payload && typeof payload === 'object' && payload.scan_frame instanceof ArrayBuffer) {
+            try {
+                Object.assign(payload, decodeScanFrame(payload.scan_frame));
+                delete payload.scan_frame;
+            } catch (e) {
+                log.error("Invalid scan frame:", e);
+            }
+        }
+        return payload;
+    }
+
+    const SCAN_HEADER_BYTES = 32; // See scan_codec.py: 'SCN1', dtype, flags, decimation, count, 5 x float32
+
+    function decodeScanFrame(buffer) {
+        // Binary LaserScan frame -> { ranges: Float32Array (metres, NaN = no return), intensities?, angle_min, ... }
+        const view = new DataView(buffer);
+        if (buffer.byteLength < SCAN_HEADER_BYTES || String.fromCharCode(...new Uint8Array(buffer, 0, 4)) !== 'SCN1') {
+            throw new Error('not a scan frame');
+        }
+        const dtype = view.getUint8(4);
+        const flags = view.getUint8(5);
+        const count = view.getUint32(8, true);
+        const resolution = view.getFloat32(28, true);
+        const scan = {
+            decimation: view.getUint16(6, true),
+            angle_min: view.getFloat32(12, true),
+            angle_increment: view.getFloat32(16, true),
+            range_min: view.getFloat32(20, true),
+            range_max: view.getFloat32(24, true),
+        };
+        const ArrayType = dtype === 2 ? Uint16Array : Float32Array;
+        const values = new ArrayType(buffer, SCAN_HEADER_BYTES, count);
+        if (dtype === 2) {
+            scan.ranges = Float32Array.from(values, v => (v === 0 ? NaN : v * resolution));
+        } else {
+            scan.ranges = values;
+        }
+        if (flags & 1) {
+            const offset = SCAN_HEADER_BYTES + Math.ceil(values.byteLength / 4) * 4;
+            const IntensityType = flags & 2 ? Float32Array : ArrayType; // bit 1: float32 intensities in a uint16 frame
+            scan.intensities = new IntensityType(buffer, offset, count);
+        }
+        return scan;
+    }
+
+    function binaryAwareReplacer(key, value) {
+        // JSON.stringify replacer: summarize binary buffers instead of dumping every byte
+        if (value instanceof Uint8Array) return `<binary ${value.length} bytes>`;
+        if (value instanceof ArrayBuffer) return `<binary ${value.byteLength} bytes>`;
+        if (value instanceof Float32Array || value instanceof Uint16Array) { // Decoded scan arrays
+            return Array.from(value, v => (Number.isNaN(v) ? null : Math.round(v * 1000) / 1000));
+        }
+        return value;
+    }
+
     function formatTimeAgo(timestamp) {
         // Format timestamp into readable relative time
         if (!timestamp || timestamp <= 0) return "never";
@@ -694,203 +857,240 @@
     }
 
     // --- Canvas Drawing ---
-    // function drawMap(canvas, ctx, imageMsg) {
-    //     // --- ADDED: Log entry and received data ---
-    //     log.debug(">>> drawMap function called. Received imageMsg:", imageMsg);
-
-    //     // Draw image data onto the canvas (robust version + ROTATION + SCALING to CONTAINER)
-    //     if (!canvas || !ctx) { log.error("Canvas/Context missing for drawMap"); return; }
-
-    //     const container = dom.mapCanvasContainer;
-    //     if (!container) {
-    //         log.error("Canvas container not found!");
-    //          if (dom.canvasStatus) { dom.canvasStatus.textContent = 'Error: Container not found'; dom.canvasStatus.className = 'canvas-status error'; dom.canvasStatus.style.display = 'block'; }
-    //         return;
-    //     }
-
-    //     const containerWidth = container.clientWidth;
-    //     const containerHeight = container.clientHeight;
-    //     log.debug(`   Canvas container dimensions: ${containerWidth}x${containerHeight}`);
-
-    //     // --- MODIFIED: Added detailed check logging ---
-    //     if (!imageMsg || typeof imageMsg !== 'object' || !imageMsg.width || !imageMsg.height || !imageMsg.encoding || !imageMsg.data) {
-    //         log.warn("Invalid image message structure for drawMap:", imageMsg);
-    //         if (dom.canvasStatus) { dom.canvasStatus.textContent = 'Error: Invalid map data structure'; dom.canvasStatus.className = 'canvas-status error'; dom.canvasStatus.style.display = 'block'; }
-    //          if(containerWidth > 0 && containerHeight > 0) {
-    //             canvas.width = containerWidth; canvas.height = containerHeight;
-    //             ctx.clearRect(0, 0, canvas.width, canvas.height);
-    //             log.debug("   Cleared canvas due to invalid structure.");
-    //          } else {
-    //              log.warn("   Cannot clear canvas, container has no dimensions.");
-    //          }
-    //         return;
-    //     }
-    //     // --- ADDED: Check if data is an array ---
-    //     if (!Array.isArray(imageMsg.data)) {
-    //         log.warn(`Map data field is not an array! Type: ${typeof imageMsg.data}`, imageMsg.data);
-    //          if (dom.canvasStatus) { dom.canvasStatus.textContent = 'Error: Invalid map data type (expected array)'; dom.canvasStatus.className = 'canvas-status error'; dom.canvasStatus.style.display = 'block'; }
-    //          if(containerWidth > 0 && containerHeight > 0) {
-    //             canvas.width = containerWidth; canvas.height = containerHeight;
-    //             ctx.clearRect(0, 0, canvas.width, canvas.height);
-    //              log.debug("   Cleared canvas due to invalid data type.");
-    //          } else {
-    //               log.warn("   Cannot clear canvas, container has no dimensions.");
-    //          }
-    //          return;
-    //     }
-    //      if (containerWidth <= 0 || containerHeight <= 0) {
-    //          log.warn("Canvas container has zero dimensions, skipping draw.");
-    //          canvas.width = 1; canvas.height = 1; // Avoid errors with 0x0 canvas
-    //          ctx.clearRect(0, 0, 1, 1);
-    //          if (dom.canvasStatus) { dom.canvasStatus.textContent = 'Waiting for layout...'; dom.canvasStatus.className = 'canvas-status waiting'; dom.canvasStatus.style.display = 'block'; }
-    //          return;
-    //      }
-    //      // --- END MODIFIED CHECKS ---
-
-    //     const originalWidth = imageMsg.width;
-    //     const originalHeight = imageMsg.height;
-    //     const { encoding } = imageMsg;
-    //     let { step, data: sourceData } = imageMsg;
-    //     const sourceDataLength = sourceData.length; // Get length for checks
-    //     log.debug(`   Image properties: ${originalWidth}x${originalHeight}, Encoding: ${encoding}, Step: ${step}, Data length: ${sourceDataLength}`);
-
-    //     let bytesPerPixelSource = 1;
-    //     if (encoding.includes('rgb') || encoding.includes('bgr') || encoding === '8UC3') bytesPerPixelSource = 3;
-    //     else if (encoding.includes('rgba') || encoding.includes('bgra')) bytesPerPixelSource = 4;
-    //     else if (encoding === 'mono16' || encoding === '16UC1') bytesPerPixelSource = 2;
-    //     if (!step || step < originalWidth * bytesPerPixelSource) step = originalWidth * bytesPerPixelSource;
-    //     log.debug(`   Calculated: bytesPerPixelSource=${bytesPerPixelSource}, step=${step}`);
-
-
-    //     try {
-    //         log.debug("   Creating offscreen canvas...");
-    //         // === Step 1: Draw original image onto an Offscreen Canvas ===
-    //         const offscreenCanvas = document.createElement('canvas');
-    //         offscreenCanvas.width = originalWidth;
-    //         offscreenCanvas.height = originalHeight;
-    //         const offscreenCtx = offscreenCanvas.getContext('2d', { willReadFrequently: true }); // Opt-in for performance if needed, might not be necessary
-    //         if (!offscreenCtx) { throw new Error("Could not create offscreen canvas context."); }
-
-    //         // Check if sourceData length is sufficient BEFORE creating ImageData
-    //         const expectedDataLength = step * (originalHeight - 1) + originalWidth * bytesPerPixelSource;
-    //         if (sourceDataLength < expectedDataLength) {
-    //             log.warn(`   Source data length (${sourceDataLength}) seems too small for dimensions/step/bpp. Expected at least ${expectedDataLength}. Attempting to draw anyway.`);
-    //              // Optional: Throw error here? Or let the loop handle out-of-bounds? Letting loop handle is more robust for slightly truncated data.
-    //              // throw new Error(`Source data length (${sourceDataLength}) is less than expected (${expectedDataLength})`);
-    //         }
-
-
-    //         const offscreenImgData = offscreenCtx.createImageData(originalWidth, originalHeight);
-    //         const offscreenTargetData = offscreenImgData.data;
-    //         log.debug(`   Created offscreen ImageData (${offscreenTargetData.length} bytes). Starting pixel loop...`);
-
-    //          for (let y = 0; y < originalHeight; y++) {
-    //             for (let x = 0; x < originalWidth; x++) {
-    //                 const targetIdx = (y * originalWidth + x) * 4; // Target is always RGBA (4 bytes)
-    //                 let sourceIdx = y * step + x * bytesPerPixelSource;
-
-    //                 // Bounds check for target (shouldn't happen if ImageData is correct size)
-    //                 if (targetIdx + 3 >= offscreenTargetData.length) {
-    //                     // This log indicates a potential logic error in index calculation or canvas size
-    //                     log.warn(`   Pixel Loop: Target index ${targetIdx + 3} out of bounds (${offscreenTargetData.length}) at x=${x}, y=${y}. Breaking inner loop.`);
-    //                     break;
-    //                 }
-
-    //                 // Bounds check for source data (CRITICAL for preventing errors)
-    //                 if (sourceIdx + bytesPerPixelSource - 1 >= sourceDataLength) {
-    //                      // Draw transparent pixel if source data is missing for this coordinate
-    //                     offscreenTargetData[targetIdx] = 0;   // R
-    //                     offscreenTargetData[targetIdx+1] = 0; // G
-    //                     offscreenTargetData[targetIdx+2] = 0; // B
-    //                     offscreenTargetData[targetIdx+3] = 0; // A (Transparent)
-    //                     // Only log this warning once per drawMap call if it happens
-    //                     if (!drawMap.sourceBoundsWarned) {
-    //                          log.warn(`   Pixel Loop: Source index ${sourceIdx + bytesPerPixelSource - 1} out of bounds (${sourceDataLength}) at x=${x}, y=${y}. Filling with transparent and suppressing further warnings for this frame.`);
-    //                          drawMap.sourceBoundsWarned = true;
-    //                     }
-    //                     continue; // Skip to next pixel
-    //                 }
-
-    //                 let r = 0, g = 0, b = 0, a = 255;
-    //                  if (encoding === 'mono8' || encoding === '8UC1') r = g = b = sourceData[sourceIdx];
-    //                 else if (encoding === 'rgb8') { r = sourceData[sourceIdx]; g = sourceData[sourceIdx + 1]; b = sourceData[sourceIdx + 2]; }
-    //                 else if (encoding === 'bgr8' || encoding === '8UC3') { b = sourceData[sourceIdx]; g = sourceData[sourceIdx + 1]; r = sourceData[sourceIdx + 2]; }
-    //                 else if (encoding === 'rgba8') { r = sourceData[sourceIdx]; g = sourceData[sourceIdx + 1]; b = sourceData[sourceIdx + 2]; a = sourceData[sourceIdx + 3]; }
-    //                 else if (encoding === 'bgra8') { b = sourceData[sourceIdx]; g = sourceData[sourceIdx + 1]; r = sourceData[sourceIdx + 2]; a = sourceData[sourceIdx + 3]; }
-    //                 else if (encoding === 'mono16' || encoding === '16UC1') { const pv16 = sourceData[sourceIdx] | (sourceData[sourceIdx + 1] << 8); r = g = b = Math.round(pv16 / 256); }
-    //                 else {
-    //                     if (!drawMap.warnedEncodings) drawMap.warnedEncodings = new Set();
-    //                     if (!drawMap.warnedEncodings.has(encoding)) { log.warn(`   Unsupported canvas encoding: ${encoding}. Rendering as black. Suppressing further warnings for this encoding.`); drawMap.warnedEncodings.add(encoding); }
-    //                     r = g = b = 0; a = 255;
-    //                 }
-    //                 offscreenTargetData[targetIdx] = r; offscreenTargetData[targetIdx + 1] = g; offscreenTargetData[targetIdx + 2] = b; offscreenTargetData[targetIdx + 3] = a;
-    //             }
-    //         }
-    //         drawMap.sourceBoundsWarned = false; // Reset warning flag for next call
-    //         log.debug("   Pixel loop finished. Putting ImageData onto offscreen canvas...");
-    //         offscreenCtx.putImageData(offscreenImgData, 0, 0);
-
-    //         // === Step 2: Rotate and Draw Scaled onto Main Canvas ===
-    //         log.debug("   Resizing main canvas and clearing...");
-    //         canvas.width = containerWidth;
-    //         canvas.height = containerHeight;
-
-    //         ctx.clearRect(0, 0, canvas.width, canvas.height);
-    //         ctx.save();
-
-    //          // Calculate aspect ratios and drawing dimensions
-    //         const rotatedImageAspectRatio = originalHeight / originalWidth; // Aspect ratio *after* 90/-90 deg rotation
-    //         const containerAspectRatio = canvas.width / canvas.height;
-    //         let drawWidth, drawHeight;
-    //         if (rotatedImageAspectRatio > containerAspectRatio) {
-    //             // Fit to container width
-    //             drawWidth = canvas.width;
-    //             drawHeight = drawWidth / rotatedImageAspectRatio;
-    //         } else {
-    //             // Fit to container height
-    //             drawHeight = canvas.height;
-    //             drawWidth = drawHeight * rotatedImageAspectRatio;
-    //         }
-    //         log.debug(`   Calculated draw dimensions (rotated): ${drawWidth.toFixed(1)}x${drawHeight.toFixed(1)}`);
-
-
-    //         // Apply transformations
-    //         ctx.translate(canvas.width / 2, canvas.height / 2);
-    //         const rotationAngle = -Math.PI; // -180 degrees
-    //          log.debug(`   Applying rotation: ${rotationAngle} radians (${rotationAngle * 180 / Math.PI} degrees)`);
-    //         ctx.rotate(rotationAngle); // Apply rotation
-
-    //         // Draw the offscreen canvas onto the main canvas, scaled and centered
-    //          log.debug("   Drawing rotated image onto main canvas...");
-    //         ctx.drawImage(
-    //             offscreenCanvas, // Source: the offscreen canvas with the original image
-    //             0, 0, originalWidth, originalHeight, // Source rect: full original image
-    //             -drawWidth / 2, -drawHeight / 2, drawWidth, drawHeight // Destination rect: scaled and centered around (0,0) after translate/rotate
-    //         );
-
-    //         ctx.restore();
-    //         log.debug("   Draw complete. Hiding canvas status.");
-
-    //         if (dom.canvasStatus) dom.canvasStatus.style.display = 'none';
-
-    //     } catch (e) {
-    //         log.error("Canvas draw error:", e);
-    //         if (dom.canvasStatus) { dom.canvasStatus.textContent = `Render Error: ${e.message}`; dom.canvasStatus.className = 'canvas-status error'; dom.canvasStatus.style.display = 'block'; }
-    //         // Attempt to clear canvas even on error
-    //         try {
-    //              if (canvas.width > 0 && canvas.height > 0) {
-    //                 log.debug("   Clearing canvas after error.");
-    //                 canvas.width = containerWidth; canvas.height = containerHeight; // Ensure size before clear
-    //                 ctx.clearRect(0, 0, canvas.width, canvas.height);
-    //              }
-    //         } catch(clearErr) {
-    //              log.error("   Error trying to clear canvas after draw error:", clearErr);
-    //         }
-    //     } finally {
-    //          // Reset warned encodings flag for next call
-    //          if (drawMap.warnedEncodings) drawMap.warnedEncodings = new Set();
-    //     }
-    // }
+    function drawMap(canvas, ctx, imageMsg) {
+        // --- ADDED: Log entry and received data ---
+        log.debug(">>> drawMap function called. Received imageMsg:", imageMsg);
+
+        // Draw image data onto the canvas (robust version + ROTATION + SCALING to CONTAINER)
+        if (!canvas || !ctx) { log.error("Canvas/Context missing for drawMap"); return; }
+
+        const container = dom.mapCanvasContainer;
+        if (!container) {
+            log.error("Canvas container not found!");
+             if (dom.canvasStatus) { dom.canvasStatus.textContent = 'Error: Container not found'; dom.canvasStatus.className = 'canvas-status error'; dom.canvasStatus.style.display = 'block'; }
+            return;
+        }
+
+        const containerWidth = container.clientWidth;
+        const containerHeight = container.clientHeight;
+        log.debug(`   Canvas container dimensions: ${containerWidth}x${containerHeight}`);
+
+        // --- MODIFIED: Added detailed check logging ---
+        if (!imageMsg || typeof imageMsg !== 'object' || !imageMsg.width || !imageMsg.height || !imageMsg.encoding || (!imageMsg.data && !imageMsg.frame_url)) {
+            log.warn("Invalid image message structure for drawMap:", imageMsg);
+            if (dom.canvasStatus) { dom.canvasStatus.textContent = 'Error: Invalid map data structure'; dom.canvasStatus.className = 'canvas-status error'; dom.canvasStatus.style.display = 'block'; }
+             if(containerWidth > 0 && containerHeight > 0) {
+                canvas.width = containerWidth; canvas.height = containerHeight;
+                ctx.clearRect(0, 0, canvas.width, canvas.height);
+                log.debug("   Cleared canvas due to invalid structure.");
+             } else {
+                 log.warn("   Cannot clear canvas, container has no dimensions.");
+             }
+            return;
+        }
+        // --- ADDED: Check if data is an array (plain list or binary Uint8Array) ---
+        if (!imageMsg.frame_url && !Array.isArray(imageMsg.data) && !(imageMsg.data instanceof Uint8Array)) {
+            log.warn(`Map data field is not an array! Type: ${typeof imageMsg.data}`, imageMsg.data);
+             if (dom.canvasStatus) { dom.canvasStatus.textContent = 'Error: Invalid map data type (expected array)'; dom.canvasStatus.className = 'canvas-status error'; dom.canvasStatus.style.display = 'block'; }
+             if(containerWidth > 0 && containerHeight > 0) {
+                canvas.width = containerWidth; canvas.height = containerHeight;
+                ctx.clearRect(0, 0, canvas.width, canvas.height);
+                 log.debug("   Cleared canvas due to invalid data type.");
+             } else {
+                  log.warn("   Cannot clear canvas, container has no dimensions.");
+             }
+             return;
+        }
+         if (containerWidth <= 0 || containerHeight <= 0) {
+             log.warn("Canvas container has zero dimensions, skipping draw.");
+             canvas.width = 1; canvas.height = 1; // Avoid errors with 0x0 canvas
+             ctx.clearRect(0, 0, 1, 1);
+             if (dom.canvasStatus) { dom.canvasStatus.textContent = 'Waiting for layout...'; dom.canvasStatus.className = 'canvas-status waiting'; dom.canvasStatus.style.display = 'block'; }
+             return;
+         }
+         // --- END MODIFIED CHECKS ---
+
+        // Server-transcoded frame (IMAGE_TRANSCODE): no pixel data, load the PNG/JPEG at container size
+        if (imageMsg.frame_url) {
+            drawServerFrame(canvas, ctx, imageMsg, containerWidth, containerHeight);
+            return;
+        }
+
+        const originalWidth = imageMsg.width;
+        const originalHeight = imageMsg.height;
+        const { encoding } = imageMsg;
+        let { step, data: sourceData } = imageMsg;
+        const sourceDataLength = sourceData.length; // Get length for checks
+        log.debug(`   Image properties: ${originalWidth}x${originalHeight}, Encoding: ${encoding}, Step: ${step}, Data length: ${sourceDataLength}`);
+
+        let bytesPerPixelSource = 1;
+        if (encoding.includes('rgb') || encoding.includes('bgr') || encoding === '8UC3') bytesPerPixelSource = 3;
+        else if (encoding.includes('rgba') || encoding.includes('bgra')) bytesPerPixelSource = 4;
+        else if (encoding === 'mono16' || encoding === '16UC1') bytesPerPixelSource = 2;
+        if (!step || step < originalWidth * bytesPerPixelSource) step = originalWidth * bytesPerPixelSource;
+        log.debug(`   Calculated: bytesPerPixelSource=${bytesPerPixelSource}, step=${step}`);
+
+
+        try {
+            log.debug("   Creating offscreen canvas...");
+            // === Step 1: Draw original image onto an Offscreen Canvas ===
+            const offscreenCanvas = document.createElement('canvas');
+            offscreenCanvas.width = originalWidth;
+            offscreenCanvas.height = originalHeight;
+            const offscreenCtx = offscreenCanvas.getContext('2d', { willReadFrequently: true }); // Opt-in for performance if needed, might not be necessary
+            if (!offscreenCtx) { throw new Error("Could not create offscreen canvas context."); }
+
+            // Check if sourceData length is sufficient BEFORE creating ImageData
+            const expectedDataLength = step * (originalHeight - 1) + originalWidth * bytesPerPixelSource;
+            if (sourceDataLength < expectedDataLength) {
+                log.warn(`   Source data length (${sourceDataLength}) seems too small for dimensions/step/bpp. Expected at least ${expectedDataLength}. Attempting to draw anyway.`);
+                 // Optional: Throw error here? Or let the loop handle out-of-bounds? Letting loop handle is more robust for slightly truncated data.
+                 // throw new Error(`Source data length (${sourceDataLength}) is less than expected (${expectedDataLength})`);
+            }
+
+
+            const offscreenImgData = offscreenCtx.createImageData(originalWidth, originalHeight);
+            const offscreenTargetData = offscreenImgData.data;
+            log.debug(`   Created offscreen ImageData (${offscreenTargetData.length} bytes). Starting pixel loop...`);
+
+             for (let y = 0; y < originalHeight; y++) {
+                for (let x = 0; x < originalWidth; x++) {
+                    const targetIdx = (y * originalWidth + x) * 4; // Target is always RGBA (4 bytes)
+                    let sourceIdx = y * step + x * bytesPerPixelSource;
+
+                    // Bounds check for target (shouldn't happen if ImageData is correct size)
+                    if (targetIdx + 3 >= offscreenTargetData.length) {
+                        // This log indicates a potential logic error in index calculation or canvas size
+                        log.warn(`   Pixel Loop: Target index ${targetIdx + 3} out of bounds (${offscreenTargetData.length}) at x=${x}, y=${y}. Breaking inner loop.`);
+                        break;
+                    }
+
+                    // Bounds check for source data (CRITICAL for preventing errors)
+                    if (sourceIdx + bytesPerPixelSource - 1 >= sourceDataLength) {
+                         // Draw transparent pixel if source data is missing for this coordinate
+                        offscreenTargetData[targetIdx] = 0;   // R
+                        offscreenTargetData[targetIdx+1] = 0; // G
+                        offscreenTargetData[targetIdx+2] = 0; // B
+                        offscreenTargetData[targetIdx+3] = 0; // A (Transparent)
+                        // Only log this warning once per drawMap call if it happens
+                        if (!drawMap.sourceBoundsWarned) {
+                             log.warn(`   Pixel Loop: Source index ${sourceIdx + bytesPerPixelSource - 1} out of bounds (${sourceDataLength}) at x=${x}, y=${y}. Filling with transparent and suppressing further warnings for this frame.`);
+                             drawMap.sourceBoundsWarned = true;
+                        }
+                        continue; // Skip to next pixel
+                    }
+
+                    let r = 0, g = 0, b = 0, a = 255;
+                     if (encoding === 'mono8' || encoding === '8UC1') r = g = b = sourceData[sourceIdx];
+                    else if (encoding === 'rgb8') { r = sourceData[sourceIdx]; g = sourceData[sourceIdx + 1]; b = sourceData[sourceIdx + 2]; }
+                    else if (encoding === 'bgr8' || encoding === '8UC3') { b = sourceData[sourceIdx]; g = sourceData[sourceIdx + 1]; r = sourceData[sourceIdx + 2]; }
+                    else if (encoding === 'rgba8') { r = sourceData[sourceIdx]; g = sourceData[sourceIdx + 1]; b = sourceData[sourceIdx + 2]; a = sourceData[sourceIdx + 3]; }
+                    else if (encoding === 'bgra8') { b = sourceData[sourceIdx]; g = sourceData[sourceIdx + 1]; r = sourceData[sourceIdx + 2]; a = sourceData[sourceIdx + 3]; }
+                    else if (encoding === 'mono16' || encoding === '16UC1') { const pv16 = sourceData[sourceIdx] | (sourceData[sourceIdx + 1] << 8); r = g = b = Math.round(pv16 / 256); }
+                    else {
+                        if (!drawMap.warnedEncodings) drawMap.warnedEncodings = new Set();
+                        if (!drawMap.warnedEncodings.has(encoding)) { log.warn(`   Unsupported canvas encoding: ${encoding}. Rendering as black. Suppressing further warnings for this encoding.`); drawMap.warnedEncodings.add(encoding); }
+                        r = g = b = 0; a = 255;
+                    }
+                    offscreenTargetData[targetIdx] = r; offscreenTargetData[targetIdx + 1] = g; offscreenTargetData[targetIdx + 2] = b; offscreenTargetData[targetIdx + 3] = a;
+                }
+            }
+            drawMap.sourceBoundsWarned = false; // Reset warning flag for next call
+            log.debug("   Pixel loop finished. Putting ImageData onto offscreen canvas...");
+            offscreenCtx.putImageData(offscreenImgData, 0, 0);
+
+            // === Step 2: Rotate and Draw Scaled onto Main Canvas ===
+            drawRotatedScaled(canvas, ctx, offscreenCanvas, originalWidth, originalHeight, containerWidth, containerHeight);
+            log.debug("   Draw complete. Hiding canvas status.");
+
+            if (dom.canvasStatus) dom.canvasStatus.style.display = 'none';
+
+        } catch (e) {
+            log.error("Canvas draw error:", e);
+            if (dom.canvasStatus) { dom.canvasStatus.textContent = `Render Error: ${e.message}`; dom.canvasStatus.className = 'canvas-status error'; dom.canvasStatus.style.display = 'block'; }
+            // Attempt to clear canvas even on error
+            try {
+                 if (canvas.width > 0 && canvas.height > 0) {
+                    log.debug("   Clearing canvas after error.");
+                    canvas.width = containerWidth; canvas.height = containerHeight; // Ensure size before clear
+                    ctx.clearRect(0, 0, canvas.width, canvas.height);
+                 }
+            } catch(clearErr) {
+                 log.error("   Error trying to clear canvas after draw error:", clearErr);
+            }
+        } finally {
+             // Reset warned encodings flag for next call
+             if (drawMap.warnedEncodings) drawMap.warnedEncodings = new Set();
+        }
+    }
+
+    function drawRotatedScaled(canvas, ctx, source, sourceWidth, sourceHeight, containerWidth, containerHeight) {
+        // Rotate by 180 degrees and fit the source (canvas or image) into the container
+        log.debug("   Resizing main canvas and clearing...");
+        canvas.width = containerWidth;
+        canvas.height = containerHeight;
+
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        ctx.save();
+
+         // Calculate aspect ratios and drawing dimensions
+        const rotatedImageAspectRatio = sourceHeight / sourceWidth; // Aspect ratio *after* 90/-90 deg rotation
+        const containerAspectRatio = canvas.width / canvas.height;
+        let drawWidth, drawHeight;
+        if (rotatedImageAspectRatio > containerAspectRatio) {
+            // Fit to container width
+            drawWidth = canvas.width;
+            drawHeight = drawWidth / rotatedImageAspectRatio;
+        } else {
+            // Fit to container height
+            drawHeight = canvas.height;
+            drawWidth = drawHeight * rotatedImageAspectRatio;
+        }
+        log.debug(`   Calculated draw dimensions (rotated): ${drawWidth.toFixed(1)}x${drawHeight.toFixed(1)}`);
+
+        // Apply transformations
+        ctx.translate(canvas.width / 2, canvas.height / 2);
+        const rotationAngle = -Math.PI; // -180 degrees
+        log.debug(`   Applying rotation: ${rotationAngle} radians (${rotationAngle * 180 / Math.PI} degrees)`);
+        ctx.rotate(rotationAngle); // Apply rotation
+
+        // Draw the source onto the main canvas, scaled and centered
+        log.debug("   Drawing rotated image onto main canvas...");
+        ctx.drawImage(
+            source,
+            0, 0, sourceWidth, sourceHeight, // Source rect: full image
+            -drawWidth / 2, -drawHeight / 2, drawWidth, drawHeight // Destination rect: scaled and centered around (0,0) after translate/rotate
+        );
+
+        ctx.restore();
+    }
+
+    function drawServerFrame(canvas, ctx, imageMsg, containerWidth, containerHeight) {
+        // Ask for the frame at the size it will be displayed; the server rounds to a cached size bucket
+        const maxDim = Math.ceil(Math.max(containerWidth, containerHeight) * (window.devicePixelRatio || 1));
+        const url = `${imageMsg.frame_url}&max_dim=${maxDim}`;
+        if (drawServerFrame.latestUrl === url) {
+            // Same frame: redraw from the loaded image (the canvas may have been cleared), or wait for it
+            const loaded = drawServerFrame.image;
+            if (loaded && loaded.complete && loaded.naturalWidth) drawRotatedScaled(canvas, ctx, loaded, loaded.naturalWidth, loaded.naturalHeight, containerWidth, containerHeight);
+            return;
+        }
+        drawServerFrame.latestUrl = url;
+        const img = new Image();
+        drawServerFrame.image = img;
+        img.onload = () => {
+            if (drawServerFrame.latestUrl !== url) return; // A newer frame superseded this one
+            drawRotatedScaled(canvas, ctx, img, img.naturalWidth, img.naturalHeight, containerWidth, containerHeight);
+            if (dom.canvasStatus) dom.canvasStatus.style.display = 'none';
+        };
+        img.onerror = () => {
+            if (drawServerFrame.latestUrl !== url) return;
+            drawServerFrame.latestUrl = null; // Allow a retry on the next render
+            log.warn(`Failed to load frame ${url}`);
+            if (dom.canvasStatus) { dom.canvasStatus.textContent = 'Error: Could not load image frame'; dom.canvasStatus.className = 'canvas-status error'; dom.canvasStatus.style.display = 'block'; }
+        };
+        img.src = url;
+    }
 
 
     // --- OpenStreetMap Updates ---
@@ -1490,6 +1690,8 @@
         dom.robotSelector.addEventListener('change', (event) => selectRobot(event.target.value));
         dom.toggleBtns.forEach(btn => btn.addEventListener('click', handleToggleButtonClick));
         if (dom.sendJoystickCmdBtn) dom.sendJoystickCmdBtn.addEventListener('click', sendJoystickCommand);
+        if (dom.liveTeleopBtn) dom.liveTeleopBtn.addEventListener('click', handleLiveTeleopToggle); // After the generic toggle handler
+        document.querySelectorAll('#controller-view input[id^="joy-"]').forEach(input => input.addEventListener('input', sendTeleopFrame));
         if (dom.testServerCmdBtn) dom.testServerCmdBtn.addEventListener('click', sendTestServerCommand);
         // Quick Commands
         if (dom.quickNavBtn) dom.quickNavBtn.addEventListener('click', sendQuickNavCommand);
@@ -1556,7 +1758,7 @@
         } else if (viewId === 'controller-view') {
              log.debug("showView (controller): Initializing/updating controller map and state.");
             initControllerMap(); // Ensure map exists
-            checkAllRobotStatuses(); // Update enable/disable state
+            applyRobotStatuses(); // Update enable/disable state
             // Update map elements
             centerControllerMapOnRobot();
             updateControllerMapRobotMarker();
@@ -1647,11 +1849,8 @@
     }
 
     // --- Send Command Functions ---
-    function sendJoystickCommand() {
-        // Send the joystick control command
-        if (!selectedRobot || robotStatus[selectedRobot] !== 'online') { showCommandFeedback('warning', 'Joystick: Robot not selected or offline.'); return; }
-        log.info(`Sending Joystick Command for robot ${selectedRobot}`);
-        const payload = {
+    function buildJoystickPayload() {
+        return {
             e_stop: getControllerValue(document.getElementById('joy-estop'), 'boolean'),
             joy_ready: getControllerValue(document.getElementById('joy-ready'), 'boolean'),
             enable_joy_drive_mode: getControllerValue(document.getElementById('joy-drive-mode'), 'boolean'),
@@ -1662,11 +1861,69 @@
             tele_type: getControllerValue(document.getElementById('joy-tele-type'), 'string'),
             joystick_vel_cmd: buildNestedObject('.input-group.twist-group', 'joystick_vel_cmd', '#controller-view .control-section:first-of-type') // Scope to Joystick section
         };
+    }
+
+    function sendJoystickCommand() {
+        // Send the joystick control command
+        if (!selectedRobot || robotStatus[selectedRobot] !== 'online') { showCommandFeedback('warning', 'Joystick: Robot not selected or offline.'); return; }
+        log.info(`Sending Joystick Command for robot ${selectedRobot}`);
+        const payload = buildJoystickPayload();
          log.debug("Joystick Payload:", JSON.stringify(payload));
         socket.emit('send_command', { robot_id: selectedRobot, command_type: 'joystick_control', payload });
         // Optional: showCommandFeedback('info', `Joystick command sent.`);
     }
 
+    // --- Live Teleop ---
+    // While enabled, the joystick payload is streamed as 'teleop' events: immediately on every input
+    // change and as a keepalive every TELEOP_KEEPALIVE_MS. The server publishes only the latest one at
+    // its fixed control rate and stops the robot if the stream goes quiet (TELEOP_STALE_TIMEOUT).
+    function handleLiveTeleopToggle() {
+        if (dom.liveTeleopBtn.classList.contains('on')) {
+            if (!selectedRobot || robotStatus[selectedRobot] !== 'online') {
+                showCommandFeedback('warning', 'Teleop: Robot not selected or offline.');
+                setLiveTeleopButton(false);
+                return;
+            }
+            teleopRobot = selectedRobot;
+            sendTeleopFrame();
+            teleopTimer = setInterval(sendTeleopFrame, TELEOP_KEEPALIVE_MS);
+            showCommandFeedback('info', `Live teleop started for ${teleopRobot}.`);
+        } else {
+            stopTeleop();
+        }
+    }
+
+    function setLiveTeleopButton(on) {
+        if (!dom.liveTeleopBtn) return;
+        dom.liveTeleopBtn.classList.toggle('on', on);
+        dom.liveTeleopBtn.classList.toggle('off', !on);
+        dom.liveTeleopBtn.textContent = on ? 'ON' : 'OFF';
+    }
+
+    function sendTeleopFrame() {
+        if (!teleopRobot || !socket.connected) return;
+        const sentAt = performance.now();
+        socket.emit('teleop', { robot_id: teleopRobot, payload: buildJoystickPayload() }, (ack) => {
+            if (ack?.status !== 'ok') {
+                log.warn('Teleop rejected:', ack?.message);
+                return;
+            }
+            if (dom.teleopLatency) {
+                const publish = ack.latency_ms != null ? ` · publish ${ack.latency_ms} ms` : '';
+                dom.teleopLatency.textContent = `(RTT ${Math.round(performance.now() - sentAt)} ms${publish})`;
+            }
+        });
+    }
+
+    function stopTeleop() {
+        if (teleopTimer) clearInterval(teleopTimer);
+        teleopTimer = null;
+        if (teleopRobot && socket.connected) socket.emit('teleop_stop', { robot_id: teleopRobot });
+        teleopRobot = null;
+        setLiveTeleopButton(false);
+        if (dom.teleopLatency) dom.teleopLatency.textContent = '';
+    }
+
     function sendTestServerCommand() {
         // Test server command to check if robot receives it
         if (!selectedRobot || robotStatus[selectedRobot] !== 'online') { 
@@ -1826,12 +2083,39 @@
         }
     }
 
+    // --- Robot Presence ---
+    // Online/offline status is owned by the server, which only sends transitions
+    // ('robot_online' / 'robot_offline', 'topic_stale'); messages just update last_seen.
+    function noteRobotSeen(robotId, lastSeen) {
+        // Record the last_seen time the server reported with a message from robotId
+        if (!latestData[robotId]) latestData[robotId] = { last_seen: 0, topics: {} };
+        latestData[robotId].last_seen = Math.max(latestData[robotId].last_seen || 0, lastSeen || 0);
+    }
+
+    function setRobotStatus(robotId, status) {
+        if (!robotId || !knownRobots.includes(robotId) || robotStatus[robotId] === status) return;
+        log.debug(`Robot ${robotId} status changed: ${robotStatus[robotId] || 'none'} -> ${status}`);
+        robotStatus[robotId] = status;
+        applyRobotStatuses();
+    }
+
+    function setTopicStale(robotId, subTopic, stale) {
+        const key = `${robotId}/${subTopic}`;
+        if (stale === staleTopics.has(key)) return;
+        if (stale) staleTopics.add(key); else staleTopics.delete(key);
+        if (robotId === selectedRobot) populateTopicList(robotId);
+    }
+
     // --- Socket.IO Event Listeners ---
     socket.on('connect', () => {
         log.info('Socket.IO Connected! SID:', socket.id);
         updateConnectionStatus(true);
         setStatus("Connected. Requesting initial state...", true);
-        if (statusCheckInterval) clearInterval(statusCheckInterval); statusCheckInterval = null;
+        activeSubscriptions.clear(); // Rooms do not survive a reconnect; re-sync after initial_state
+        topicSeq = {}; // Delta sequences restart with the server
+        resyncPending.clear();
+        pathSubscription = null;
+        pendingPathUpdates = [];
         clearCommandFeedback();
         // Server should automatically send initial_state on connection
     });
@@ -1842,7 +2126,6 @@
         setStatus("Disconnected. Attempting to reconnect...", true);
         if(dom.robotSelector) dom.robotSelector.disabled = true;
         disableController("Disconnected from server.", true);
-        if (statusCheckInterval) clearInterval(statusCheckInterval); statusCheckInterval = null;
         // Mark robots as offline visually
         Object.keys(robotStatus).forEach(rId => robotStatus[rId] = 'offline');
         updateRobotStatusUI();
@@ -1855,7 +2138,6 @@
         setStatus(`Connection Error: ${err.message}. Retrying...`, true);
         if(dom.robotSelector) dom.robotSelector.disabled = true;
         disableController("Connection error.", true);
-        if (statusCheckInterval) clearInterval(statusCheckInterval); statusCheckInterval = null;
         Object.keys(robotStatus).forEach(rId => robotStatus[rId] = 'offline'); updateRobotStatusUI();
         if (sequenceActive) { log.warn("Socket connection error during active sequence. Stopping."); stopSequence('error'); }
     });
@@ -1864,32 +2146,28 @@
         log.info('Received initial state from server.');
         log.debug('Initial state data:', state); // Log the whole state
         try {
-            latestData = state.all_data || {};
+            // Metadata only (payloads are fetched on demand), serialized once on the server for all connects
+            latestData = state.all_data_json ? JSON.parse(state.all_data_json) : (state.all_data || {});
             knownRobots = state.known_robots || [];
             expectedSubTopics = state.robot_sub_topics || [];
-            robotStatus = {}; // Reset status
-
-            // Initialize status based on received data
+            pathSubTopics = new Set(state.path_sub_topics || []);
+            // Presence is computed by the server; later changes arrive as transition events
+            robotStatus = {};
             knownRobots.forEach(rId => {
-                 const lastSeen = latestData[rId]?.last_seen || 0;
-                 if (lastSeen > 0 && (Date.now() - lastSeen) < OFFLINE_THRESHOLD) robotStatus[rId] = 'online';
-                 else if (lastSeen > 0) robotStatus[rId] = 'offline';
-                 else robotStatus[rId] = 'waiting';
-                 log.debug(`Initial status for ${rId}: ${robotStatus[rId]} (last seen: ${lastSeen})`);
+                 robotStatus[rId] = state.robot_status?.[rId] || 'waiting';
+                 log.debug(`Initial status for ${rId}: ${robotStatus[rId]} (last seen: ${latestData[rId]?.last_seen || 0})`);
             });
+            staleTopics = new Set();
+            Object.entries(state.stale_topics || {}).forEach(([rId, subTopics]) => subTopics.forEach(t => staleTopics.add(`${rId}/${t}`)));
 
             populateRobotSelector(); // Populate dropdown
-
-            // Start status checking ONLY after getting initial state
-            if (statusCheckInterval) clearInterval(statusCheckInterval);
-            statusCheckInterval = setInterval(checkAllRobotStatuses, STATUS_CHECK_INTERVAL);
-            log.info(`Robot status check interval (${STATUS_CHECK_INTERVAL / 1000}s) started.`);
-            checkAllRobotStatuses(); // Initial check
+            applyRobotStatuses();
 
             // Restore UI based on selection
             if (selectedRobot && knownRobots.includes(selectedRobot)) {
                 log.info(`Restoring state for selected robot: ${selectedRobot}`);
                 populateTopicList(selectedRobot);
+                fetchTopicPayload(selectedRobot, 'robot_status');
                 if (selectedSubTopic) {
                     log.debug(`Restoring selected topic: ${selectedSubTopic}`);
                     configureLayoutForTopic(selectedSubTopic);
@@ -1904,7 +2182,7 @@
                 initControllerMap(); // Make sure controller map is ready if needed
                 centerControllerMapOnRobot(); updateControllerMapRobotMarker(); updateControllerMapRoute();
                 updateStoredMarkerPositions();
-                checkAllRobotStatuses(); // Update controller enabled state
+                applyRobotStatuses(); // Update controller enabled state
             } else {
                  log.info("No valid robot previously selected or selection is now invalid. Deselecting.");
                 selectRobot(null); // Deselect if invalid
@@ -1918,6 +2196,7 @@
                  // If a topic is selected, renderData will set the status/header correctly
                  // renderData(); // Already called above if topic was selected
              }
+            syncSubscriptions();
             log.info("Initial state processed successfully.");
 
         } catch (e) {
@@ -1927,8 +2206,10 @@
         }
     });
 
-    socket.on('mqtt_data', (data) => {
-        // Process incoming MQTT data forwarded by the server
+    socket.on('mqtt_data', handleMqttData);
+
+    function handleMqttData(data) {
+        // Process incoming MQTT data forwarded by the server (or fetched via get_topic)
         // --- ADDED: Log all incoming MQTT data via socket ---
         // log.debug("<<< Received 'mqtt_data' via SocketIO:", data);
 
@@ -1943,7 +2224,7 @@
          if (robot_id === 'bulldog01_5f899b' && sub_topic === 'routed_map') {
              log.debug(`>>> Received bulldog/routed_map data via socket. Payload type: ${typeof topicEntry?.payload}, Timestamp: ${topicEntry?.timestamp}`);
              if (typeof topicEntry?.payload === 'object' && topicEntry.payload !== null && topicEntry.payload.data) {
-                 log.debug(`    Payload keys: ${Object.keys(topicEntry.payload)}, Data field type: ${typeof topicEntry.payload.data}, Is Array: ${Array.isArray(topicEntry.payload.data)}, Data length: ${Array.isArray(topicEntry.payload.data) ? topicEntry.payload.data.length : 'N/A'}`);
+                 log.debug(`    Payload keys: ${Object.keys(topicEntry.payload)}, Data field type: ${typeof topicEntry.payload.data}, Is Array: ${Array.isArray(topicEntry.payload.data)}, Is Binary: ${topicEntry.payload.data instanceof ArrayBuffer}`);
              } else if (typeof topicEntry?.payload === 'string' && topicEntry.payload.startsWith('Error:')) {
                   log.warn(`    Received payload is an error string: ${topicEntry.payload}`);
              }
@@ -1953,32 +2234,22 @@
 
         if (!knownRobots.includes(robot_id)) return; // Ignore unknown robots
 
+        normalizeBinaryPayload(topicEntry?.payload); // ArrayBuffer image data -> Uint8Array
+
         // Ensure data structure exists
         if (!latestData[robot_id]) latestData[robot_id] = { last_seen: 0, topics: {} };
         if (!latestData[robot_id].topics) latestData[robot_id].topics = {};
 
-        const oldLastSeen = latestData[robot_id].last_seen || 0;
+        // Drop out-of-order entries (e.g. a get_topic reply racing a live update)
+        const storedEntry = latestData[robot_id].topics[sub_topic];
+        if (storedEntry?.payload !== undefined && (storedEntry.timestamp || 0) > (topicEntry?.timestamp || 0)) return;
+
         // Store the { payload: ..., timestamp: ... } object
         latestData[robot_id].topics[sub_topic] = topicEntry;
-        latestData[robot_id].last_seen = robot_last_seen;
-
-        // Update status if needed (reduce frequency of checks unless status changes)
-        const previousStatus = robotStatus[robot_id];
-        const now = Date.now();
-        let currentStatus = 'offline';
-        if (robot_last_seen > 0 && (now - robot_last_seen) < OFFLINE_THRESHOLD) currentStatus = 'online';
-        else if (robot_last_seen > 0) currentStatus = 'offline';
-        else currentStatus = 'waiting';
-
-        if (previousStatus !== currentStatus) {
-            log.debug(`Status change detected for ${robot_id} on message receipt: ${previousStatus} -> ${currentStatus}. Triggering checkAllRobotStatuses.`);
-            checkAllRobotStatuses(); // Re-evaluates status for all robots and updates UI/controller
-        } else if (robot_id === selectedRobot && currentStatus === 'online' && dom.controllerContent?.classList.contains('controller-disabled')) {
-             // If the selected robot was previously offline/waiting but is now online, re-enable controller immediately
-              log.debug(`Selected robot ${robot_id} is now online. Triggering checkAllRobotStatuses to potentially re-enable controller.`);
-              checkAllRobotStatuses();
-        }
+        if (storedEntry?.stale && !topicEntry?.stale && robot_id === selectedRobot) populateTopicList(robot_id);
+        if (data.seq !== undefined) topicSeq[`${robot_id}/${sub_topic}`] = data.seq; // Keyframe: base for later deltas
 
+        noteRobotSeen(robot_id, robot_last_seen);
 
         // Update UI ONLY if data is for the currently selected robot AND topic/view
         if (robot_id === selectedRobot) {
@@ -2018,14 +2289,135 @@
                  updateOsmMapPositionFromStatus();
             }
         }
+    }
+
+    function fetchTopicPayload(robotId, subTopic) {
+        // Lazily fetch one topic's latest payload (initial_state only carries metadata)
+        if (!robotId || !subTopic || !socket.connected) return;
+        socket.emit('get_topic', { robot_id: robotId, sub_topic: subTopic }, (response) => {
+            resyncPending.delete(`${robotId}/${subTopic}`);
+            if (response?.status !== 'ok') {
+                log.debug(`get_topic ${robotId}/${subTopic}: ${response?.message || 'no data'}`);
+                return;
+            }
+            handleMqttData({ robot_id: robotId, sub_topic: subTopic, data: response.data, robot_last_seen: response.robot_last_seen, seq: response.seq });
+        });
+    }
+
+    socket.on('path_update', applyPathUpdate);
+
+    // --- Delta Topics ---
+    socket.on('mqtt_delta', handleMqttDelta);
+
+    function handleMqttDelta(delta) {
+        // Field-level patch {seq, timestamp, set: [[path, value]], unset: [path]} against the previous message
+        const { robot_id, sub_topic, seq } = delta || {};
+        if (!robot_id || !sub_topic || typeof seq !== 'number' || !knownRobots.includes(robot_id)) return;
+        const key = `${robot_id}/${sub_topic}`;
+        const lastSeq = topicSeq[key];
+        const base = latestData[robot_id]?.topics?.[sub_topic];
+        if (lastSeq !== undefined && seq <= lastSeq) return; // Already covered by a keyframe/resync
+        if (lastSeq === undefined || seq !== lastSeq + 1 || !base || typeof base.payload !== 'object' || base.payload === null) {
+            log.debug(`Delta gap on ${key} (have ${lastSeq}, got ${seq}); requesting resync`);
+            delete topicSeq[key];
+            requestResync(robot_id, sub_topic);
+            return;
+        }
+        const payload = base.payload;
+        (delta.set || []).forEach(([path, value]) => applyPatchValue(payload, path, value));
+        (delta.unset || []).forEach(path => removePatchValue(payload, path));
+        handleMqttData({
+            robot_id, sub_topic, seq,
+            data: { payload, timestamp: delta.timestamp, size: delta.size },
+            robot_last_seen: delta.robot_last_seen
+        });
+    }
+
+    function applyPatchValue(target, path, value) {
+        let node = target;
+        for (let i = 0; i < path.length - 1; i++) {
+            if (typeof node[path[i]] !== 'object' || node[path[i]] === null) node[path[i]] = {};
+            node = node[path[i]];
+        }
+        node[path[path.length - 1]] = value;
+    }
+
+    function removePatchValue(target, path) {
+        let node = target;
+        for (let i = 0; i < path.length - 1; i++) {
+            node = node?.[path[i]];
+            if (typeof node !== 'object' || node === null) return;
+        }
+        delete node[path[path.length - 1]];
+    }
+
+    function requestResync(robotId, subTopic) {
+        // Missed a sequence number (or no base yet): fetch the stream's last entry + seq; the next keyframe also recovers
+        const key = `${robotId}/${subTopic}`;
+        if (resyncPending.has(key)) return;
+        resyncPending.add(key);
+        fetchTopicPayload(robotId, subTopic);
+    }
+
+
+    // --- Robot Registry Events ---
+    socket.on('robot_added', (data) => {
+        // A robot registered itself with its first message (or a known robot after a server restart)
+        const robotId = data?.robot_id;
+        if (!robotId || knownRobots.includes(robotId)) return;
+        log.info(`Robot added: ${robotId}`);
+        knownRobots.push(robotId);
+        knownRobots.sort();
+        if (!latestData[robotId]) latestData[robotId] = { last_seen: 0, topics: {} };
+        robotStatus[robotId] = 'waiting';
+        populateRobotSelector();
+        updateRobotStatusUI();
+    });
+
+    socket.on('robot_removed', (data) => {
+        // The server evicted a robot that stayed silent longer than its idle TTL
+        const robotId = data?.robot_id;
+        if (!robotId || !knownRobots.includes(robotId)) return;
+        log.info(`Robot removed: ${robotId}`);
+        knownRobots = knownRobots.filter(id => id !== robotId);
+        delete latestData[robotId];
+        delete robotStatus[robotId];
+        staleTopics.forEach(key => { if (key.startsWith(`${robotId}/`)) staleTopics.delete(key); });
+        Object.keys(topicSeq).forEach(key => { if (key.startsWith(`${robotId}/`)) delete topicSeq[key]; });
+        populateRobotSelector(); // Deselects the robot if it was selected
+        updateRobotStatusUI();
     });
 
+    // --- Presence Events ---
+    socket.on('robot_online', (data) => setRobotStatus(data?.robot_id, 'online'));
+    socket.on('robot_offline', (data) => setRobotStatus(data?.robot_id, 'offline'));
+    socket.on('topic_stale', (data) => {
+        if (data?.robot_id && data?.sub_topic) setTopicStale(data.robot_id, data.sub_topic, !!data.stale);
+    });
+
+    socket.on('topic_update', (data) => {
+        // Payload-less notice for topics this client is not subscribed to (keeps status/topic list fresh)
+        const { robot_id, sub_topic, timestamp, robot_last_seen } = data || {};
+        if (!robot_id || !sub_topic || !knownRobots.includes(robot_id)) return;
+        const isNewTopic = !latestData[robot_id]?.topics?.[sub_topic];
+        noteRobotSeen(robot_id, robot_last_seen);
+        if (isNewTopic) {
+            latestData[robot_id].topics = latestData[robot_id].topics || {};
+            latestData[robot_id].topics[sub_topic] = { payload: "waiting...", timestamp: 0 };
+            if (robot_id === selectedRobot) populateTopicList(robot_id);
+        } else if (latestData[robot_id].topics[sub_topic].stale) {
+            delete latestData[robot_id].topics[sub_topic].stale; // A live message replaced the restored entry
+            if (robot_id === selectedRobot) populateTopicList(robot_id);
+        }
+        log.debug(`topic_update: ${robot_id}/${sub_topic} at ${timestamp}`);
+    });
 
     socket.on('command_feedback', (data) => {
         // Display feedback messages from the server after sending commands
         log.debug("Command feedback received from server:", data);
         if (data?.message) {
-            showCommandFeedback(data.status || 'info', data.message);
+            const latencyText = typeof data.latency_ms === 'number' ? ` (${data.latency_ms} ms)` : '';
+            showCommandFeedback(data.status || 'info', data.message + latencyText);
         }
     });
 
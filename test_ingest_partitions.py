@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Partitioned ingestion against the local broker stand-in (mqtt_broker.py).
+
+Runs a PartitionSupervisor whose children are real `python app.py` partitions connected to an
+in-process Broker, publishes robot_status rounds and checks on the mirrored partition buses that:
+
+    - every message is ingested by exactly one partition (shared and hash mode)
+    - in hash mode each robot is owned by partition_for(robot, live), as PartitionFilter decides
+    - when a partition dies its robots move to the others, and traffic reaches it again once
+      the supervisor has restarted it
+
+    python -m unittest test_ingest_partitions
+"""
+import collections
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import msgpack
+import paho.mqtt.client as mqtt
+
+from ingest_partitions import PartitionFilter, PartitionSupervisor, partition_for
+from mqtt_broker import Broker
+
+PARTITIONS = 3
+ROBOTS = [f"part_robot_{i}" for i in range(12)]
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+
+def wait_for(condition, timeout=20.0, interval=0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return condition()
+
+
+class PartitionedIngestTest:
+    """Shared scenario; subclasses set MODE."""
+    MODE = None
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='aa_partitions_')
+        self.broker = Broker('127.0.0.1', 0).start()
+        self.ingested = collections.defaultdict(list) # (robot_id, round) -> [partition index]
+        self.lock = threading.Lock()
+        self.supervisor = PartitionSupervisor(
+            PARTITIONS, f"unix://{self.tmp}/partition_{{index}}.sock", self._on_partition_message, self.MODE,
+            script=APP_SCRIPT, health_interval=0.3, stall_timeout=10.0, restart_delay=0.5,
+            env={'MQTT_HOST': '127.0.0.1', 'MQTT_PORT': str(self.broker.port), 'KNOWN_ROBOTS': '',
+                 'MQTT_RECONNECT_MIN': '0.2', 'MQTT_RECONNECT_MAX': '1', 'SNAPSHOT_PATH': '', 'MQTT_RECORD_PATH': ''})
+        self.publisher = mqtt.Client(client_id='partition_test_publisher')
+        self.publisher.connect('127.0.0.1', self.broker.port)
+        self.publisher.loop_start()
+        self.supervisor.start()
+
+    def tearDown(self):
+        self.publisher.loop_stop()
+        self.publisher.disconnect()
+        self.supervisor.stop()
+        self.broker.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _on_partition_message(self, index, message):
+        if message[0] != 'topic' or message[2] != 'robot_status':
+            return # Bus snapshots repeat entries already counted
+        payload = message[3]['payload']
+        with self.lock:
+            self.ingested[(message[1], payload['round'])].append(index)
+
+    def _subscribed_partitions(self):
+        return sum(1 for client_id, client in self.broker.stats()['clients'].items()
+                   if '_p' in client_id and client['subscriptions'])
+
+    def _wait_ready(self, live):
+        self.assertTrue(wait_for(lambda: sorted(self.supervisor.live()) == sorted(live)), self.supervisor.stats())
+        self.assertTrue(wait_for(lambda: self._subscribed_partitions() == len(live)), self.broker.stats())
+        time.sleep(1.0) # Let the live set reach every partition filter
+
+    def _publish_round(self, round_number):
+        for robot_id in ROBOTS:
+            self.publisher.publish(f"{robot_id}/r2s/robot_status", msgpack.packb({'round': round_number, 'robot': robot_id}))
+            time.sleep(0.02) # One message at a time per robot in the decode queue
+        self.assertTrue(wait_for(lambda: all((r, round_number) in self.ingested for r in ROBOTS), 10.0),
+                        f"round {round_number} incomplete: {self._owners(round_number)}")
+        time.sleep(0.5) # A duplicate from a second partition would arrive by now
+        owners = self._owners(round_number)
+        for robot_id, indexes in owners.items():
+            self.assertEqual(len(indexes), 1, f"{robot_id} ingested by partitions {indexes} in round {round_number}")
+        return {robot_id: indexes[0] for robot_id, indexes in owners.items()}
+
+    def _owners(self, round_number):
+        with self.lock:
+            return {robot_id: list(self.ingested.get((robot_id, round_number), ())) for robot_id in ROBOTS}
+
+    def _check_ownership(self, owners, live):
+        if self.MODE == 'hash':
+            for robot_id, index in owners.items():
+                self.assertEqual(index, partition_for(robot_id, live), robot_id)
+        self.assertTrue(set(owners.values()) <= set(live), owners)
+
+    def test_ingested_once_and_rebalanced_on_failure(self):
+        everyone = list(range(PARTITIONS))
+        self._wait_ready(everyone)
+        owners = self._publish_round(0)
+        self._check_ownership(owners, everyone)
+        self.assertEqual(set(owners.values()), set(everyone), "Every partition should take part")
+
+        victim = 1
+        restarts = self.supervisor.stats()['partitions'][victim]['restarts']
+        self.supervisor.partitions[victim].proc.kill()
+        survivors = [index for index in everyone if index != victim]
+        self.assertTrue(wait_for(lambda: self.supervisor.live() == survivors, 10.0), self.supervisor.stats())
+        time.sleep(1.0)
+        owners = self._publish_round(1)
+        self._check_ownership(owners, survivors)
+        if self.MODE == 'hash': # Rendezvous hashing: only the victim's robots move
+            for robot_id, index in self._owners(0).items():
+                if index[0] != victim:
+                    self.assertEqual(owners[robot_id], index[0], robot_id)
+
+        self._wait_ready(everyone)
+        self.assertGreater(self.supervisor.stats()['partitions'][victim]['restarts'], restarts)
+        owners = self._publish_round(2)
+        self._check_ownership(owners, everyone)
+        self.assertIn(victim, owners.values(), "The restarted partition should ingest again")
+
+
+class SharedModeTest(PartitionedIngestTest, unittest.TestCase):
+    MODE = 'shared'
+
+
+class HashModeTest(PartitionedIngestTest, unittest.TestCase):
+    MODE = 'hash'
+
+
+class PartitionFilterTest(unittest.TestCase):
+    def test_filters_split_robots_between_live_partitions(self):
+        filters = [PartitionFilter(index, PARTITIONS) for index in range(PARTITIONS)]
+        for robot_id in ROBOTS:
+            self.assertEqual(sum(f.owns(robot_id) for f in filters), 1, robot_id)
+        for f in filters:
+            f.set_live([0, 2])
+        self.assertFalse(any(filters[1].owns(robot_id) for robot_id in ROBOTS))
+        for robot_id in ROBOTS:
+            self.assertEqual(filters[0].owns(robot_id) + filters[2].owns(robot_id), 1, robot_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Sampled per-message tracing for the ingest pipeline, driven by runtime rules.
+
+A rule selects messages by robot and sub_topic glob and traces one in every `sample`
+matches. Without rules `Tracer.start` is a single attribute check, so untraced messages
+pay nothing. A traced message carries a Trace through the pipeline, and each stage adds a
+timing span (receive, queue, decode, convert, store, emit) and optional events. Events
+keep their format string and a short summary of each argument. The text is only
+formatted when the trace is read, and a summary never walks image or scan data.
+The most recent traces are kept in a ring buffer:
+
+    trace = tracer.start(robot_id, sub_topic)   # None unless a rule samples this message
+    if trace:
+        trace.event("decoded %s", payload)      # payload summarized as keys/types/lengths
+        trace.add_span('decode', started)
+"""
+import collections
+import fnmatch
+import itertools
+import threading
+import time
+
+SUMMARY_MAX_KEYS = 20
+SUMMARY_MAX_CHARS = 80
+
+
+def summarize(value, depth=0):
+    """Short structural description of a payload value; cost does not grow with data size."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{type(value).__name__}[{len(value)}]>"
+    if isinstance(value, str):
+        return value if len(value) <= SUMMARY_MAX_CHARS else value[:SUMMARY_MAX_CHARS] + '…'
+    if isinstance(value, (list, tuple)):
+        return f"<{type(value).__name__}[{len(value)}]>"
+    if isinstance(value, dict):
+        if depth:
+            return f"<dict[{len(value)}]>"
+        items = list(itertools.islice(value.items(), SUMMARY_MAX_KEYS))
+        summary = {str(k): summarize(v, depth + 1) for k, v in items}
+        if len(value) > SUMMARY_MAX_KEYS:
+            summary['…'] = f"{len(value) - SUMMARY_MAX_KEYS} more keys"
+        return summary
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return f"<{type(value).__name__}>"
+
+
+class TraceRule:
+    __slots__ = ('rule_id', 'robot', 'topic', 'sample', 'log', 'created', 'matched', 'sampled')
+
+    def __init__(self, rule_id, robot='*', topic='*', sample=1, log=False):
+        self.rule_id = rule_id
+        self.robot = robot
+        self.topic = topic
+        self.sample = max(1, int(sample))
+        self.log = bool(log)
+        self.created = time.time()
+        self.matched = 0
+        self.sampled = 0
+
+    def matches(self, robot_id, sub_topic):
+        return fnmatch.fnmatchcase(robot_id, self.robot) and fnmatch.fnmatchcase(sub_topic, self.topic)
+
+    def to_dict(self):
+        return {'id': self.rule_id, 'robot': self.robot, 'topic': self.topic, 'sample': self.sample,
+                'log': self.log, 'created': self.created, 'matched': self.matched, 'sampled': self.sampled}
+
+
+class Trace:
+    """Spans and events of one message. Times are milliseconds since the message was received."""
+    __slots__ = ('trace_id', 'robot_id', 'sub_topic', 'rule_id', 'log', 'wall_time', 'origin', 'spans', 'events')
+
+    def __init__(self, trace_id, robot_id, sub_topic, rule, origin=None):
+        self.trace_id = trace_id
+        self.robot_id = robot_id
+        self.sub_topic = sub_topic
+        self.rule_id = rule.rule_id
+        self.log = rule.log
+        self.wall_time = time.time()
+        self.origin = time.perf_counter() if origin is None else origin
+        self.spans = [] # (stage, start offset s, duration s, attrs)
+        self.events = [] # (offset s, format, summarized args)
+
+    def add_span(self, stage, started, ended=None, **attrs):
+        """Record a stage from perf_counter() `started` to `ended` (default: now)."""
+        ended = time.perf_counter() if ended is None else ended
+        self.spans.append((stage, started - self.origin, ended - started, attrs))
+
+    def event(self, fmt, *args):
+        self.events.append((time.perf_counter() - self.origin, fmt, tuple(summarize(arg) for arg in args)))
+
+    def to_dict(self):
+        events = []
+        for offset, fmt, args in self.events:
+            try:
+                message = fmt % args if args else fmt
+            except (TypeError, ValueError):
+                message = f"{fmt} {args}"
+            events.append({'at_ms': round(offset * 1000, 3), 'message': message})
+        return {
+            'id': self.trace_id, 'robot_id': self.robot_id, 'sub_topic': self.sub_topic, 'rule': self.rule_id,
+            'time': self.wall_time,
+            'spans': [{'stage': stage, 'start_ms': round(start * 1000, 3), 'duration_ms': round(duration * 1000, 3), **attrs}
+                      for stage, start, duration, attrs in list(self.spans)],
+            'events': events,
+        }
+
+    def __str__(self):
+        spans = ' '.join(f"{stage}={duration * 1000:.2f}ms" for stage, _, duration, _ in list(self.spans))
+        events = '; '.join(event['message'] for event in self.to_dict()['events'])
+        return f"trace {self.trace_id} {self.robot_id}/{self.sub_topic}: {spans}" + (f" | {events}" if events else '')
+
+
+class Tracer:
+    """Trace rules plus a ring buffer of the most recent sampled traces."""
+
+    def __init__(self, capacity=1000):
+        self.rules = [] # Copy-on-write: replaced, never mutated, so start() can read it without a lock
+        self.buffer = collections.deque(maxlen=capacity)
+        self.match_cache = {} # (robot_id, sub_topic) -> TraceRule or None, reset with the rules
+        self.handoffs = {} # key -> (token, trace) waiting for a later, decoupled stage (e.g. a coalesced emit)
+        self.lock = threading.Lock()
+        self._rule_ids = itertools.count(1)
+        self._trace_ids = itertools.count(1)
+
+    def add_rule(self, robot='*', topic='*', sample=1, log=False):
+        with self.lock:
+            rule = TraceRule(next(self._rule_ids), robot or '*', topic or '*', sample, log)
+            self.rules = self.rules + [rule]
+            self.match_cache = {}
+        return rule
+
+    def remove_rule(self, rule_id=None):
+        """Remove one rule, or every rule if rule_id is None. Returns the number removed."""
+        with self.lock:
+            kept = [rule for rule in self.rules if rule_id is not None and rule.rule_id != rule_id]
+            removed = len(self.rules) - len(kept)
+            self.rules = kept
+            self.match_cache = {}
+        return removed
+
+    def start(self, robot_id, sub_topic, received=None):
+        """A new Trace if a rule matches and samples this message, else None.
+
+        `received` is the perf_counter() time the message arrived (default: now).
+        """
+        if not self.rules:
+            return None
+        key = (robot_id, sub_topic)
+        try:
+            rule = self.match_cache[key]
+        except KeyError:
+            rule = self.match_cache[key] = next((r for r in self.rules if r.matches(robot_id, sub_topic)), None)
+        if rule is None:
+            return None
+        rule.matched += 1
+        if (rule.matched - 1) % rule.sample:
+            return None
+        rule.sampled += 1
+        trace = Trace(next(self._trace_ids), robot_id, sub_topic, rule, received)
+        self.buffer.append(trace) # Visible while in flight; later stages keep adding spans
+        return trace
+
+    def hand_off(self, key, token, trace):
+        """Park a trace for the stage that will process `token` (e.g. an entry timestamp) under `key`."""
+        self.handoffs[key] = (token, trace)
+
+    def take(self, key, token):
+        """The trace parked for this key and token, if any. A newer hand-off replaces an older one."""
+        if not self.handoffs:
+            return None
+        parked = self.handoffs.get(key)
+        if parked is None or parked[0] != token:
+            return None
+        del self.handoffs[key]
+        return parked[1]
+
+    def forget_robot(self, robot_id):
+        for key in [key for key in self.handoffs if key[0] == robot_id]:
+            self.handoffs.pop(key, None)
+
+    def recent(self, robot_id=None, sub_topic=None, limit=100):
+        """Newest first, optionally filtered by exact robot_id / sub_topic."""
+        result = []
+        for trace in reversed(list(self.buffer)):
+            if (robot_id is None or trace.robot_id == robot_id) and (sub_topic is None or trace.sub_topic == sub_topic):
+                result.append(trace.to_dict())
+                if len(result) >= limit:
+                    break
+        return result
+
+    def stats(self):
+        return {'rules': [rule.to_dict() for rule in self.rules], 'buffered': len(self.buffer),
+                'capacity': self.buffer.maxlen, 'pending_handoffs': len(self.handoffs)}